@@ -1,15 +1,34 @@
 """
 Module for ARIMA modeling.
 
+Functions:
+    daily_totals: sums and counts raw measurements per metric and day in a
+    single pass
+
+    daily_frame: creates the daily flow rate and exogenous predictor frame
+    from daily totals
+
 Classes:
     Arima: contains functions to retrieve data and build ARIMA model
     for given river run
         Functions:
             get_data: retrieves needed data for selected run
 
-            daily_avg: takes time series with measurements on different
-            timeframes and creates a dataframe with daily averages for
-            flow rate and exogenous predictors
+            get_daily_data: retrieves the daily rollup of measurements
+            for selected run
+
+            daily_avg: combines the daily rollup into a dataframe with daily
+            averages for flow rate and exogenous predictors
+
+            daily_avg_for_runs: daily_avg for several runs, reading each
+            station's rollup once
+
+            select_order: returns the cached ARIMA order for a run,
+            re-selecting it once the cache is older than the selection
+            interval
+
+            fit_model: fits the ARIMA model for a run, warm-started from
+            the run's previously fitted parameters
 
             arima_model: creates flow rate predictions using statsmodel
             package functions
@@ -19,11 +38,83 @@ Classes:
 """
 
 import datetime
+import numpy as np
 import pandas as pd
+from sqlalchemy.exc import SQLAlchemyError
 from statsmodels.tsa.arima_model import ARIMA
 from statsmodels.tsa.stattools import arma_order_select_ic
+from riverrunner.context import ModelOrder, ModelParameters
 from riverrunner.repository import Repository
 
+"""days a selected model order is reused before it is selected again"""
+ORDER_SELECTION_INTERVAL = 7
+
+"""model column name and daily aggregation for each metric, in column order"""
+DAILY_METRICS = [
+    ('00001', 'temp', 'mean'),
+    ('00060', 'flow', 'mean'),
+    ('00003', 'precip', 'sum'),
+]
+
+
+def daily_totals(time_series):
+    """Sums and counts raw measurements per metric and day
+
+    Timestamps are parsed once and all metrics are grouped in a single
+    pass.
+
+    Args:
+        time_series (DataFrame): measurements, assumes output from
+        Repository.get_measurements
+
+    Returns:
+        DataFrame: value_sum and value_count indexed by metric_id and day
+    """
+    day = pd.to_datetime(time_series['date_time'], utc=True).dt.floor('D')
+    day.name = 'day'
+
+    totals = time_series['value'] \
+        .groupby([time_series['metric_id'], day]) \
+        .agg(['sum', 'count'])
+    totals.columns = ['value_sum', 'value_count']
+    return totals
+
+
+def daily_frame(totals):
+    """Creates the daily temp, flow and precip frame from daily totals
+
+    Precipitation is totalled per day, other metrics are averaged. Days
+    without values inside a metric's range are kept as NaN (0 for
+    precipitation) and only days present for every metric are returned.
+
+    Args:
+        totals (DataFrame): value_sum and value_count indexed by metric_id
+        and day, as returned by daily_totals
+
+    Returns:
+        DataFrame: containing daily measurements
+    """
+    columns = []
+    for metric_id, name, how in DAILY_METRICS:
+        if metric_id in totals.index.get_level_values('metric_id'):
+            metric = totals.xs(metric_id, level='metric_id')
+        else:
+            metric = pd.DataFrame(columns=['value_sum', 'value_count'],
+                                  index=pd.DatetimeIndex([], tz='UTC'))
+
+        if how == 'sum':
+            daily = metric['value_sum'].astype(float).resample('D').sum()
+        else:
+            daily = (metric['value_sum'] / metric['value_count'])\
+                .astype(float).resample('D').mean()
+
+        daily.name = name
+        columns.append(daily)
+
+    time_series_daily = pd.concat(columns, axis=1, join='inner')
+    time_series_daily.index.name = 'date_time'
+    return time_series_daily
+
 
 class Arima:
     """
@@ -31,9 +122,21 @@ class Arima:
 
     Args:
         session: (Session) db session
+        order_interval: (int) optional days a cached model order is reused
+        from_raw: (bool) optional, aggregate the daily data from raw
+        measurements in the database instead of reading the daily rollup,
+        for measurements written without maintaining the rollup
+
+    Attributes:
+        fit_stats (dict): keyed by run id, the order, optimizer iterations
+        and whether the last fit of the run was warm-started
     """
-    def __init__(self, session):
+    def __init__(self, session, order_interval=ORDER_SELECTION_INTERVAL,
+                 from_raw=False):
         self.repo = Repository(session)
+        self.order_interval = datetime.timedelta(days=order_interval)
+        self.from_raw = from_raw
+        self.fit_stats = {}
 
     def get_data(self, run_id, metric_ids=None):
         """Retrieves data for selected run from database for past four years
@@ -56,69 +159,231 @@ class Arima:
                                                    metric_ids=metric_ids)
         return test_measures
 
-    def daily_avg(self, run_id):
+    def get_daily_data(self, run_id, metric_ids=None):
+        """Retrieves the daily rollup for selected run from database for
+        past four years from current date using
+        Repository.get_daily_measurements function.
+
+        Args:
+            run_id (int): id of run for which model will be created
+            metric_ids ([str]) - optional: list of metric ids to include
+
+        Returns:
+            DataFrame: containing four years of daily sums, means and counts
+            up to current date for the given run
+        """
+        return self.get_daily_data_for_runs([run_id], metric_ids)[run_id]
+
+    def get_daily_data_for_runs(self, run_ids, metric_ids=None):
+        """Retrieves the daily rollup for several runs from database for
+        past four years from current date, reading each station once using
+        Repository.get_daily_measurements_for_runs function. With from_raw
+        the same frames are aggregated from raw measurements by
+        Repository.get_measurements_for_runs.
+
+        Args:
+            run_ids ([int]): ids of runs for which models will be created
+            metric_ids ([str]) - optional: list of metric ids to include
+
+        Returns:
+            {int: DataFrame}: four years of daily sums, means and counts up
+            to current date keyed by run id
+        """
+        now = datetime.datetime.now()
+        end = datetime.datetime(now.year, now.month, now.day)
+        start = end - datetime.timedelta(days=4*365)
+        if self.from_raw:
+            # daily sums and counts give the rollup's value_sum and
+            # value_count, means are taken after combining stations
+            daily_measures = self.repo.get_measurements_for_runs(
+                run_ids=run_ids,
+                start_date=start,
+                end_date=end,
+                metric_ids=metric_ids,
+                resolution='day',
+                aggregates='sum')
+            return {run_id: df.rename(columns={'date_time': 'day',
+                                               'value': 'value_sum'})
+                    for run_id, df in daily_measures.items()}
+
+        daily_measures = self.repo.get_daily_measurements_for_runs(
+            run_ids=run_ids,
+            start_date=start,
+            end_date=end,
+            metric_ids=metric_ids)
+        return daily_measures
+
+    def daily_avg(self, run_id, daily=None):
         """Creates dataframe needed for modelling
 
-        Calls Arima.get_data to retrieve measurements for given run and
-        creates a dataframe with daily averages for flow rate and exogenous
-        predictors.
+        Calls Arima.get_daily_data to retrieve the daily rollup for given
+        run and creates a dataframe with daily averages for flow rate and
+        temperature, and daily totals for precipitation.
 
         Args:
             run_id (int): id of run for which model will be created
+            daily (DataFrame) - optional: the run's daily rollup, retrieved
+            if not supplied
 
         Returns:
             DataFrame: containing daily measurements
         """
-        time_series = self.get_data(run_id=run_id,
-                                    metric_ids=['00003', '00060', '00001'])
-        if len(time_series) == 0:
+        if daily is None:
+            daily = self.get_daily_data(run_id=run_id,
+                                        metric_ids=[m[0] for m in DAILY_METRICS])
+        if len(daily) == 0:
             return None
 
-        precip = time_series[time_series.metric_id == '00003']
-        precip['date_time'] = pd.to_datetime(precip['date_time'], utc=True)
-        precip.index = precip['date_time']
-        precip_daily = precip.resample('D').sum()
-
-        flow = time_series[time_series.metric_id == '00060']
-        flow['date_time'] = pd.to_datetime(flow['date_time'], utc=True)
-        flow.index = flow['date_time']
-        flow_daily = flow.resample('D').mean()
-
-        temp = time_series[time_series.metric_id == '00001']
-        temp['date_time'] = pd.to_datetime(temp['date_time'], utc=True)
-        temp.index = temp['date_time']
-        temp_daily = temp.resample('D').mean()
-
-        time_series_daily = temp_daily\
-            .merge(flow_daily,
-                   how='inner',
-                   left_index=True,
-                   right_index=True) \
-            .merge(precip_daily,
-                   how='inner',
-                   left_index=True,
-                   right_index=True)
-        time_series_daily.columns = ['temp', 'flow', 'precip']
-        time_series_daily = time_series_daily.dropna()
-        return time_series_daily
-
-    def arima_model(self, run_id):
+        # combine stations reporting the same metric on the same day
+        daily = daily.assign(day=pd.to_datetime(daily['day'], utc=True))
+        totals = daily.groupby(['metric_id', 'day'])[
+            ['value_sum', 'value_count']].sum()
+
+        return daily_frame(totals).dropna()
+
+    def daily_avg_for_runs(self, run_ids):
+        """Creates the modelling dataframes for several runs
+
+        Retrieves the daily rollup of every run in one pass with
+        Arima.get_daily_data_for_runs, then applies Arima.daily_avg to each.
+
+        Args:
+            run_ids ([int]): ids of runs for which models will be created
+
+        Returns:
+            {int: DataFrame}: daily measurements keyed by run id
+        """
+        daily = self.get_daily_data_for_runs(
+            run_ids, metric_ids=[m[0] for m in DAILY_METRICS])
+        return {run_id: self.daily_avg(run_id, daily[run_id])
+                for run_id in run_ids}
+
+    def select_order(self, run_id, flow, refresh=False):
+        """Returns the (p, q) order used to model a run.
+
+        The order chosen by arma_order_select_ic is cached per run and
+        reused until it is older than the selection interval, so the grid
+        search only runs once per interval instead of every night.
+
+        Args:
+            run_id (int): id of run for which model will be created
+            flow (Series): daily flow rates used to select the order
+            refresh (bool): optional, select a new order even if the cached
+            one is still current
+
+        Returns:
+            (int, int): number of autoregressive and moving average terms
+
+        Raises:
+            ValueError: if order selection does not converge
+        """
+        now = datetime.datetime.now()
+
+        if not refresh:
+            cached = self.repo.get_model_order(run_id)
+            if cached is not None and now - cached.selected < self.order_interval:
+                return cached.order
+
+        params = arma_order_select_ic(flow, ic='aic')
+        order = ModelOrder(
+            run_id=run_id,
+            ar_order=int(params.aic_min_order[0]),
+            ma_order=int(params.aic_min_order[1]),
+            selected=now
+        )
+
+        try:
+            self.repo.put_model_order(order)
+        except SQLAlchemyError:
+            # a failed cache write only costs a re-selection next time
+            pass
+
+        return order.order
+
+    def fit_model(self, run_id, measures, order):
+        """Fits the ARIMA model for a run.
+
+        The parameters fitted for the same run and order on the previous
+        run are used as start parameters. If there are none, or the warm
+        start fails to converge, the model is fit from a cold start. The
+        fitted parameters are stored for the next fit and the optimizer
+        iterations are recorded in Arima.fit_stats.
+
+        Args:
+            run_id (int): id of run for which model will be created
+            measures (DataFrame): daily measurements from Arima.daily_avg
+            order ((int, int)): number of autoregressive and moving average
+            terms
+
+        Returns:
+            ARMAResults: the fitted model
+        """
+        p, q = order
+
+        def build():
+            return ARIMA(measures['flow'],
+                         order=(p, 0, q),
+                         exog=measures[['temp', 'precip']])
+
+        mod = None
+        cached = self.repo.get_model_parameters(run_id, p, q)
+        if cached is not None:
+            try:
+                mod = build().fit(start_params=np.asarray(cached.params))
+                if not mod.mle_retvals.get('converged', True):
+                    mod = None
+            except Exception:
+                mod = None
+
+        warm_start = mod is not None
+        if mod is None:
+            mod = build().fit()
+
+        iterations = mod.mle_retvals.get('iterations')
+        self.fit_stats[run_id] = {
+            'order': order,
+            'iterations': iterations,
+            'warm_start': warm_start
+        }
+
+        try:
+            self.repo.put_model_parameters(ModelParameters(
+                run_id=run_id,
+                ar_order=p,
+                ma_order=q,
+                params=[float(x) for x in mod.params],
+                iterations=iterations,
+                fitted=datetime.datetime.now()
+            ))
+        except SQLAlchemyError:
+            # the next fit falls back to a cold start
+            pass
+
+        return mod
+
+    def arima_model(self, run_id, refresh_order=False, measures=None):
         """Creates flow rate predictions using ARIMA model.
 
         Calls Arima.daily_avg to retrieve data for given run, then creates
-        flow rate predictions by using statsmodels functions
-        arma_order_select_ic and ARIMA. Three weeks of past flow rate data
-        are also returned for plotting purposes.
+        flow rate predictions by using the cached model order (see
+        Arima.select_order) and a warm-started statsmodels ARIMA (see
+        Arima.fit_model). Three weeks of past flow rate data are also
+        returned for plotting purposes.
 
         Args:
             run_id (int): id of run for which model will be created
+            refresh_order (bool): optional, re-select the model order even
+            if the cached one is still current
+            measures (DataFrame): optional, daily measurements from
+            Arima.daily_avg, retrieved if not supplied
 
         Returns:
             DataFrame: containing time-series flow rate predictions for next
             7 days and historical flow rate for past 21 days
         """
         # Retrieve data for modelling
-        measures = self.daily_avg(run_id)
+        if measures is None:
+            measures = self.daily_avg(run_id)
 
         # don't try to compute if there aren't any measures
         if measures is None:
@@ -133,13 +398,11 @@ class Arima:
 
         try:
             # Find optimal order for model
-            params = arma_order_select_ic(measures['flow'], ic='aic')
+            p, q = self.select_order(run_id, measures['flow'],
+                                     refresh=refresh_order)
             try:
                 # Build and fit model
-                mod = ARIMA(measures['flow'],
-                            order=(params.aic_min_order[0], 0,
-                                   params.aic_min_order[1]),
-                            exog=measures[['temp', 'precip']]).fit()
+                mod = self.fit_model(run_id, measures, (p, q))
 
                 prediction = pd.DataFrame(
                     [mod.forecast(steps=7,
@@ -1,8 +1,29 @@
 """
 Module for mapping the ORM context to Python classes.
 
+Functions:
+    get_engine: returns the process-wide engine and connection pool for a database, creating it on first use
+
+    index_measurement_table: adds the composite and BRIN measurement indexes to an existing database
+
+    compact_measurement_table: copies measurements into the compact layout keyed by small integer station and metric
+    keys and creates the view the repository reads it through
+
+    partition_measurement_table: migrates the measurement table to monthly or yearly range partitions on date_time.
+    create_measurement_partitions and detach_measurement_partitions add and remove partitions, the repository calls
+    the former whenever measurements are added
+
+Examples:
+    python context.py --partition [month | year]
+
+    * migrates the measurement table of settings.DATABASE to range partitions, monthly by default
+
+    python context.py --detach-partitions before-date [--drop]
+
+    * detaches the measurement partitions ending on or before before-date, 'YYYY-MM-DD', and optionally drops them
+
 Classes:
-    Context: generates a database engine and contains a mangaged database connection through the Session object.
+    Context: uses the shared database engine and contains a mangaged database connection through the Session object.
         A connection string must be provided and in the following format:
 
         DATABASE = {
@@ -18,15 +39,22 @@ Classes:
         context initialization.
 
     ORM Classes: map objects their respective type to their associated database tables. See the design
-    specification for more detailed information. Mapped objects defined below are: Address, Measurement,
-    Metric, Prediction, RiverRun, State, Station, StationRiverDistance, and TmpMeasurement.
+    specification for more detailed information. Mapped objects defined below are: Address, CompactMeasurement,
+    DailyMeasurement, IngestWatermark, Measurement, MeasurementRetention, Metric, MetricKey, ModelOrder,
+    ModelParameters, Prediction, RiverRun, State, Station, StationKey, StationRiverDistance, and TmpMeasurement.
 """
 
 
 import datetime
+import os
+import re
+import sys
+import threading
+from riverrunner import measurement_cache
 from sqlalchemy import create_engine, select
 from sqlalchemy.engine.url import URL
-from sqlalchemy import Column, Integer, String, Float, DateTime, Index, ForeignKey, ForeignKeyConstraint
+from sqlalchemy import Column, Integer, SmallInteger, String, Float, DateTime, Index, ForeignKey, ForeignKeyConstraint
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import relationship, sessionmaker
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
@@ -36,6 +64,62 @@ from sqlalchemy.ext.hybrid import hybrid_property
 Base = declarative_base()
 
 
+"""size of the connection pool kept by each engine"""
+POOL_SIZE = 5
+
+"""connections an engine may open beyond its pool size under load"""
+MAX_OVERFLOW = 10
+
+"""test pooled connections for liveness before handing them out"""
+POOL_PRE_PING = True
+
+"""composite index matching the repository's station, metric and date range reads of measurements"""
+MEASUREMENT_INDEX = 'idx_measurement_station_metric_date_time'
+
+"""block range index on measurement date_time, small because measurements arrive roughly in time order"""
+MEASUREMENT_BRIN_INDEX = 'idx_measurement_date_time_brin'
+
+"""presents compact_measurement with the string station and metric ids of the measurement table"""
+COMPACT_MEASUREMENT_VIEW = 'compact_measurement_view'
+
+"""engines keyed by process id and connection url, see get_engine"""
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def get_engine(connection_string, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_pre_ping=POOL_PRE_PING):
+    """get the process-wide engine for a database
+
+    engines, and with them their connection pools, are created once per process and database. the tables are
+    created or updated the first time an engine is created. pool settings only apply to that first call.
+
+    Args:
+        connection_string (dict): must contain {drivername,host,port,username,paassword,database}
+        pool_size (int): optional number of connections kept in the pool
+        max_overflow (int): optional number of connections allowed beyond the pool size
+        pool_pre_ping (bool): optional, test connections for liveness when they are checked out
+
+    Returns:
+        Engine: the shared engine
+    """
+    url = URL(**connection_string)
+
+    # forked processes must not share their parent's pooled connections
+    key = (os.getpid(), str(url))
+
+    with _ENGINES_LOCK:
+        engine = _ENGINES.get(key)
+        if engine is None:
+            engine = create_engine(url,
+                                   pool_size=pool_size,
+                                   max_overflow=max_overflow,
+                                   pool_pre_ping=pool_pre_ping)
+            Base.metadata.create_all(engine)
+            _ENGINES[key] = engine
+
+    return engine
+
+
 class Context(object):
     """generate a managed session with the database
 
@@ -43,25 +127,26 @@ class Context(object):
         Session (sqlalchemy.orm.sessionmaker): managed connection to database. `see more <http://docs.sqlalchemy.org/en/latest/orm/session.html>`_.
     """
 
-    def __init__(self, connection_string):
+    def __init__(self, connection_string, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                 pool_pre_ping=POOL_PRE_PING):
         """initialize the connection
 
+        the engine is shared with every other context of the same database in this process, see get_engine
+
         Args:
             connection_string (dict): must contain {drivername,host,port,username,paassword,database}
+            pool_size (int): optional number of connections kept in the pool
+            max_overflow (int): optional number of connections allowed beyond the pool size
+            pool_pre_ping (bool): optional, test connections for liveness when they are checked out
         """
-
-        self.__engine = create_engine(URL(**connection_string))
-
-        self.Session = sessionmaker()
-        self.Session.configure(bind=self.__engine)
-
         try:
-            s = self.Session()
+            self.__engine = get_engine(connection_string, pool_size, max_overflow, pool_pre_ping)
         except OperationalError:
             print("Unable to connect to destination db")
             exit(101)
 
-        Base.metadata.create_all(self.__engine)
+        self.Session = sessionmaker()
+        self.Session.configure(bind=self.__engine)
 
 
 class Address(Base):
@@ -99,6 +184,140 @@ class Address(Base):
         return '%s, %s, %s' % (self.address, self.city, self.state)
 
 
+class CompactMeasurement(Base):
+    """ORM mapping for measurements in the compact layout
+
+    the same measurements as Measurement keyed by small integer station and metric keys instead of their string ids,
+    roughly halving the size of the table and its key. read through COMPACT_MEASUREMENT_VIEW, see
+    compact_measurement_table.
+
+    Attributes:
+        station_key (int): reference to the key of the weather station that gathered the measurement
+        metric_key (int): reference to the key of the metric gathered
+        date_time (DateTime): timestamp for when the measurement was taken
+        value (float): the value recorded, single precision after compact_measurement_table(float4=True)
+    """
+    __tablename__ = 'compact_measurement'
+
+    station_key = Column(ForeignKey('station_key.station_key'), primary_key=True)
+    metric_key = Column(ForeignKey('metric_key.metric_key'), primary_key=True)
+    date_time = Column(DateTime, primary_key=True)
+
+    value = Column(Float)
+
+    def __repr__(self):
+        return f'<CompactMeasurement(station_key="{self.station_key}", datetime="{self.date_time}", ' \
+               f'metric_key="{self.metric_key}")>'
+
+    def __str__(self):
+        return 'station_key: %s, datetime: %s, metric_key: %s' % \
+               (self.station_key, self.date_time, self.metric_key)
+
+
+class DailyMeasurement(Base):
+    """ORM mapping for the daily rollup of measurements
+
+    rows are maintained by the repository whenever measurements are added
+
+    Attributes:
+        station_id (str): reference to the weather station that gathered the measurements
+        metric_id (str): reference to the metric gathered
+        day (DateTime): midnight of the day summarized
+        value_sum (float): sum of the day's values
+        value_mean (float): mean of the day's values
+        value_count (int): number of values recorded that day
+    """
+    __tablename__ = 'daily_measurement'
+
+    station_id = Column(ForeignKey('station.station_id'), primary_key=True)
+    station = relationship('Station')
+
+    metric_id = Column(ForeignKey('metric.metric_id'), primary_key=True)
+    metric    = relationship('Metric')
+
+    day = Column(DateTime, primary_key=True)
+
+    value_sum   = Column(Float)
+    value_mean  = Column(Float)
+    value_count = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<DailyMeasurement(station_id="{self.station_id}", day="{self.day}", metric="{self.metric_id}")>'
+
+    def __str__(self):
+        return 'station: %s, day: %s, metric: %s' % \
+               (self.station_id, self.day, self.metric_id)
+
+    @property
+    def dict(self):
+        """dictionary representation of the daily rollup"""
+        return {
+            'day': self.day,
+            'metric_id': self.metric_id,
+            'station_id': self.station_id,
+            'source': self.station.source,
+            'value_sum': self.value_sum,
+            'value_mean': self.value_mean,
+            'value_count': self.value_count
+        }
+
+
+class IngestWatermark(Base):
+    """ORM mapping for the latest measurement ingested for each station and metric
+
+    rows are maintained by the repository whenever measurements are added, retrieval uses them to request only
+    data after what is already stored
+
+    Attributes:
+        station_id (str): reference to the weather station that gathered the measurements
+        metric_id (str): reference to the metric gathered
+        date_time (DateTime): timestamp of the latest measurement stored
+        updated (DateTime): when the watermark last moved
+    """
+    __tablename__ = 'ingest_watermark'
+
+    station_id = Column(ForeignKey('station.station_id'), primary_key=True)
+    station = relationship('Station')
+
+    metric_id = Column(ForeignKey('metric.metric_id'), primary_key=True)
+    metric    = relationship('Metric')
+
+    date_time = Column(DateTime, nullable=False)
+    updated   = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<IngestWatermark(station_id="{self.station_id}", metric="{self.metric_id}", ' \
+               f'date_time="{self.date_time}")>'
+
+    def __str__(self):
+        return 'station: %s, metric: %s, date_time: %s' % \
+               (self.station_id, self.metric_id, self.date_time)
+
+
+class MeasurementRetention(Base):
+    """ORM mapping for the retention cut-off applied to a measurement table
+
+    measurements before the cut-off have been downsampled by the repository, so the daily rollup of those days is
+    final and no measurements may be added to them
+
+    Attributes:
+        relation (str): table the cut-off applies to, measurement or compact_measurement
+        cutoff (DateTime): midnight of the first day still holding raw measurements
+        updated (DateTime): when the cut-off last moved
+    """
+    __tablename__ = 'measurement_retention'
+
+    relation = Column(String(64), primary_key=True)
+    cutoff   = Column(DateTime, nullable=False)
+    updated  = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<MeasurementRetention(relation="{self.relation}", cutoff="{self.cutoff}")>'
+
+    def __str__(self):
+        return 'relation: %s, cutoff: %s' % (self.relation, self.cutoff)
+
+
 class Measurement(Base):
     """ORM mapping for measurements
 
@@ -110,6 +329,11 @@ class Measurement(Base):
     """
     __tablename__ = 'measurement'
 
+    __table_args__ = (
+        Index(MEASUREMENT_INDEX, 'station_id', 'metric_id', 'date_time'),
+        Index(MEASUREMENT_BRIN_INDEX, 'date_time', postgresql_using='brin'),
+    )
+
     date_time = Column(DateTime, primary_key=True)
 
     metric_id = Column(ForeignKey('metric.metric_id'), primary_key=True)
@@ -120,9 +344,6 @@ class Measurement(Base):
 
     value = Column(Float)
 
-    Index('idx_station', 'station_id')
-    Index('idx_date_time', 'date_time')
-
     def __repr__(self):
         return f'<Measurement(station_id="{self.station_id}", datetime="{self.date_time}", metric="{self.metric_id}")>'
 
@@ -165,6 +386,84 @@ class Metric(Base):
         return f'metric_id: {self.metric_id}, name: {self.name}'
 
 
+class MetricKey(Base):
+    """ORM mapping for the small integer keys of metrics in the compact measurement layout
+
+    Attributes:
+        metric_key (int): small integer key
+        metric_id (str): reference to the metric
+    """
+    __tablename__ = 'metric_key'
+
+    metric_key = Column(SmallInteger, primary_key=True)
+
+    metric_id = Column(ForeignKey('metric.metric_id'), unique=True, nullable=False)
+    metric = relationship('Metric')
+
+    def __repr__(self):
+        return f'<MetricKey(metric_key="{self.metric_key}", metric_id="{self.metric_id}")>'
+
+    def __str__(self):
+        return f'metric_key: {self.metric_key}, metric_id: {self.metric_id}'
+
+
+class ModelOrder(Base):
+    """ORM mapping for cached ARIMA model orders
+
+    Attributes:
+        run_id (int): reference to the river run the order was selected for
+        ar_order (int): number of autoregressive terms (p)
+        ma_order (int): number of moving average terms (q)
+        selected (DateTime): timestamp of the order selection
+    """
+    __tablename__ = 'model_order'
+
+    run_id = Column(ForeignKey('river_run.run_id'), primary_key=True)
+
+    ar_order = Column(Integer, nullable=False)
+    ma_order = Column(Integer, nullable=False)
+    selected = Column(DateTime, nullable=False)
+
+    @property
+    def order(self):
+        """the (p, q) order pair"""
+        return self.ar_order, self.ma_order
+
+    def __repr__(self):
+        return f'<ModelOrder(run_id="{self.run_id}", order="({self.ar_order}, {self.ma_order})")>'
+
+    def __str__(self):
+        return f'run_id: {self.run_id}, p: {self.ar_order}, q: {self.ma_order}, selected: {self.selected}'
+
+
+class ModelParameters(Base):
+    """ORM mapping for fitted ARIMA model parameters
+
+    Attributes:
+        run_id (int): reference to the river run the model was fit for
+        ar_order (int): number of autoregressive terms (p)
+        ma_order (int): number of moving average terms (q)
+        params ([float]): fitted parameters, used as start parameters for the next fit
+        iterations (int): optimizer iterations used by the fit
+        fitted (DateTime): timestamp of the fit
+    """
+    __tablename__ = 'model_parameters'
+
+    run_id = Column(ForeignKey('river_run.run_id'), primary_key=True)
+    ar_order = Column(Integer, primary_key=True)
+    ma_order = Column(Integer, primary_key=True)
+
+    params = Column(ARRAY(Float), nullable=False)
+    iterations = Column(Integer)
+    fitted = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<ModelParameters(run_id="{self.run_id}", order="({self.ar_order}, {self.ma_order})")>'
+
+    def __str__(self):
+        return f'run_id: {self.run_id}, p: {self.ar_order}, q: {self.ma_order}, iterations: {self.iterations}'
+
+
 class Prediction(Base):
     """ORM mapping for predictions
 
@@ -380,6 +679,27 @@ class Station(Base):
         }
 
 
+class StationKey(Base):
+    """ORM mapping for the small integer keys of stations in the compact measurement layout
+
+    Attributes:
+        station_key (int): small integer key
+        station_id (str): reference to the weather station
+    """
+    __tablename__ = 'station_key'
+
+    station_key = Column(SmallInteger, primary_key=True)
+
+    station_id = Column(ForeignKey('station.station_id'), unique=True, nullable=False)
+    station = relationship('Station')
+
+    def __repr__(self):
+        return f'<StationKey(station_key="{self.station_key}", station_id="{self.station_id}")>'
+
+    def __str__(self):
+        return f'station_key: {self.station_key}, station_id: {self.station_id}'
+
+
 class StationRiverDistance(Base):
     """ORM mapping describing distances between runs and stations
 
@@ -411,6 +731,9 @@ class StationRiverDistance(Base):
 class TmpMeasurement(Base):
     """ORM mapping for temporary measurements
 
+    Notes:
+        * no longer written by the repository, measurement loads stage into their own temporary table
+
     Attributes:
         date_time (DateTime): timestamp for when the measurement was taken
         metric_id (int): reference to the metric gathered
@@ -428,3 +751,448 @@ class TmpMeasurement(Base):
     station = relationship('Station')
 
     value = Column(Float, primary_key=True)
+
+
+"""measurement partitions span one month or one year of date_time"""
+PARTITION_INTERVALS = ('month', 'year')
+
+"""interval used when partitioning the measurement table"""
+PARTITION_INTERVAL = 'month'
+
+"""names of measurement partitions, measurement_y2018m05 for a month and measurement_y2018 for a year"""
+PARTITION_NAME_PATTERN = re.compile(r'^measurement_y(\d{4})(?:m(\d{2}))?$')
+
+"""moves the retention cut-off of a measurement table forward, never back"""
+RETENTION_CUTOFF_SQL = """
+    INSERT INTO measurement_retention (relation, cutoff, updated)
+        VALUES (%(relation)s, %(cutoff)s, now())
+    ON CONFLICT (relation)
+        DO UPDATE SET cutoff = EXCLUDED.cutoff, updated = EXCLUDED.updated
+        WHERE measurement_retention.cutoff < EXCLUDED.cutoff;
+"""
+
+
+def measurement_partition_name(day, interval=PARTITION_INTERVAL):
+    """name of the measurement partition holding a day
+
+    Args:
+        day (date): any day within the partition
+        interval (str): 'month' or 'year'
+
+    Returns:
+        str: partition table name
+
+    Raises:
+        ValueError: if the interval is not supported
+    """
+    if interval == 'month':
+        return f'measurement_y{day.year:04d}m{day.month:02d}'
+    elif interval == 'year':
+        return f'measurement_y{day.year:04d}'
+    else:
+        raise ValueError(f'partition interval must be one of {PARTITION_INTERVALS}')
+
+
+def measurement_partition_bounds(day, interval=PARTITION_INTERVAL):
+    """first day of the partition holding a day and first day of the next partition
+
+    Args:
+        day (date): any day within the partition
+        interval (str): 'month' or 'year'
+
+    Returns:
+        (date, date): inclusive start and exclusive end
+
+    Raises:
+        ValueError: if the interval is not supported
+    """
+    if interval == 'month':
+        start = datetime.date(day.year, day.month, 1)
+        end = datetime.date(day.year + day.month // 12, day.month % 12 + 1, 1)
+    elif interval == 'year':
+        start = datetime.date(day.year, 1, 1)
+        end = datetime.date(day.year + 1, 1, 1)
+    else:
+        raise ValueError(f'partition interval must be one of {PARTITION_INTERVALS}')
+
+    return start, end
+
+
+def measurement_partitions(start_date, end_date, interval=PARTITION_INTERVAL):
+    """the measurement partitions covering a date range
+
+    Args:
+        start_date (date): first day of the range
+        end_date (date): last day of the range, inclusive
+        interval (str): 'month' or 'year'
+
+    Returns:
+        [(str, date, date)]: name, inclusive start and exclusive end of each partition in order
+    """
+    if isinstance(end_date, datetime.datetime):
+        end_date = end_date.date()
+
+    partitions = []
+    day = start_date
+    while True:
+        start, end = measurement_partition_bounds(day, interval)
+        if start > end_date:
+            break
+
+        partitions.append((measurement_partition_name(start, interval), start, end))
+        day = end
+
+    return partitions
+
+
+def parse_measurement_partition_name(name):
+    """recover the interval and bounds of a measurement partition from its name
+
+    Args:
+        name (str): partition table name
+
+    Returns:
+        (str, date, date): interval, inclusive start and exclusive end. None if the name is not a partition name
+    """
+    match = PARTITION_NAME_PATTERN.match(name)
+    if match is None:
+        return None
+
+    year, month = match.groups()
+    interval = 'year' if month is None else 'month'
+    start, end = measurement_partition_bounds(datetime.date(int(year), int(month or 1), 1), interval)
+
+    return interval, start, end
+
+
+def get_measurement_partitions(cursor):
+    """names of the partitions currently attached to the measurement table
+
+    Args:
+        cursor (cursor): open database cursor
+
+    Returns:
+        [str]: partition names in order, empty if the table is not partitioned
+    """
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'measurement'::regclass
+        ORDER BY c.relname;
+    """)
+
+    return [name for name, in cursor.fetchall()]
+
+
+def get_measurement_partition_interval(cursor):
+    """the interval the measurement table is partitioned by
+
+    Notes:
+        * read from the catalog on every call, so a migration committed by another connection or process is seen by
+        the next transaction
+
+    Args:
+        cursor (cursor): open database cursor
+
+    Returns:
+        str: 'month' or 'year', None if the table is not partitioned
+    """
+    cursor.execute("""
+        SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'measurement'::regclass;
+    """)
+    if cursor.fetchone() is None:
+        return None
+
+    for name in get_measurement_partitions(cursor):
+        parsed = parse_measurement_partition_name(name)
+        if parsed is not None:
+            return parsed[0]
+
+    return PARTITION_INTERVAL
+
+
+def create_measurement_partitions(cursor, start_date, end_date, interval=None):
+    """create any missing measurement partitions covering a date range
+
+    Notes:
+        * does nothing when the measurement table is not partitioned, which is read from the catalog in the
+        caller's transaction
+        * the caller is responsible for committing
+
+    Args:
+        cursor (cursor): open database cursor
+        start_date (date): first day of the range
+        end_date (date): last day of the range, inclusive
+        interval (str): optional 'month' or 'year', defaults to the interval of the existing partitions
+
+    Returns:
+        [str]: names of the partitions created
+    """
+    if interval is None:
+        interval = get_measurement_partition_interval(cursor)
+        if interval is None:
+            return []
+
+    existing = set(get_measurement_partitions(cursor))
+    created = []
+    for name, start, end in measurement_partitions(start_date, end_date, interval):
+        if name in existing:
+            continue
+
+        # partition bounds must be plain literals, not casts
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {name} PARTITION OF measurement
+                FOR VALUES FROM (%(start)s) TO (%(end)s);
+        """, {'start': start.isoformat(), 'end': end.isoformat()})
+        created.append(name)
+
+    return created
+
+
+def detach_measurement_partitions(cursor, before, drop=False):
+    """detach the measurement partitions that end on or before a date
+
+    detached partitions keep their rows as ordinary tables, so they can be archived or dropped without touching the
+    rest of the measurement table. the daily rollup of the detached days is kept and made final by moving the
+    retention cut-off of measurement to the end of the last partition detached, the same as
+    Repository.clear_measurements, so their partitions are not created again by later writes.
+
+    Notes:
+        * cached measurement reads of the detached days are invalidated in this process
+        * the caller is responsible for committing
+
+    Args:
+        cursor (cursor): open database cursor
+        before (date): partitions ending on or before this day are detached
+        drop (bool): optional, drop the partitions after detaching them
+
+    Returns:
+        [str]: names of the partitions detached
+    """
+    if isinstance(before, datetime.datetime):
+        before = before.date()
+
+    detached = []
+    cutoff = None
+    for name in get_measurement_partitions(cursor):
+        parsed = parse_measurement_partition_name(name)
+        if parsed is None or parsed[2] > before:
+            continue
+
+        cursor.execute(f"ALTER TABLE measurement DETACH PARTITION {name};")
+        if drop:
+            cursor.execute(f"DROP TABLE {name};")
+        detached.append(name)
+        cutoff = parsed[2] if cutoff is None else max(cutoff, parsed[2])
+
+    if cutoff is not None:
+        cursor.execute(RETENTION_CUTOFF_SQL, {'relation': 'measurement',
+                                              'cutoff': datetime.datetime(cutoff.year, cutoff.month, cutoff.day)})
+        # the end is inclusive
+        measurement_cache.MEASUREMENT_CACHE.invalidate(end_date=cutoff - datetime.timedelta(days=1))
+
+    return detached
+
+
+def partition_measurement_table(cursor, interval=PARTITION_INTERVAL, keep_unpartitioned=False):
+    """migrate the measurement table to declarative range partitioning on date_time
+
+    the existing table is renamed, a partitioned measurement table with the same columns, key, references and
+    indexes is created along with a partition for every month or year holding measurements, and the rows are
+    copied over.
+    afterwards queries filtering on date_time only scan the partitions in range and the repository creates new
+    partitions as measurements are added.
+
+    Notes:
+        * requires PostgreSQL 11 or later for keys, references and upserts on partitioned tables
+        * the caller is responsible for committing, the table is locked until then
+
+    Args:
+        cursor (cursor): open database cursor
+        interval (str): optional 'month' or 'year'
+        keep_unpartitioned (bool): optional, keep the original table as measurement_unpartitioned
+
+    Returns:
+        [str]: names of the partitions created
+
+    Raises:
+        ValueError: if the interval is not supported or the table is already partitioned
+    """
+    if interval not in PARTITION_INTERVALS:
+        raise ValueError(f'partition interval must be one of {PARTITION_INTERVALS}')
+
+    if get_measurement_partition_interval(cursor) is not None:
+        raise ValueError('measurement is already partitioned')
+
+    cursor.execute("""
+        ALTER TABLE measurement RENAME TO measurement_unpartitioned;
+        ALTER INDEX measurement_pkey RENAME TO measurement_unpartitioned_pkey;
+
+        CREATE TABLE measurement (LIKE measurement_unpartitioned INCLUDING DEFAULTS)
+            PARTITION BY RANGE (date_time);
+        ALTER TABLE measurement ADD PRIMARY KEY (date_time, metric_id, station_id);
+        ALTER TABLE measurement ADD FOREIGN KEY (metric_id) REFERENCES metric (metric_id);
+        ALTER TABLE measurement ADD FOREIGN KEY (station_id) REFERENCES station (station_id);
+
+        SELECT MIN(date_time), MAX(date_time) FROM measurement_unpartitioned;
+    """)
+    first, last = cursor.fetchone()
+
+    created = []
+    if first is not None:
+        created = create_measurement_partitions(cursor, first.date(), last.date(), interval)
+
+    cursor.execute(f"""
+        ALTER INDEX IF EXISTS {MEASUREMENT_INDEX} RENAME TO {MEASUREMENT_INDEX}_unpartitioned;
+        ALTER INDEX IF EXISTS {MEASUREMENT_BRIN_INDEX} RENAME TO {MEASUREMENT_BRIN_INDEX}_unpartitioned;
+    """)
+
+    cursor.execute("""
+        INSERT INTO measurement (date_time, metric_id, station_id, value)
+            SELECT date_time, metric_id, station_id, value
+            FROM measurement_unpartitioned;
+    """)
+    index_measurement_table(cursor)
+
+    if not keep_unpartitioned:
+        cursor.execute("DROP TABLE measurement_unpartitioned;")
+
+    return created
+
+
+def index_measurement_table(cursor, include_value=False):
+    """create the measurement indexes on an existing database
+
+    tables created by the context already have the indexes declared on Measurement, this adds them to older
+    databases and drops the single column indexes they replace. with include_value the composite index also covers
+    value, so the repository's measurement reads can be answered by index-only scans.
+
+    Notes:
+        * include_value requires PostgreSQL 11 or later
+        * the caller is responsible for committing, the table is locked against writes until then
+
+    Args:
+        cursor (cursor): open database cursor
+        include_value (bool): optional, rebuild the composite index to cover value
+
+    Returns:
+        None
+    """
+    if include_value:
+        cursor.execute(f"""
+            DROP INDEX IF EXISTS {MEASUREMENT_INDEX};
+            CREATE INDEX {MEASUREMENT_INDEX} ON measurement (station_id, metric_id, date_time) INCLUDE (value);
+        """)
+    else:
+        cursor.execute(f"""
+            CREATE INDEX IF NOT EXISTS {MEASUREMENT_INDEX} ON measurement (station_id, metric_id, date_time);
+        """)
+
+    cursor.execute(f"""
+        CREATE INDEX IF NOT EXISTS {MEASUREMENT_BRIN_INDEX} ON measurement USING brin (date_time);
+        DROP INDEX IF EXISTS idx_station;
+        DROP INDEX IF EXISTS idx_date_time;
+    """)
+
+
+def put_measurement_keys(cursor, source):
+    """assign compact keys to the stations and metrics of a measurement relation that do not have one yet
+
+    only ids without a key are inserted, so existing ids never draw values from the small key sequences
+
+    Notes:
+        * the caller is responsible for committing
+
+    Args:
+        cursor (cursor): open database cursor
+        source (str): table or view with station_id and metric_id columns
+    """
+    cursor.execute(f"""
+        INSERT INTO station_key (station_id)
+            SELECT DISTINCT s.station_id
+            FROM {source} s
+            WHERE NOT EXISTS (SELECT 1 FROM station_key k WHERE k.station_id = s.station_id)
+        ON CONFLICT (station_id) DO NOTHING;
+
+        INSERT INTO metric_key (metric_id)
+            SELECT DISTINCT s.metric_id
+            FROM {source} s
+            WHERE NOT EXISTS (SELECT 1 FROM metric_key k WHERE k.metric_id = s.metric_id)
+        ON CONFLICT (metric_id) DO NOTHING;
+    """)
+
+
+def compact_measurement_table(cursor, float4=False):
+    """copy the measurement table into the compact layout
+
+    stations and metrics are assigned small integer keys, every measurement is copied into compact_measurement and
+    COMPACT_MEASUREMENT_VIEW is created so compact measurements read like the measurement table. afterwards a
+    Repository created with compact=True reads and writes the compact layout. the measurement table is left in place.
+
+    Notes:
+        * the caller is responsible for committing
+        * measurements already in the compact table are kept
+
+    Args:
+        cursor (cursor): open database cursor
+        float4 (bool): optional, store values in single precision, about 7 significant digits
+
+    Returns:
+        int: number of measurements copied
+    """
+    put_measurement_keys(cursor, 'measurement')
+
+    if float4:
+        cursor.execute(f"""
+            DROP VIEW IF EXISTS {COMPACT_MEASUREMENT_VIEW};
+            ALTER TABLE compact_measurement ALTER COLUMN value TYPE real;
+        """)
+
+    cursor.execute("""
+        INSERT INTO compact_measurement (station_key, metric_key, date_time, value)
+            SELECT sk.station_key, mk.metric_key, m.date_time, m.value
+            FROM measurement m
+                JOIN station_key sk ON sk.station_id = m.station_id
+                JOIN metric_key mk ON mk.metric_id = m.metric_id
+        ON CONFLICT (station_key, metric_key, date_time) DO NOTHING;
+    """)
+    copied = cursor.rowcount
+
+    # values are cast back to double precision so readers see the same types in both layouts
+    cursor.execute(f"""
+        CREATE OR REPLACE VIEW {COMPACT_MEASUREMENT_VIEW} AS
+            SELECT c.date_time, mk.metric_id, sk.station_id, c.value::double precision AS value
+            FROM compact_measurement c
+                JOIN station_key sk ON sk.station_key = c.station_key
+                JOIN metric_key mk ON mk.metric_key = c.metric_key;
+    """)
+
+    return copied
+
+
+if __name__ == '__main__':
+    # python context.py --partition [month | year]
+    # python context.py --detach-partitions before-date [--drop]
+    from riverrunner import settings
+
+    connection = get_engine(settings.DATABASE).raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            if sys.argv[1] == '--partition':
+                interval = sys.argv[2] if len(sys.argv) > 2 else PARTITION_INTERVAL
+                names = partition_measurement_table(cursor, interval)
+                print(f'created {len(names)} {interval} partitions')
+
+            elif sys.argv[1] == '--detach-partitions':
+                before = datetime.datetime.strptime(sys.argv[2], '%Y-%m-%d').date()
+                names = detach_measurement_partitions(cursor, before, drop='--drop' in sys.argv[3:])
+                print(f'detached {", ".join(names) or "no partitions"}')
+
+        connection.commit()
+    except:
+        connection.rollback()
+
+        raise
+    finally:
+        connection.close()
@@ -1,30 +1,44 @@
 """ script that scrapes and uploads DarkSky and USGS data
 
 Examples:
-    python continuous_retrieval.py [--csv] --manual start-date end-date
+    python continuous_retrieval.py [--csv | --binary] --manual start-date end-date
 
     * scrapes and uploads data over the specified date range (inclusive)
     * start-date and end-date must be in ISO format, 'YYYY-MM-DD'
-    * optional argument to insert records into database from CSV file (for USGS data only)
+    * optional argument to insert records into database from CSV file with a text or binary COPY (for USGS data only)
 
-    python continuous_retrieval.py [--csv] --daily [days-back]
+    python continuous_retrieval.py --daily [days-back]
 
-    * scrapes and uploads data over date range
-    * date range is from days-back before yesterday to yesterday (inclusive)
+    * streams the USGS data added since each site's ingest watermark up to yesterday into the database, sites
+    without a watermark are fetched from days-back before yesterday
+    * fills DarkSky gaps from days-back before yesterday to yesterday (inclusive)
     * optional days-back parameter must be an integer (defaults to 0)
-    * optional argument to insert records into database from CSV file (for USGS data only)
+    * --csv and --binary are no longer accepted with --daily, load files over a date range with --manual
+
+    python continuous_retrieval.py --incremental
+
+    * streams the USGS data added since each site's ingest watermark up to today into the database
+    * sites without a watermark are fetched from yesterday, no site goes back more than USGS_MAX_BACKFILL_DAYS
 """
 
+import collections
+import contextlib
 import datetime as dt
 import dateutil
 import json
+from multiprocessing.pool import ThreadPool
 import pandas as pd
+import psycopg2
+import queue
 import requests
+from riverrunner import http_client
+from riverrunner import json_stream
 from riverrunner import settings
 from riverrunner.context import Context, Measurement
 from riverrunner.repository import Repository
-from sqlalchemy.exc import SQLAlchemyError
 import sys
+import threading
+import time
 
 
 # data directory
@@ -43,6 +57,111 @@ PARAM_CODES = [
     "00060",
 ]
 
+# USGS sites per request, the service accepts up to 100
+USGS_BATCH_SIZE = 100
+
+# USGS requests in flight at once
+USGS_WORKERS = 4
+
+# bytes of a streamed USGS response parsed at a time
+USGS_STREAM_CHUNK_SIZE = 1 << 16
+
+# streamed USGS responses with a smaller Content-Length are parsed whole with response.json(), which is much faster
+# but peaks at several times the body in memory, see static/benchmarks.benchmark_usgs_parsing. the length is of the
+# body as sent, so compressed responses are compared before decompression
+USGS_STREAM_MIN_BYTES = 1 << 20
+
+# records passed from a streaming USGS request at a time, and blocks of records waiting to be consumed
+USGS_BLOCK_SIZE = 1000
+USGS_QUEUE_SIZE = 16
+
+# locations of the site code, parameter code and values of each series in a USGS response
+USGS_SITE_PREFIX = "value.timeSeries.item.sourceInfo.siteCode.item"
+USGS_VARIABLE_PREFIX = "value.timeSeries.item.variable.variableCode.item"
+USGS_VALUE_PREFIX = "value.timeSeries.item.values.item.value.item"
+
+# days fetched for sites without an ingest watermark, and most days an incremental retrieval goes back
+USGS_NEW_SITE_DAYS = 1
+USGS_MAX_BACKFILL_DAYS = 30
+
+# DarkSky requests in flight at once and requests started per second
+DARK_SKY_WORKERS = 8
+DARK_SKY_RATE = 10.
+
+# days of DarkSky observations fetched and written together when filling gaps
+NOAA_FILL_DAYS = 7
+
+
+class TokenBucket:
+    """ thread-safe token bucket rate limiter
+
+    tokens are added at a steady rate up to the capacity and each call takes one, so bursts of up to capacity calls
+    pass at once and the long run rate never exceeds the rate
+
+    Args:
+        rate (float): tokens added per second
+        capacity (float): optional most tokens held, defaults to one second of tokens
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = max(1., rate) if capacity is None else capacity
+
+        self.__tokens = self.capacity
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        """ take a token, waiting until one is available
+
+        Returns:
+            None
+        """
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated) * self.rate)
+                self.__updated = now
+
+                if self.__tokens >= 1.:
+                    self.__tokens -= 1.
+                    return
+
+                wait = (1. - self.__tokens) / self.rate
+            time.sleep(wait)
+
+
+def fetch_station_observations(stations, days, workers=DARK_SKY_WORKERS, rate=DARK_SKY_RATE):
+    """request observations of every station and day from the DarkSky API concurrently
+
+    requests are made by a pool of worker threads, started no faster than the rate limit, and collected as they
+    finish. stations whose request fails are left out
+
+    Args:
+        stations (DataFrame): weather stations, as returned by Repository.get_all_stations
+        days ([str]): days in iso format
+        workers (int): optional number of requests in flight at once
+        rate (float): optional requests started per second
+
+    Returns:
+        [(station_id, metric_id, date_time, value)]: ready for Repository.put_measurements_from_list(upsert=True)
+    """
+    tasks = [(station, day) for day in days for station in stations.itertuples(index=False)]
+    if len(tasks) == 0:
+        return []
+
+    bucket = TokenBucket(rate)
+
+    def request(task):
+        bucket.acquire()
+        return make_station_observation_request(*task)
+
+    measurements = []
+    with ThreadPool(processes=min(workers, len(tasks))) as pool:
+        for station_measurements in pool.imap_unordered(request, tasks):
+            if station_measurements is not None:
+                measurements.extend(station_measurements)
+    return measurements
+
 
 def fill_noaa_gaps(start_date, end_date, db=settings.DATABASE):
     """use as needed to fill gaps in weather measurements
@@ -58,25 +177,23 @@ def fill_noaa_gaps(start_date, end_date, db=settings.DATABASE):
     stations = repo.get_all_stations(source='NOAA')
     total = 0
 
-    # loop through each day retrieving observations
+    # loop through the days a few at a time, fetching each group concurrently
     while start_date <= end_date:
-        content = stations.apply(
-            lambda station: make_station_observation_request(station, start_date.isoformat()),
-            axis=1
-        ).values
-
-        # put them all in the db
-        added = 0
-        for station_measurements in content:
-            try:
-                repo.put_measurements_from_list(station_measurements)
-            except SQLAlchemyError:
-                session.rollback()
-                continue
-            added += len(station_measurements)
-
-        print(f'added {added} - {start_date.isoformat()}')
-        start_date += dt.timedelta(days=1)
+        days = []
+        while start_date <= end_date and len(days) < NOAA_FILL_DAYS:
+            days.append(start_date.isoformat())
+            start_date += dt.timedelta(days=1)
+
+        # put them all in the db in one batch
+        measurements = fetch_station_observations(stations, days)
+        try:
+            repo.put_measurements_from_list(measurements, upsert=True)
+            added = len(measurements)
+        except psycopg2.Error as e:
+            print([str(a) for a in e.args])
+            added = 0
+
+        print(f'added {added} - {days[0]} to {days[-1]}')
         total += added
 
     return total
@@ -98,7 +215,7 @@ def get_noaa_predictions(run_id, session):
     lat = run.put_in_latitude
     lon = run.put_in_longitude
 
-    r = requests.get(f'https://api.weather.gov/points/{lat},{lon}/forecast/hourly')
+    r = http_client.get(f'https://api.weather.gov/points/{lat},{lon}/forecast/hourly')
 
     if r.status_code == 200 and len(r.content) > 10:
         return pd.DataFrame(r.json()['properties']['periods'])
@@ -118,54 +235,196 @@ def get_usgs_site_ids():
     return site_ids
 
 
-def get_usgs_json_data(site_id, start_date, end_date, param_code):
-    """ retrieve JSON data for a specific USGS site, parameter, and date range
+def usgs_params(site_ids, start_date, end_date, param_codes, modified_since=None):
+    """ query parameters of a USGS request for several sites and parameters over a date range
 
     Args:
-        site_id (str): string representation of site id
+        site_ids ([str]): list of site ids
         start_date (str): start date in ISO format, 'YYYY-MM-DD'
         end_date (str): end date in ISO format, 'YYYY-MM-DD'
-        param_code (str): string representation of parameter code
+        param_codes ([str]): list of parameter codes
+        modified_since (str): optional ISO 8601 duration, e.g. 'P3D', only sites with values added or changed within
+            it are returned
 
     Returns:
-        dict[str, str]: map relating timestamps to values
+        dict[str, str]: query parameters
     """
     params = {
         "format": USGS_FORMAT,
-        "sites": site_id,
+        "sites": ",".join(site_ids),
         "startDT": start_date,
         "endDT": end_date,
-        "parameterCd": param_code,
+        "parameterCd": ",".join(param_codes),
         "siteStatus": USGS_SITE_STATUS,
     }
-    response = requests.get(USGS_BASE_URL, params=params)
+    if modified_since is not None:
+        params["modifiedSince"] = modified_since
+    return params
+
+
+def get_usgs_batch_json_data(site_ids, start_date, end_date, param_codes, modified_since=None):
+    """ retrieve JSON data for several USGS sites and parameters over a date range in one request
+
+    Args:
+        site_ids ([str]): list of site ids
+        start_date (str): start date in ISO format, 'YYYY-MM-DD'
+        end_date (str): end date in ISO format, 'YYYY-MM-DD'
+        param_codes ([str]): list of parameter codes
+        modified_since (str): optional ISO 8601 duration, only sites changed within it are returned
+
+    Returns:
+        dict[(str, str), dict[str, str]]: maps relating timestamps to values keyed by site id and parameter code,
+        sites without data for a parameter are left out
+
+    Raises:
+        RequestException: if the request fails or its last response is an error status
+    """
+    params = usgs_params(site_ids, start_date, end_date, param_codes, modified_since)
+    response = http_client.get(USGS_BASE_URL, params=params)
+    response.raise_for_status()
     try:
         response_json = response.json()
     except json.decoder.JSONDecodeError:
         print(response.content)
         raise
-    # response_json = requests.get(USGS_BASE_URL, params=params).json()
-    time_series_list = response_json["value"]["timeSeries"]
-    values_list = []
-    if len(time_series_list) > 0:
-        values_list = time_series_list[0]["values"][0]["value"]
-    date_value_map = {elem["dateTime"]: elem["value"] for elem in values_list}
-    return date_value_map
+
+    return usgs_series(response_json)
+
+
+def usgs_series(response_json):
+    """ map the values of a parsed USGS response to the site and parameter of their series
+
+    Args:
+        response_json (dict): parsed USGS response
+
+    Returns:
+        dict[(str, str), dict[str, str]]: maps relating timestamps to values keyed by site id and parameter code,
+        sites without data for a parameter are left out
+    """
+    # one time series per site and parameter, keep the first if a site reports a parameter more than once
+    series = {}
+    for time_series in response_json["value"]["timeSeries"]:
+        site_id = time_series["sourceInfo"]["siteCode"][0]["value"]
+        param_code = time_series["variable"]["variableCode"][0]["value"]
+        if (site_id, param_code) in series or len(time_series["values"]) == 0:
+            continue
+
+        values_list = time_series["values"][0]["value"]
+        series[(site_id, param_code)] = {elem["dateTime"]: elem["value"] for elem in values_list}
+    return series
+
+
+def iter_usgs_batch_records(site_ids, start_date, end_date, param_codes, modified_since=None):
+    """ yield the records of several USGS sites and parameters from one request as the response arrives
+
+    the response is parsed incrementally, so memory stays flat however long the date range is. responses whose
+    Content-Length is below USGS_STREAM_MIN_BYTES are parsed whole instead
+
+    Args:
+        site_ids ([str]): list of site ids
+        start_date (str): start date in ISO format, 'YYYY-MM-DD'
+        end_date (str): end date in ISO format, 'YYYY-MM-DD'
+        param_codes ([str]): list of parameter codes
+        modified_since (str): optional ISO 8601 duration, only sites changed within it are returned
+
+    Yields:
+        (str, str, str, str): site id, parameter code, timestamp and value
+    """
+    params = usgs_params(site_ids, start_date, end_date, param_codes, modified_since)
+    response = http_client.get(USGS_BASE_URL, params=params, stream=True)
+    try:
+        response.raise_for_status()
+        length = response.headers.get("Content-Length")
+        if length is not None and int(length) < USGS_STREAM_MIN_BYTES:
+            for (site_id, param_code), date_value_map in usgs_series(response.json()).items():
+                for date_time, value in date_value_map.items():
+                    yield site_id, param_code, date_time, value
+            return
+
+        yield from parse_usgs_records(response.iter_content(USGS_STREAM_CHUNK_SIZE))
+    finally:
+        response.close()
+
+
+def parse_usgs_records(chunks):
+    """ yield the records of a USGS JSON response as its chunks arrive
+
+    follows get_usgs_batch_json_data, only the first values of the first series of each site and parameter are
+    used. the site and parameter codes of a series must come before its values, as they do in USGS responses
+
+    Args:
+        chunks (iterable): str or bytes chunks of the response
+
+    Yields:
+        (str, str, str, str): site id, parameter code, timestamp and value
+
+    Raises:
+        ValueError: if the response is not valid JSON or a series' values come before its codes
+    """
+    seen = set()
+    series, site_id, param_code, skip = None, None, None, False
+    items = json_stream.iter_items(chunks, USGS_SITE_PREFIX, USGS_VARIABLE_PREFIX, USGS_VALUE_PREFIX)
+    for path, item in items:
+        # path is value, timeSeries, series index, then the location within the series
+        if path[2] != series:
+            series, site_id, param_code, skip = path[2], None, None, False
+
+        if path[3] == "sourceInfo":
+            if path[-1] == 0:
+                site_id = item["value"]
+            continue
+        if path[3] == "variable":
+            if path[-1] == 0:
+                param_code = item["value"]
+            continue
+
+        if skip or path[4] != 0:
+            continue
+        if site_id is None or param_code is None:
+            raise ValueError("USGS series values came before the series codes")
+        if path[-1] == 0:
+            skip = (site_id, param_code) in seen
+            seen.add((site_id, param_code))
+            if skip:
+                continue
+
+        yield site_id, param_code, item["dateTime"], item["value"]
+
+
+def get_usgs_json_data(site_id, start_date, end_date, param_code):
+    """ retrieve JSON data for a specific USGS site, parameter, and date range
+
+    Args:
+        site_id (str): string representation of site id
+        start_date (str): start date in ISO format, 'YYYY-MM-DD'
+        end_date (str): end date in ISO format, 'YYYY-MM-DD'
+        param_code (str): string representation of parameter code
+
+    Returns:
+        dict[str, str]: map relating timestamps to values
+    """
+    series = get_usgs_batch_json_data([site_id], start_date, end_date, [param_code])
+    return series.get((site_id, param_code), {})
 
 
 def make_station_observation_request(station, day):
     """make a request for observations to the DarkSky API
 
     Args:
-        station: (Station) weather station to retrieve measurments
+        station: (Station) weather station to retrieve measurments, anything with station_id, latitude and longitude
         day: (str) datetime in iso format
     Returns:
-        [Measurements] if call was successful
+        [(station_id, metric_id, date_time, value)] if call was successful, ready for
+        Repository.put_measurements_from_list(upsert=True)
         None otherwise
     """
     now = dt.datetime.now().isoformat()
 
-    r = requests.get(f'{DARK_SKY_URL}/{settings.DARK_SKY_KEY}/{station.latitude},{station.longitude},{day}')
+    try:
+        r = http_client.get(f'{DARK_SKY_URL}/{settings.DARK_SKY_KEY}/{station.latitude},{station.longitude},{day}')
+    except requests.RequestException as e:
+        print(f'{now}: {station.station_id} failed - {e}')
+        return None
 
     # make sure the web result is valid
     if r.status_code == 200:
@@ -177,35 +436,10 @@ def make_station_observation_request(station, day):
             timestamp = obs['time']
             timestamp = dt.datetime.fromtimestamp(timestamp)
 
-            # add precip
-            measurements.append(
-                Measurement(
-                    station_id=station.station_id,
-                    metric_id='00003',
-                    value=obs['precipIntensity'],
-                    date_time=timestamp
-                )
-            )
-
-            # add temp
-            measurements.append(
-                Measurement(
-                    station_id=station.station_id,
-                    metric_id='00001',
-                    value=obs['temperature'],
-                    date_time=timestamp
-                )
-            )
-
-            # add humidity
-            measurements.append(
-                Measurement(
-                    station_id=station.station_id,
-                    metric_id='00002',
-                    value=obs['humidity'],
-                    date_time=timestamp
-                )
-            )
+            # add precip, temp and humidity
+            measurements.append((station.station_id, '00003', timestamp, obs['precipIntensity']))
+            measurements.append((station.station_id, '00001', timestamp, obs['temperature']))
+            measurements.append((station.station_id, '00002', timestamp, obs['humidity']))
         print(f'{now}: {station.station_id} complete')
         return measurements
     else:
@@ -227,19 +461,131 @@ def put_24hr_observations(session):
     yesterday = dt.datetime.now() - dt.timedelta(hours=24)
     yesterday = dt.datetime(year=yesterday.year, month=yesterday.month, day=yesterday.day)
 
-    # apply the api request to each station
-    content = stations.apply(
-        lambda station: make_station_observation_request(station, yesterday.isoformat()),
-        axis=1
-    ).values
+    # request every station concurrently, then put them all in the db in one batch
+    measurements = fetch_station_observations(stations, [yesterday.isoformat()])
+    repo.put_measurements_from_list(measurements, upsert=True)
+
+    return len(measurements)
+
+
+def iter_usgs_records(site_ids, start_date, end_date, param_codes, batch_size=USGS_BATCH_SIZE,
+                      workers=USGS_WORKERS, stream=True, modified_since=None):
+    """ yield the records of USGS parameters for each site, requesting batches of sites concurrently
+
+    every request covers a batch of sites and all parameters. batches are requested by a pool of worker threads.
+    streamed responses are parsed as they arrive and their records are yielded in blocks as they are parsed, so
+    batches interleave and memory stays flat. otherwise each response is parsed whole and its records are yielded in
+    batch order. batches whose request fails after the client's retries are skipped, a streamed batch failing part
+    way keeps the records already yielded
+
+    Args:
+        site_ids ([str]): list of site ids
+        start_date (str): start date in ISO format, 'YYYY-MM-DD'
+        end_date (str): end date in ISO format, 'YYYY-MM-DD'
+        param_codes ([str]): list of parameter codes, or a single parameter code
+        batch_size (int): optional number of sites per request
+        workers (int): optional number of requests in flight at once
+        stream (bool): optional, parse responses incrementally
+        modified_since (str): optional ISO 8601 duration, only sites changed within it are returned
+
+    Yields:
+        (str, str, str, str): site id, parameter code, timestamp and value
+    """
+    if isinstance(param_codes, str):
+        param_codes = [param_codes]
+
+    batches = [site_ids[i:i + batch_size] for i in range(0, len(site_ids), batch_size)]
+    if len(batches) == 0:
+        return
+
+    if stream:
+        yield from _iter_streamed_usgs_records(batches, start_date, end_date, param_codes, workers, modified_since)
+        return
+
+    def request(batch):
+        # a failed batch is skipped so the other batches are still loaded
+        try:
+            return get_usgs_batch_json_data(batch, start_date, end_date, param_codes, modified_since)
+        except requests.RequestException as e:
+            print("failed sites {}: {}".format(",".join(batch), e))
+            return {}
+
+    with ThreadPool(processes=min(workers, len(batches))) as pool:
+        for series in pool.imap(request, batches):
+            for (site_id, param_code), date_value_map in series.items():
+                for date_time, value in date_value_map.items():
+                    yield site_id, param_code, date_time, value
+
 
-    # put them all in the db
-    added = 0
-    for station_measurements in content:
-        repo.put_measurements_from_list(station_measurements)
-        added += len(station_measurements)
+def _iter_streamed_usgs_records(batches, start_date, end_date, param_codes, workers, modified_since):
+    """ yield the records of streamed batch requests as the worker threads parse them
 
-    return added
+    workers pass blocks of records through a bounded queue, so a slow consumer holds the workers back rather than
+    letting parsed records pile up. closing the generator stops the workers at their next block
+    """
+    blocks = queue.Queue(maxsize=USGS_QUEUE_SIZE)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                blocks.put(item, timeout=.1)
+                return
+            except queue.Full:
+                continue
+
+    def pump(batch):
+        # a failed batch is skipped so the other batches are still loaded, parse errors are raised by the consumer
+        try:
+            block = []
+            for record in iter_usgs_batch_records(batch, start_date, end_date, param_codes, modified_since):
+                block.append(record)
+                if len(block) == USGS_BLOCK_SIZE:
+                    put(block)
+                    block = []
+                    if stop.is_set():
+                        return
+            put(block)
+        except requests.RequestException as e:
+            print("failed sites {}: {}".format(",".join(batch), e))
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    with ThreadPool(processes=min(workers, len(batches))) as pool:
+        pool.map_async(pump, batches)
+        try:
+            finished = 0
+            while finished < len(batches):
+                item = blocks.get()
+                if item is done:
+                    finished += 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield from item
+        finally:
+            stop.set()
+
+
+def write_usgs_records(records, files):
+    """ write each record to the CSV file of its parameter as it passes through
+
+    lines are written in the layout read by Repository.put_measurements_from_csv, timestamp, parameter code, site id
+    and value
+
+    Args:
+        records (iterable): (site id, parameter code, timestamp, value) records
+        files (dict[str, file]): open file of each parameter code
+
+    Yields:
+        (str, str, str, str): the records, unchanged
+    """
+    for site_id, param_code, date_time, value in records:
+        files[param_code].write("{},{},{},{}\n".format(date_time, param_code, site_id, value))
+        yield site_id, param_code, date_time, value
 
 
 def scrape_usgs_data(start_date, end_date):
@@ -252,45 +598,138 @@ def scrape_usgs_data(start_date, end_date):
     Returns:
         [str]: list of full paths of CSV files that were written to
     """
-    start_date_file_ext = start_date.replace("-", "")
-    end_date_file_ext = end_date.replace("-", "")
     site_ids = get_usgs_site_ids()
-    param_codes = PARAM_CODES
-    out_files = []
-    for param_code in param_codes:
-        total_values = 0
-        out_file = DATA_DIR + "measurements_{}_{}_{}.csv".format(
-            param_code,
-            start_date_file_ext,
-            end_date_file_ext
-        )
-        out_files.append(out_file)
-        with open(out_file, "w") as f:
-            for site_id in site_ids:
-                json_data = get_usgs_json_data(
-                    site_id=site_id,
-                    start_date=start_date,
-                    end_date=end_date,
-                    param_code=param_code
-                )
-                total_values += len(json_data)
-                for date_time, value in json_data.items():
-                    f.write("{},{},{},{}\n".format(
-                        site_id,
-                        param_code,
-                        date_time,
-                        value
-                    ))
-        print("{}: {}".format(param_code, total_values))
+    out_files = [usgs_file_name(param_code, start_date, end_date) for param_code in PARAM_CODES]
+    total_values = collections.Counter()
+    with contextlib.ExitStack() as stack:
+        files = {param_code: stack.enter_context(open(out_file, "w"))
+                 for param_code, out_file in zip(PARAM_CODES, out_files)}
+        records = iter_usgs_records(site_ids, start_date, end_date, PARAM_CODES)
+        for _, param_code, _, _ in write_usgs_records(records, files):
+            total_values[param_code] += 1
+    for param_code in PARAM_CODES:
+        print("{}: {}".format(param_code, total_values[param_code]))
     return out_files
 
 
-def upload_data_from_file(csv_file, from_csv=False):
+def stream_usgs_data(start_date, end_date, audit=False):
+    """ scrape data for all USGS sites and parameters and copy it into the database as it arrives
+
+    Args:
+        start_date (str): start date in ISO format, 'YYYY-MM-DD'
+        end_date (str): end date in ISO format, 'YYYY-MM-DD'
+        audit (bool): optional, also write the CSV files scrape_usgs_data would have written
+
+    Returns:
+        int: number of records inserted
+    """
+    r = Repository()
+    site_ids = get_usgs_site_ids()
+    with contextlib.ExitStack() as stack:
+        records = iter_usgs_records(site_ids, start_date, end_date, PARAM_CODES)
+        if audit:
+            files = {param_code: stack.enter_context(open(usgs_file_name(param_code, start_date, end_date), "w"))
+                     for param_code in PARAM_CODES}
+            records = write_usgs_records(records, files)
+        total_values = r.put_measurements_from_stream(records)
+    print("{}: {}".format(",".join(PARAM_CODES), total_values))
+    return total_values
+
+
+def usgs_update_windows(site_ids, watermarks, end_date, param_codes=PARAM_CODES,
+                        new_site_days=USGS_NEW_SITE_DAYS, max_days=USGS_MAX_BACKFILL_DAYS):
+    """ group USGS sites by the day their incremental retrieval starts from
+
+    a site starts from the day of its oldest watermark over the parameters so no parameter misses values, the day
+    itself is fetched again as it may have been partial. a parameter without a watermark starts new_site_days before
+    the end date and no site goes back more than max_days
+
+    Args:
+        site_ids ([str]): list of site ids
+        watermarks (DataFrame): station_id, metric_id and date_time, as returned by Repository.get_ingest_watermarks
+        end_date (date): last day to retrieve
+        param_codes ([str]): optional list of parameter codes
+        new_site_days (int): optional days fetched for a parameter without a watermark
+        max_days (int): optional most days before the end date a site starts from
+
+    Returns:
+        dict[date, [str]]: site ids keyed by the day their retrieval starts from
+    """
+    earliest = end_date - dt.timedelta(days=max_days)
+    default = max(earliest, end_date - dt.timedelta(days=new_site_days))
+    latest = {(w.station_id, w.metric_id): w.date_time.date() for w in watermarks.itertuples(index=False)}
+
+    windows = collections.defaultdict(list)
+    for site_id in site_ids:
+        start = min(latest.get((site_id, param_code), default) for param_code in param_codes)
+        windows[min(max(start, earliest), end_date)].append(site_id)
+    return dict(windows)
+
+
+def stream_usgs_updates(end_date=None, modified_since=True, new_site_days=USGS_NEW_SITE_DAYS):
+    """ copy the USGS measurements added since each site's ingest watermark into the database
+
+    sites are grouped by the day their retrieval starts from, see usgs_update_windows, and each group is requested
+    over its own date range. with modified_since only sites whose values changed within the range are returned, so
+    sites that have not reported cost no transfer
+
+    the watermarks are built from the stored measurements first if there are none, so sites already holding
+    measurements resume from them rather than from new_site_days
+
+    Args:
+        end_date (date): optional last day to retrieve, defaults to today
+        modified_since (bool): optional, ask USGS for changed sites only
+        new_site_days (int): optional days fetched for a parameter without a watermark, sites go back at least
+            this far and otherwise no more than USGS_MAX_BACKFILL_DAYS
+
+    Returns:
+        int: number of records inserted
+    """
+    r = Repository()
+    today = dt.date.today()
+    end_date = today if end_date is None else end_date
+
+    r.put_ingest_watermarks(if_empty=True)
+    watermarks = r.get_ingest_watermarks(source="USGS", metric_ids=PARAM_CODES)
+    windows = usgs_update_windows(get_usgs_site_ids(), watermarks, end_date, new_site_days=new_site_days,
+                                  max_days=max(USGS_MAX_BACKFILL_DAYS, new_site_days))
+
+    def records():
+        for start_date, site_ids in sorted(windows.items()):
+            duration = "P{}D".format((today - start_date).days + 1) if modified_since else None
+            yield from iter_usgs_records(site_ids, start_date.isoformat(), end_date.isoformat(), PARAM_CODES,
+                                         modified_since=duration)
+
+    total_values = r.put_measurements_from_stream(records())
+    print("{}: {} from {} start dates".format(",".join(PARAM_CODES), total_values, len(windows)))
+    return total_values
+
+
+def usgs_file_name(param_code, start_date, end_date):
+    """ name of the CSV file holding a USGS parameter over a date range
+
+    Args:
+        param_code (str): string representation of parameter code
+        start_date (str): start date in ISO format, 'YYYY-MM-DD'
+        end_date (str): end date in ISO format, 'YYYY-MM-DD'
+
+    Returns:
+        str: full path of the CSV file
+    """
+    return DATA_DIR + "measurements_{}_{}_{}.csv".format(
+        param_code,
+        start_date.replace("-", ""),
+        end_date.replace("-", "")
+    )
+
+
+def upload_data_from_file(csv_file, from_csv=False, binary=False):
     """ insert all records contained in file to database
 
     Args:
         csv_file (str): full path of CSV file containing records
-        from_csv (bool): whether to insert into database using CSV or ORM (CSV scales better)
+        from_csv (bool): whether to insert into database using CSV or a bulk upsert of the parsed rows (CSV scales better)
+        binary (bool): with from_csv, encode the file on the client and send it as a binary COPY
 
     Returns:
         bool: success/exception
@@ -298,51 +737,63 @@ def upload_data_from_file(csv_file, from_csv=False):
     r = Repository()
 
     if from_csv:
-        success = r.put_measurements_from_csv(csv_file=csv_file)
+        success = r.put_measurements_from_csv(csv_file=csv_file, binary=binary)
 
     else:
         measurements = []
         with open(csv_file, "r") as f:
             for line in f:
-                site_id, param_code, date_time, value = line.strip().split(",")
-                measurement = Measurement(
-                    station_id=site_id,
-                    metric_id=param_code,
-                    date_time=dateutil.parser.parse(date_time),
-                    value=float(value)
-                )
-                measurements.append(measurement)
-        success = r.put_measurements_from_list(measurements=measurements)
+                date_time, param_code, site_id, value = line.strip().split(",")
+                measurements.append((site_id, param_code, dateutil.parser.parse(date_time), float(value)))
+        success = r.put_measurements_from_list(measurements=measurements, upsert=True)
 
     return success
 
 
-if __name__ == "__main__":
-    # python scrape_usgs_data.py [--csv] --manual start-date end-date
-    # python scrape_usgs_data.py [--csv] --daily [days-back]
-
-    from_csv = False
-    if sys.argv[1] == "--csv":
-        from_csv = True
-
-    if "--manual" in sys.argv[1:3]:
-        index = sys.argv.index("--manual")
-        start_date, end_date = sys.argv[index+1:]
-
-    elif "--daily" in sys.argv[1:3]:
-        index = sys.argv.index("--daily")
-        days_back = 0
-        if len(sys.argv) > index + 1:
-            days_back = int(sys.argv[index+1])
-        today = dt.date.today()
-        end_date = today - dt.timedelta(days=1)
+def main(argv):
+    """ run the command line, see the module docstring
+
+    Args:
+        argv ([str]): arguments after the script name
+
+    Returns:
+        None
+
+    Raises:
+        ValueError: if the arguments are not one of the documented forms
+    """
+    if argv[0] == "--incremental":
+        stream_usgs_updates()
+        return
+
+    if argv[0] == "--daily":
+        days_back = int(argv[1]) if len(argv) > 1 else 0
+        end_date = dt.date.today() - dt.timedelta(days=1)
         start_date = end_date - dt.timedelta(days=days_back)
-        end_date = end_date.isoformat()
-        start_date = start_date.isoformat()
+
+        stream_usgs_updates(end_date=end_date, new_site_days=days_back)
+        fill_noaa_gaps(start_date, end_date)
+        return
+
+    from_csv = argv[0] in ("--csv", "--binary")
+    binary = argv[0] == "--binary"
+    if "--manual" not in argv[:2]:
+        raise ValueError("expected [--csv | --binary] --manual, --daily or --incremental, see the module docstring")
+
+    index = argv.index("--manual")
+    start_date, end_date = argv[index+1:index+3]
 
     csv_files = scrape_usgs_data(start_date=start_date, end_date=end_date)
     for csv_file in csv_files:
         print("uploading {}...".format(csv_file))
-        success = upload_data_from_file(csv_file=csv_file, from_csv=from_csv)
+        upload_data_from_file(csv_file=csv_file, from_csv=from_csv, binary=binary)
+
+    fill_noaa_gaps(dt.datetime.strptime(start_date, "%Y-%m-%d").date(),
+                   dt.datetime.strptime(end_date, "%Y-%m-%d").date())
 
-    fill_noaa_gaps(start_date, end_date)
+
+if __name__ == "__main__":
+    # python continuous_retrieval.py [--csv | --binary] --manual start-date end-date
+    # python continuous_retrieval.py --daily [days-back]
+    # python continuous_retrieval.py --incremental
+    main(sys.argv[1:])
@@ -5,14 +5,23 @@ There are two major methods to be used: daily_run, fill_gaps
 daily run: retrieves weather data from the day prior then computes and inserts predictions for all river runs.
 fill_gaps: the variables day and end can be modified as necessary to retrieve weather measurements between a
 specified date range
+
+retain_measurements downsamples raw measurements older than the retention age. retention is opt-in because it
+deletes raw measurements, daily_run only runs it when given a retention age such as RETENTION_DAYS.
+
+bootstrap_measurement_tables builds the daily rollup and ingest watermarks of a database holding measurements from
+before they existed, daily_run runs it first.
 """
 
-from riverrunner.arima import Arima
+from riverrunner.arima import Arima, DAILY_METRICS
 from riverrunner.context import Prediction
 from riverrunner import continuous_retrieval
 from riverrunner.continuous_retrieval import *
 from riverrunner.repository import Repository
 from sqlalchemy.exc import SQLAlchemyError
+import functools
+import multiprocessing
+import psycopg2
 import time
 
 """maximum number of API retries for Dark Sky"""
@@ -21,6 +30,19 @@ DARK_SKY_RETRIES = 10
 """wait time in seconds between API call"""
 DARK_SKY_WAIT = 600
 
+"""number of worker processes used to fit prediction models, 1 fits every run in the calling process"""
+PREDICTION_WORKERS = 1
+
+"""age in days after which raw measurements are downsampled by retain_measurements, Arima reads four years of data.
+daily_run does not apply it unless passed as retention_days"""
+RETENTION_DAYS = 5*365
+
+"""finest resolution old measurements are kept at, see Repository.clear_measurements"""
+RETENTION_RESOLUTION = 'day'
+
+"""per worker process model, created by _init_prediction_worker"""
+_worker_arima = None
+
 
 def log(message):
     """write log message to file
@@ -57,12 +79,14 @@ def get_weather_observations(session, attempt=0, retries=DARK_SKY_RETRIES, wait=
         log(f'added {added} observations to db')
         return True
 
-    except SQLAlchemyError as e:
-        session.rollback()
+    except (SQLAlchemyError, psycopg2.Error) as e:
+        # measurements are written on a raw connection the repository has already rolled back
+        if isinstance(e, SQLAlchemyError):
+            session.rollback()
         log(f'failed to gather daily observations - {str(e.args)}')
         time.sleep(wait)
 
-        return get_weather_observations(session, attempt+1)
+        return get_weather_observations(session, attempt+1, retries, wait)
 
     except Exception as e:
         log(f'failed to gather daily observations - {str(e.args)}')
@@ -70,59 +94,120 @@ def get_weather_observations(session, attempt=0, retries=DARK_SKY_RETRIES, wait=
 
 
 def get_usgs_observations():
-    """retrieves yesterday's USGS river metrics"""
-    yesterday = dt.date.today() - dt.timedelta(days=1)
-    end_date = yesterday.isoformat()
-
-    csv_files = scrape_usgs_data(start_date=end_date, end_date=end_date)
-    for csv_file in csv_files:
-        log("uploading {}...".format(csv_file))
-        upload_data_from_file(csv_file=csv_file)
+    """retrieves the USGS river metrics added since each site's ingest watermark"""
+    added = stream_usgs_updates()
+    log("uploaded {} USGS measurements".format(added))
 
     return True
 
 
-def compute_predictions(session):
+def _init_prediction_worker(db):
+    """create the database session and model used by a prediction worker process
+
+    Args:
+        db: (dict) connection string for the worker's own database session
+    """
+    global _worker_arima
+
+    context = Context(db)
+    _worker_arima = Arima(context.Session())
+
+
+def _fit_run(job, arima=None, refresh_order=False):
+    """fit the model for a single run
+
+    Args:
+        job: (int, DataFrame, list) run to fit, its daily measurements from Arima.daily_avg and the error reading
+            them, see _prediction_jobs
+        arima: (Arima) optional model to fit with, defaults to the worker process model
+        refresh_order: (bool) optional, re-select the model order instead of using the cached one
+
+    Returns:
+        (run_id, predictions, fit_stats, error): fit_stats is None if no model was fit, error is None if the
+        fit succeeded
+    """
+    run_id, measures, error = job
+    if error is not None:
+        return run_id, None, None, error
+
+    if arima is None:
+        arima = _worker_arima
+
+    try:
+        if measures is None:
+            # nothing to model, same as arima_model without measurements
+            return run_id, pd.DataFrame(), None, None
+
+        predictions = arima.arima_model(run_id, refresh_order=refresh_order, measures=measures)
+        return run_id, predictions, arima.fit_stats.get(run_id), None
+    except Exception as e:
+        return run_id, None, None, [str(a) for a in e.args]
+
+
+def build_predictions(run_id, predictions):
+    """convert a series of predicted flow rates to Prediction objects
+
+    Args:
+        run_id: (int) run the predictions belong to
+        predictions: (Series) predicted flow rates indexed by date
+
+    Returns:
+        [Prediction]
+    """
+    return [
+        Prediction(
+            run_id=run_id,
+            timestamp=pd.to_datetime(d),
+            fr_lb=round(float(p), 1),
+            fr=round(float(p), 1),
+            fr_ub=round(float(p), 1)
+        )
+        for p, d in zip(predictions.values, predictions.index.values)
+    ]
+
+
+def compute_predictions(session, workers=PREDICTION_WORKERS, db=settings.DATABASE, refresh_orders=False):
     """compute and cache predictions for all runs
 
+    the daily measurements of every run are read up front so each station's history is read once. with more
+    than one worker the models are then fit in a process pool, each worker holding its own database
+    session. predictions are collected and written back through the given session in run order so the
+    results are identical to fitting serially.
+
     Args:
         session: (Session) database connection
+        workers: (int) optional number of processes used to fit models
+        db: (dict) optional connection string used by worker processes
+        refresh_orders: (bool) optional, re-select every run's model order instead of using the cached ones
 
     Returns:
         True: if observations were successfully retrieved and inserted
         False: otherwise
     """
     try:
-        arima = Arima(session)
         repo = Repository(session)
 
         runs = repo.get_all_runs_as_list()
-        for run in runs:
+        names = {run.run_id: run.run_name for run in runs}
+        run_ids = [run.run_id for run in runs]
+        if len(run_ids) == 0:
+            return True
+
+        arima = Arima(session)
+        jobs = _prediction_jobs(session, arima, run_ids)
+
+        if workers > 1 and len(run_ids) > 1:
+            pool = multiprocessing.Pool(processes=workers, initializer=_init_prediction_worker, initargs=(db,))
             try:
-                predictions = arima.arima_model(run.run_id)
-
-                to_add = [
-                    Prediction(
-                        run_id=run.run_id,
-                        timestamp=pd.to_datetime(d),
-                        fr_lb=round(float(p), 1),
-                        fr=round(float(p), 1),
-                        fr_ub=round(float(p), 1)
-                    )
-                    for p, d in zip(predictions.values, predictions.index.values)
-                ]
-
-                repo.clear_predictions(run.run_id)
-                repo.put_predictions(to_add)
-                log(f'predictions for {run.run_id}-{run.run_name} added to db')
-                return True
-
-            except SQLAlchemyError as e:
-                log(f'{run.run_id}-{run.run_name} failed - {[str(a) for a in e.args]}')
-                session.rollback()
-
-            except Exception as e:
-                log(f'predictions for {run.run_id}-{run.run_name} failed - {[str(a) for a in e.args]}')
+                fit = functools.partial(_fit_run, refresh_order=refresh_orders)
+                results = pool.imap(fit, jobs)
+                _put_predictions(session, repo, names, results)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = (_fit_run(job, arima, refresh_orders) for job in jobs)
+            _put_predictions(session, repo, names, results)
 
         return True
 
@@ -131,14 +216,148 @@ def compute_predictions(session):
         return False
 
 
-def daily_run(db_context):
-    """perform the daily observation retrieval and flow rate predictions"""
+def _prediction_jobs(session, arima, run_ids):
+    """read the daily measurements of every run, isolating the runs whose measurements cannot be read
+
+    the daily rollup of every run is read in one pass. if that read fails each run is read on its own, so one
+    bad run only fails its own predictions
+
+    Args:
+        session: (Session) database connection used by arima
+        arima: (Arima) model reading the measurements
+        run_ids: ([int]) runs to read
+
+    Returns:
+        [(run_id, measures, error)]: measures from Arima.daily_avg, error is None if they were read
+    """
+    metric_ids = [m[0] for m in DAILY_METRICS]
+    try:
+        daily = arima.get_daily_data_for_runs(run_ids, metric_ids=metric_ids)
+    except Exception as e:
+        log(f'failed to read daily measurements of all runs, reading each run - {str(e.args)}')
+        session.rollback()
+        daily = {}
+
+    jobs = []
+    for run_id in run_ids:
+        try:
+            jobs.append((run_id, arima.daily_avg(run_id, daily.get(run_id)), None))
+        except Exception as e:
+            session.rollback()
+            jobs.append((run_id, None, [str(a) for a in e.args]))
+
+    return jobs
+
+
+def _put_predictions(session, repo, names, results):
+    """replace the cached predictions for each fitted run
+
+    Args:
+        session: (Session) database connection
+        repo: (Repository) repository writing the predictions
+        names: (dict) run names keyed by run id
+        results: iterable of (run_id, predictions, fit_stats, error) tuples
+    """
+    for run_id, predictions, fit_stats, error in results:
+        if error is not None:
+            log(f'predictions for {run_id}-{names[run_id]} failed - {error}')
+            continue
+
+        try:
+            repo.clear_predictions(run_id)
+            repo.put_predictions(build_predictions(run_id, predictions))
+            if fit_stats is None:
+                log(f'predictions for {run_id}-{names[run_id]} added to db')
+            else:
+                start = 'warm' if fit_stats['warm_start'] else 'cold'
+                log(f'predictions for {run_id}-{names[run_id]} added to db - '
+                    f'{fit_stats["iterations"]} iterations, {start} start')
+
+        except SQLAlchemyError as e:
+            log(f'{run_id}-{names[run_id]} failed - {[str(a) for a in e.args]}')
+            session.rollback()
+
+        except Exception as e:
+            log(f'predictions for {run_id}-{names[run_id]} failed - {[str(a) for a in e.args]}')
+
+
+def retain_measurements(session, days=RETENTION_DAYS, resolution=RETENTION_RESOLUTION, archive_file=None,
+                        dry_run=False):
+    """downsample raw measurements older than the retention age and write the report to log
+
+    Args:
+        session: (Session) database connection
+        days: (int) optional age in days of the oldest raw measurements kept
+        resolution: (str) optional 'day' or 'hour', finest resolution kept for older measurements
+        archive_file: (str) optional file to archive the removed measurements to
+        dry_run: (bool) optional, only report what would be removed
+
+    Returns:
+        dict: the report of Repository.clear_measurements
+    """
+    repo = Repository(session)
+    before = dt.datetime.now() - dt.timedelta(days=days)
+
+    report = repo.clear_measurements(before, resolution=resolution, archive_file=archive_file, dry_run=dry_run)
+
+    action = 'would remove' if dry_run else 'removed'
+    # day resolution keeps no measurement rows, only the daily rollup
+    kept = f'{report["kept"]} hourly means' if resolution == 'hour' else 'the daily rollup'
+    log(f'retention before {report["cutoff"].date().isoformat()} {action} {report["rows"]} measurements, '
+        f'kept {kept}, about {report["bytes"] / 2**20:.1f} MiB')
+
+    return report
+
+
+def bootstrap_measurement_tables(session):
+    """build the tables derived from measurements when a database has measurements stored before they existed
+
+    each table is only built while it is empty, so this costs one query per table once they have been built
+
+    Args:
+        session: (Session) database connection
+
+    Returns:
+        bool: True if nothing failed
+    """
+    try:
+        repo = Repository(session)
+
+        built = repo.put_daily_measurements(if_empty=True)
+        if built > 0:
+            log(f'built the daily rollup of {built} station metrics')
+
+        built = repo.put_ingest_watermarks(if_empty=True)
+        if built > 0:
+            log(f'built the ingest watermarks of {built} station metrics')
+
+        return True
+
+    except Exception as e:
+        log(f'failed to build the measurement tables - {str(e.args)}')
+        return False
+
+
+def daily_run(db_context, workers=PREDICTION_WORKERS, retention_days=None):
+    """perform the daily observation retrieval and flow rate predictions
+
+    Args:
+        db_context: (dict) database connection string
+        workers: (int) optional number of processes used to fit models
+        retention_days: (int) optional, downsample raw measurements older than this many days after predicting.
+            retention is opt-in, None keeps every raw measurement, RETENTION_DAYS is the recommended age
+    """
     context = Context(db_context)
     session = context.Session()
 
+    # before any new measurement is put, which would make the tables non-empty
+    bootstrap_measurement_tables(session)
     get_weather_observations(session)
     get_usgs_observations()
-    compute_predictions(session)
+    compute_predictions(session, workers=workers, db=db_context)
+
+    if retention_days is not None:
+        retain_measurements(session, days=retention_days)
 
     session.close()
 
@@ -0,0 +1,270 @@
+"""
+Module for requests to the external APIs.
+
+Every request goes through a pooled session so connections to each host are kept alive and reused. Requests time
+out instead of hanging, failed attempts are retried with jittered exponential backoff and hosts that keep failing are
+skipped until they recover, so one dead service cannot stall the daily run.
+
+Functions:
+    get: send a GET request through the process's client
+
+    get_client: the process's shared client
+
+Classes:
+    CircuitBreaker: tracks the failures of a host and stops requests to it while it is down
+
+    CircuitOpenError: raised instead of sending a request to a host whose circuit is open
+
+    HttpClient: pooled session with timeouts, retries and a circuit breaker per host
+"""
+
+import os
+import random
+import threading
+import time
+import urllib.parse
+import requests
+from requests.adapters import HTTPAdapter
+
+"""seconds to wait for a connection to be established"""
+CONNECT_TIMEOUT = 10.
+
+"""seconds to wait between bytes of the response"""
+READ_TIMEOUT = 60.
+
+"""attempts made after the first one fails"""
+RETRIES = 4
+
+"""seconds of the first backoff, doubled for every further attempt"""
+BACKOFF = 1.
+
+"""longest backoff in seconds, also caps the Retry-After of a rate limited response"""
+MAX_BACKOFF = 60.
+
+"""response statuses that are retried"""
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+"""hosts and connections per host kept alive, at least the number of threads requesting one host"""
+POOL_HOSTS = 10
+POOL_SIZE = 16
+
+"""consecutive failed requests that open a host's circuit"""
+BREAKER_FAILURES = 5
+
+"""seconds a host's circuit stays open before a single trial request is let through"""
+BREAKER_RESET = 300.
+
+"""shared client of each process keyed by process id, clients are not shared across a fork"""
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+class CircuitOpenError(requests.RequestException):
+    """a request was not sent because its host's circuit is open"""
+    pass
+
+
+class CircuitBreaker:
+    """tracks consecutive failed requests to a host
+
+    the circuit opens after a number of consecutive failures and requests are refused while it is open. once the
+    reset time has passed a single trial request is allowed, its success closes the circuit and its failure opens it
+    again.
+
+    Args:
+        failures (int): consecutive failures that open the circuit
+        reset (float): seconds the circuit stays open before a trial request
+    """
+    def __init__(self, failures=BREAKER_FAILURES, reset=BREAKER_RESET):
+        self.failures = failures
+        self.reset = reset
+
+        self.__failed = 0
+        self.__opened = None
+        self.__trial = False
+        self.__lock = threading.Lock()
+
+    @property
+    def open(self):
+        """whether requests are currently refused"""
+        with self.__lock:
+            return self.__opened is not None and (self.__trial or time.monotonic() - self.__opened < self.reset)
+
+    def allow(self):
+        """whether a request may be sent now
+
+        Returns:
+            bool: True while closed, and for one trial request once the reset time has passed
+        """
+        with self.__lock:
+            if self.__opened is None:
+                return True
+
+            if not self.__trial and time.monotonic() - self.__opened >= self.reset:
+                self.__trial = True
+                return True
+
+            return False
+
+    def record_failure(self):
+        """count a failed request, opening the circuit once there are enough in a row"""
+        with self.__lock:
+            self.__failed += 1
+            self.__trial = False
+            if self.__failed >= self.failures:
+                self.__opened = time.monotonic()
+
+    def record_success(self):
+        """close the circuit"""
+        with self.__lock:
+            self.__failed = 0
+            self.__opened = None
+            self.__trial = False
+
+
+class HttpClient:
+    """pooled HTTP session with timeouts, retries and a circuit breaker per host
+
+    connection errors, timeouts and RETRY_STATUSES responses are retried after a backoff drawn uniformly between
+    zero and BACKOFF doubled for every attempt, capped at MAX_BACKOFF. a rate limited response's Retry-After is used
+    instead when it is given in seconds. a request that still fails counts against its host's circuit breaker.
+
+    Notes:
+        * the last response is returned if every attempt got a retried status, so callers keep checking status_code
+        * safe to share between threads
+
+    Args:
+        connect_timeout (float): seconds to wait for a connection
+        read_timeout (float): seconds to wait between bytes of the response
+        retries (int): attempts made after the first one fails
+        backoff (float): seconds of the first backoff
+        max_backoff (float): longest backoff in seconds
+        failures (int): consecutive failed requests that open a host's circuit
+        reset (float): seconds a host's circuit stays open
+        pool_size (int): connections kept alive per host
+    """
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, retries=RETRIES, backoff=BACKOFF,
+                 max_backoff=MAX_BACKOFF, failures=BREAKER_FAILURES, reset=BREAKER_RESET, pool_size=POOL_SIZE):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failures = failures
+        self.reset = reset
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.__breakers = {}
+        self.__lock = threading.Lock()
+
+    def breaker(self, url):
+        """the circuit breaker of a url's host
+
+        Args:
+            url (str): any url of the host
+
+        Returns:
+            CircuitBreaker: created on first use
+        """
+        host = urllib.parse.urlsplit(url).netloc
+        with self.__lock:
+            if host not in self.__breakers:
+                self.__breakers[host] = CircuitBreaker(self.failures, self.reset)
+
+            return self.__breakers[host]
+
+    def get(self, url, params=None, **kwargs):
+        """send a GET request, see request
+
+        Returns:
+            Response: the response
+        """
+        return self.request('GET', url, params=params, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """send a request, retrying failed attempts
+
+        Args:
+            method (str): HTTP method
+            url (str): url to request
+            **kwargs: passed to requests.Session.request, timeout defaults to the client's timeouts
+
+        Returns:
+            Response: the first response without a retried status, or the last response
+
+        Raises:
+            CircuitOpenError: if the host's circuit is open
+            ConnectionError: if the last attempt could not connect
+            Timeout: if the last attempt timed out
+            RequestException: any other error of an attempt, raised at once and counted as a failure
+        """
+        breaker = self.breaker(url)
+        if not breaker.allow():
+            raise CircuitOpenError(f'circuit open for {urllib.parse.urlsplit(url).netloc}')
+
+        kwargs.setdefault('timeout', (self.connect_timeout, self.read_timeout))
+
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    response, error = self.session.request(method, url, **kwargs), None
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    response, error = None, e
+                else:
+                    if response.status_code not in RETRY_STATUSES:
+                        breaker.record_success()
+                        return response
+
+                if attempt < self.retries:
+                    time.sleep(self.__backoff(attempt, response))
+        except:
+            # errors that are not retried still count, so a trial request never leaves its circuit half open
+            breaker.record_failure()
+
+            raise
+
+        breaker.record_failure()
+        if error is not None:
+            raise error
+
+        return response
+
+    def __backoff(self, attempt, response):
+        """seconds to wait before the next attempt"""
+        retry_after = None if response is None else response.headers.get('Retry-After')
+        if retry_after is not None and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+def get_client():
+    """the shared client of this process
+
+    Returns:
+        HttpClient: created with the module defaults on first use
+    """
+    pid = os.getpid()
+    with _CLIENTS_LOCK:
+        if pid not in _CLIENTS:
+            _CLIENTS[pid] = HttpClient()
+
+        return _CLIENTS[pid]
+
+
+def get(url, params=None, **kwargs):
+    """send a GET request through the shared client of this process
+
+    Args:
+        url (str): url to request
+        params (dict): optional query parameters
+        **kwargs: see HttpClient.request
+
+    Returns:
+        Response: the response
+    """
+    return get_client().get(url, params=params, **kwargs)
@@ -0,0 +1,253 @@
+"""
+Module for parsing JSON documents incrementally.
+
+Large API responses are parsed as their body arrives instead of being loaded whole, so memory holds only the
+items being read rather than the whole document. Locations in a document are paths of object keys and array
+indexes, e.g. ('value', 'timeSeries', 0, 'values'). Prefixes select locations with dotted keys, where 'item' stands
+for any array index, e.g. 'value.timeSeries.item.values'.
+
+Functions:
+    iter_events: yields the parse events of a document as its chunks arrive
+
+    iter_items: yields the complete values found at a set of prefixes as their chunks arrive
+"""
+
+import codecs
+import json
+import re
+
+"""characters skipped between tokens"""
+WHITESPACE = frozenset(' \t\n\r')
+
+"""a complete JSON string token including its quotes"""
+STRING_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+
+"""the characters a number token may hold, and a valid JSON number"""
+NUMBER_CHARACTERS = re.compile(r'[-+.eE0-9]*')
+NUMBER_PATTERN = re.compile(r'-?(?:0|[1-9]\d*)(\.\d+)?([eE][-+]?\d+)?$')
+
+"""JSON literals and their values"""
+LITERALS = {'true': True, 'false': False, 'null': None}
+
+
+def iter_events(chunks):
+    """parse a JSON document as its chunks arrive
+
+    Args:
+        chunks (iterable): str or utf-8 encoded bytes chunks of the document, split anywhere
+
+    Yields:
+        (tuple, str, object): path of the value, event and scalar. events are 'start_map', 'end_map', 'start_array',
+        'end_array' and 'value', the scalar is None for all but 'value'
+
+    Raises:
+        ValueError: if the document is not valid JSON
+    """
+    tokens = _tokens(chunks)
+    yield from _value_events(tokens, _next_token(tokens), ())
+
+    if next(tokens, None) is not None:
+        raise ValueError('extra data after the document')
+
+
+def iter_items(chunks, *prefixes):
+    """yield the values found at a set of prefixes as their chunks arrive
+
+    each value is built once it is complete and nothing outside the selected values is kept, so memory is bounded
+    by the largest selected value. values nested in another selected value are only returned as part of it.
+
+    Args:
+        chunks (iterable): str or utf-8 encoded bytes chunks of the document, split anywhere
+        *prefixes (str): dotted keys of the values to yield, 'item' standing for any array index and '' for the
+            whole document
+
+    Yields:
+        (tuple, object): path and value in document order
+
+    Raises:
+        ValueError: if the document is not valid JSON
+    """
+    patterns = {}
+    for prefix in prefixes:
+        pattern = tuple(prefix.split('.')) if prefix else ()
+        patterns.setdefault(len(pattern), []).append(pattern)
+
+    events = iter_events(chunks)
+    for path, event, value in events:
+        if event in ('end_map', 'end_array') or not _matches(path, patterns.get(len(path), [])):
+            continue
+
+        if event == 'value':
+            yield path, value
+        else:
+            yield path, _build(events, event)
+
+
+def _build(events, event):
+    """build the map or array just started from the events up to its end"""
+    root = {} if event == 'start_map' else []
+    stack = [root]
+    for path, event, value in events:
+        if event in ('end_map', 'end_array'):
+            stack.pop()
+            if len(stack) == 0:
+                return root
+            continue
+
+        item = value if event == 'value' else {} if event == 'start_map' else []
+        parent = stack[-1]
+        if isinstance(parent, dict):
+            parent[path[-1]] = item
+        else:
+            parent.append(item)
+
+        if event != 'value':
+            stack.append(item)
+
+    raise ValueError('unexpected end of the document')
+
+
+def _literal_prefix(text):
+    """whether text could be the start of a literal cut off by the end of a chunk"""
+    return len(text) < 5 and any(literal.startswith(text) for literal in LITERALS)
+
+
+def _matches(path, patterns):
+    """whether a path matches any of the patterns of its length"""
+    for pattern in patterns:
+        if all(isinstance(p, int) if key == 'item' else p == key for p, key in zip(path, pattern)):
+            return True
+
+    return False
+
+
+def _next_token(tokens):
+    """the next token, raising at the end of the document"""
+    token = next(tokens, None)
+    if token is None:
+        raise ValueError('unexpected end of the document')
+
+    return token
+
+
+def _value_events(tokens, token, path):
+    """the events of the value starting with a token"""
+    kind, value = token
+    if kind == '{':
+        yield path, 'start_map', None
+        token = _next_token(tokens)
+        while token[0] != '}':
+            if token[0] != 'string':
+                raise ValueError(f'expected an object key at {path}')
+            key = token[1]
+
+            if _next_token(tokens)[0] != ':':
+                raise ValueError(f'expected ":" after key {key!r} at {path}')
+            yield from _value_events(tokens, _next_token(tokens), path + (key,))
+
+            token = _next_token(tokens)
+            if token[0] == ',':
+                token = _next_token(tokens)
+                if token[0] == '}':
+                    raise ValueError(f'trailing "," at {path}')
+            elif token[0] != '}':
+                raise ValueError(f'expected "," or "}}" at {path}')
+        yield path, 'end_map', None
+
+    elif kind == '[':
+        yield path, 'start_array', None
+        token = _next_token(tokens)
+        index = 0
+        while token[0] != ']':
+            yield from _value_events(tokens, token, path + (index,))
+            index += 1
+
+            token = _next_token(tokens)
+            if token[0] == ',':
+                token = _next_token(tokens)
+                if token[0] == ']':
+                    raise ValueError(f'trailing "," at {path}')
+            elif token[0] != ']':
+                raise ValueError(f'expected "," or "]" at {path}')
+        yield path, 'end_array', None
+
+    elif kind in ('string', 'scalar'):
+        yield path, 'value', value
+
+    else:
+        raise ValueError(f'unexpected {kind!r} at {path}')
+
+
+def _tokens(chunks):
+    """split the chunks of a document into tokens
+
+    tokens split across chunks are completed from the following chunks before they are yielded
+
+    Yields:
+        (str, object): punctuation with None, ('string', str) or ('scalar', number, bool or None)
+    """
+    chunks = iter(chunks)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer, pos, eof = '', 0, False
+
+    def fill():
+        """append the next chunk to the unread part of the buffer, returns False at the end of the document"""
+        nonlocal buffer, pos, eof
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            rest = decoder.decode(b'', final=True)
+        else:
+            rest = decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+
+        buffer, pos = buffer[pos:] + rest, 0
+        return not eof
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in WHITESPACE:
+            pos += 1
+
+        if pos == len(buffer):
+            if fill():
+                continue
+            return
+
+        c = buffer[pos]
+        if c in '{}[]:,':
+            pos += 1
+            yield c, None
+
+        elif c == '"':
+            match = STRING_PATTERN.match(buffer, pos)
+            if match is None:
+                if fill():
+                    continue
+                raise ValueError('unterminated string')
+
+            pos = match.end()
+            yield 'string', json.decoder.scanstring(match.group(0), 1)[0]
+
+        elif c == '-' or c.isdigit():
+            end = NUMBER_CHARACTERS.match(buffer, pos).end()
+            if end == len(buffer) and not eof:
+                fill()
+                continue
+
+            number = buffer[pos:end]
+            match = NUMBER_PATTERN.match(number)
+            if match is None:
+                raise ValueError(f'invalid number {number!r}')
+
+            pos = end
+            yield 'scalar', float(number) if match.group(1) or match.group(2) else int(number)
+
+        else:
+            for literal, value in LITERALS.items():
+                if buffer.startswith(literal, pos):
+                    pos += len(literal)
+                    yield 'scalar', value
+                    break
+            else:
+                if _literal_prefix(buffer[pos:]) and fill():
+                    continue
+                raise ValueError(f'unexpected {buffer[pos:pos + 20]!r}')
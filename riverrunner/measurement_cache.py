@@ -0,0 +1,276 @@
+"""
+Module for caching measurement reads.
+
+Repeated reads of the same stations over overlapping windows, e.g. four years to today asked again the next day,
+only need the part of the window not read before. The cache keeps, for every set of stations and metrics, the
+measurements read so far and the date ranges they cover, and fetches only the missing ranges.
+
+Classes:
+    MeasurementCache: range-aware cache of measurement frames with least recently used eviction by memory size
+
+Attributes:
+    MEASUREMENT_CACHE: process-wide cache read by repositories created with cached=True and invalidated by every
+    repository write
+"""
+
+import collections
+import datetime
+import threading
+import pandas as pd
+
+"""memory in bytes the process-wide cache may hold before evicting the least recently used entries"""
+MAX_CACHE_BYTES = 256 * 2**20
+
+"""measurements more recent than this are never recorded as covered since late data may still arrive for them"""
+CACHE_SETTLE = datetime.timedelta(days=1)
+
+"""columns identifying a measurement"""
+MEASUREMENT_KEY = ['station_id', 'metric_id', 'date_time']
+
+
+def subtract_ranges(ranges, start, end):
+    """the parts of a date range not covered by a set of ranges
+
+    Args:
+        ranges ([(DateTime, DateTime)]): sorted, non-overlapping half-open ranges
+        start (DateTime): beginning of the range
+        end (DateTime): end of the range, exclusive
+
+    Returns:
+        [(DateTime, DateTime)]: sorted half-open ranges
+    """
+    missing = []
+    for first, last in ranges:
+        if last <= start or first >= end:
+            continue
+
+        if first > start:
+            missing.append((start, first))
+        start = max(start, last)
+
+    if start < end:
+        missing.append((start, end))
+
+    return missing
+
+
+def union_ranges(ranges, start, end):
+    """add a date range to a set of ranges
+
+    Args:
+        ranges ([(DateTime, DateTime)]): sorted, non-overlapping half-open ranges
+        start (DateTime): beginning of the range
+        end (DateTime): end of the range, exclusive
+
+    Returns:
+        [(DateTime, DateTime)]: sorted, non-overlapping half-open ranges
+    """
+    merged = []
+    for first, last in sorted(ranges + [(start, end)]):
+        if len(merged) > 0 and first <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+
+    return merged
+
+
+def _frame_bytes(frame):
+    """memory held by a frame"""
+    return int(frame.memory_usage(deep=True).sum()) if len(frame) > 0 else 0
+
+
+def _in_range(frame, start_date, end_date):
+    """mask of the rows of a frame within a half-open range, None bounds are open"""
+    mask = pd.Series(True, index=frame.index)
+    if start_date is not None:
+        mask &= frame.date_time >= start_date
+    if end_date is not None:
+        mask &= frame.date_time < end_date
+
+    return mask
+
+
+def _replace_ranges(frame, ranges, fetched):
+    """replace the rows of a frame within each range by the frame fetched for it
+
+    Returns:
+        DataFrame: ordered by date_time
+    """
+    if len(frame) > 0 and len(ranges) > 0:
+        stale = pd.Series(False, index=frame.index)
+        for first, last in ranges:
+            stale |= _in_range(frame, first, last)
+        frame = frame[~stale]
+
+    frames = [f for f in [frame] + fetched if len(f) > 0]
+    if len(frames) == 0:
+        return pd.DataFrame()
+    if len(frames) == 1 and len(ranges) == 0:
+        return frames[0]
+
+    return pd.concat(frames, ignore_index=True)\
+        .drop_duplicates(MEASUREMENT_KEY, keep='last')\
+        .sort_values('date_time')\
+        .reset_index(drop=True)
+
+
+class MeasurementCache:
+    """range-aware cache of measurement frames
+
+    entries are keyed by the source read, a set of station ids and an optional set of metric ids. each entry holds
+    the measurements read for its key and the date ranges they cover. entries are evicted least recently used first once the frames
+    together exceed the memory limit.
+
+    Notes:
+        * only writes made through a repository in this process invalidate the cache, writes made elsewhere are
+        seen once they are older than the settle time
+        * safe to share between threads, a read racing a write to its range returns what it fetched without
+        caching it
+
+    Attributes:
+        max_bytes (int): memory limit of the cached frames
+        settle (timedelta): measurements more recent than this are always fetched again
+    """
+    def __init__(self, max_bytes=MAX_CACHE_BYTES, settle=CACHE_SETTLE):
+        self.max_bytes = max_bytes
+        self.settle = settle
+
+        self.__entries = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @property
+    def bytes(self):
+        """memory held by the cached frames"""
+        return sum(entry['bytes'] for entry in self.__entries.values())
+
+    def clear(self):
+        """remove every entry
+
+        Returns:
+            None
+        """
+        with self.__lock:
+            self.__entries.clear()
+
+    def get(self, station_ids, metric_ids, start_date, end_date, fetch, source=None):
+        """read measurements, fetching only the parts of the range not already cached
+
+        the fetched ranges replace whatever the entry held for them. if the entry is invalidated while a range is
+        being fetched the fetched measurements may predate the write, so they are returned but not cached
+
+        Args:
+            station_ids ([str]): stations to read
+            metric_ids ([str]): metrics to read, None for all
+            start_date (DateTime): beginning of the range
+            end_date (DateTime): end of the range, exclusive
+            fetch (callable): fetch(start_date, end_date) returns a frame of the measurements in a range
+            source (hashable): optional identity of the database and table read, reads of different sources never
+                share an entry
+
+        Returns:
+            DataFrame: measurements in the range ordered by date_time, empty without columns if there are none
+        """
+        key = (source, frozenset(station_ids), None if metric_ids is None else frozenset(str(m) for m in metric_ids))
+
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                entry = {'frame': pd.DataFrame(), 'ranges': [], 'bytes': 0, 'generation': 0}
+                self.__entries[key] = entry
+            generation = entry['generation']
+            cached = entry['frame']
+            missing = subtract_ranges(entry['ranges'], start_date, end_date)
+
+        # fetch outside the lock so slow reads do not block other keys
+        fetched = [fetch(first, last) for first, last in missing]
+
+        with self.__lock:
+            # an invalidated, cleared or evicted entry is not updated
+            current = self.__entries.get(key) is entry and entry['generation'] == generation
+            frame = _replace_ranges(entry['frame'] if current else cached, missing, fetched)
+
+            if current:
+                horizon = datetime.datetime.now() - self.settle
+                for first, last in missing:
+                    last = min(last, horizon)
+                    if first < last:
+                        entry['ranges'] = union_ranges(entry['ranges'], first, last)
+
+                entry['frame'] = frame
+                entry['bytes'] = _frame_bytes(frame)
+                self.__entries.move_to_end(key)
+                self.__evict()
+
+        if len(frame) == 0:
+            return pd.DataFrame()
+
+        frame = frame[(frame.date_time >= start_date) & (frame.date_time < end_date)]
+        return frame.reset_index(drop=True) if len(frame) > 0 else pd.DataFrame()
+
+    def invalidate(self, station_id=None, metric_id=None, start_date=None, end_date=None, source=None):
+        """forget cached measurements so they are read again
+
+        the measurements of the station and metric within the range are dropped from every entry holding them and
+        the range is no longer covered, so measurements deleted from the database are not served from the cache
+
+        Args:
+            station_id (str): optional station changed, defaults to every station
+            metric_id (str): optional metric changed, defaults to every metric
+            start_date (DateTime): optional beginning of the range changed, defaults to the earliest measurement
+            end_date (DateTime): optional end of the range changed, inclusive, defaults to the latest measurement
+            source (hashable): optional source changed, see get, defaults to every source
+
+        Returns:
+            None
+        """
+        with self.__lock:
+            for key in list(self.__entries):
+                entry_source, station_ids, metric_ids = key
+                if source is not None and entry_source != source:
+                    continue
+                if station_id is not None and station_id not in station_ids:
+                    continue
+                if metric_id is not None and metric_ids is not None and metric_id not in metric_ids:
+                    continue
+
+                if start_date is None and end_date is None:
+                    del self.__entries[key]
+                    continue
+
+                # whole days are forgotten, the end is inclusive
+                first = None if start_date is None else \
+                    datetime.datetime(start_date.year, start_date.month, start_date.day)
+                last = None if end_date is None else \
+                    datetime.datetime(end_date.year, end_date.month, end_date.day) + datetime.timedelta(days=1)
+
+                entry = self.__entries[key]
+                entry['generation'] += 1
+                entry['ranges'] = [
+                    kept for r in entry['ranges']
+                    for kept in subtract_ranges([(first or datetime.datetime.min, last or datetime.datetime.max)], *r)
+                ]
+
+                frame = entry['frame']
+                if len(frame) > 0:
+                    stale = _in_range(frame, first, last)
+                    if station_id is not None:
+                        stale &= frame.station_id == station_id
+                    if metric_id is not None:
+                        stale &= frame.metric_id == metric_id
+                    entry['frame'] = frame[~stale].reset_index(drop=True)
+                    entry['bytes'] = _frame_bytes(entry['frame'])
+
+    def __evict(self):
+        """drop least recently used entries until the cache fits in its memory limit"""
+        total = self.bytes
+        while total > self.max_bytes and len(self.__entries) > 1:
+            _, entry = self.__entries.popitem(last=False)
+            total -= entry['bytes']
+
+
+"""process-wide cache read by repositories created with cached=True"""
+MEASUREMENT_CACHE = MeasurementCache()
@@ -5,34 +5,491 @@ The repository class represents an abstraction for the user to interface with th
 standard CRUD operations as defined below.
 """
 
+import contextlib
 import datetime
+import itertools
+import numpy as np
 import pandas as pd
-import psycopg2
+import psycopg2.extras
+import struct
+import uuid
 from riverrunner import context
-from riverrunner.context import Measurement, Prediction, RiverRun, Station, StationRiverDistance
+from riverrunner import measurement_cache
+from riverrunner.context import ModelOrder, ModelParameters, Prediction, RiverRun, Station, StationRiverDistance
 from riverrunner import settings
 from sqlalchemy.exc import SQLAlchemyError
 
+"""store and read measurements in the compact layout by default, see context.compact_measurement_table"""
+COMPACT_MEASUREMENTS = False
+
+"""read measurements through the process-wide measurement_cache.MEASUREMENT_CACHE by default"""
+CACHE_MEASUREMENTS = False
+
+"""recomputes the daily rollup of a station's metric for every day between two timestamps, format with the
+measurement relation"""
+DAILY_ROLLUP_SQL = """
+    INSERT INTO daily_measurement (station_id, metric_id, day, value_sum, value_mean, value_count)
+        SELECT station_id, metric_id, date_trunc('day', date_time), SUM(value), AVG(value), COUNT(value)
+        FROM {measurement}
+        WHERE station_id = %(station_id)s
+            AND metric_id = %(metric_id)s
+            AND date_time >= date_trunc('day', %(start)s::timestamp)
+            AND date_time < date_trunc('day', %(end)s::timestamp) + interval '1 day'
+        GROUP BY station_id, metric_id, date_trunc('day', date_time)
+    ON CONFLICT (station_id, metric_id, day)
+        DO UPDATE SET value_sum = EXCLUDED.value_sum,
+                      value_mean = EXCLUDED.value_mean,
+                      value_count = EXCLUDED.value_count;
+"""
+
+"""per-load staging table, private to the connection and dropped when the load commits or rolls back"""
+STAGING_TABLE = 'staging_measurement'
+
+"""creates the staging table, position records load order so the last copy of a duplicated measurement wins"""
+STAGING_TABLE_SQL = f"""
+    CREATE TEMPORARY TABLE {STAGING_TABLE} (LIKE measurement, position bigserial) ON COMMIT DROP;
+"""
+
+"""merges the staging table into measurement, only changed values are rewritten and returned as ranges"""
+MERGE_STAGING_SQL = f"""
+    WITH merged AS (
+        INSERT INTO measurement (station_id, metric_id, date_time, value)
+            SELECT DISTINCT ON (station_id, metric_id, date_time) station_id, metric_id, date_time, value
+            FROM {STAGING_TABLE}
+            ORDER BY station_id, metric_id, date_time, position DESC
+        ON CONFLICT (station_id, metric_id, date_time)
+            DO UPDATE SET value = EXCLUDED.value
+            WHERE measurement.value IS DISTINCT FROM EXCLUDED.value
+        RETURNING station_id, metric_id, date_time
+    )
+    SELECT station_id, metric_id, MIN(date_time), MAX(date_time)
+    FROM merged
+    GROUP BY station_id, metric_id;
+"""
+
+"""merges the staging table into compact_measurement, translating ids to the keys assigned by
+context.put_measurement_keys"""
+COMPACT_MERGE_STAGING_SQL = f"""
+    WITH merged AS (
+        INSERT INTO compact_measurement (station_key, metric_key, date_time, value)
+            SELECT DISTINCT ON (sk.station_key, mk.metric_key, s.date_time)
+                sk.station_key, mk.metric_key, s.date_time, s.value
+            FROM {STAGING_TABLE} s
+                JOIN station_key sk ON sk.station_id = s.station_id
+                JOIN metric_key mk ON mk.metric_id = s.metric_id
+            ORDER BY sk.station_key, mk.metric_key, s.date_time, s.position DESC
+        ON CONFLICT (station_key, metric_key, date_time)
+            DO UPDATE SET value = EXCLUDED.value
+            WHERE compact_measurement.value IS DISTINCT FROM EXCLUDED.value
+        RETURNING station_key, metric_key, date_time
+    )
+    SELECT sk.station_id, mk.metric_id, MIN(m.date_time), MAX(m.date_time)
+    FROM merged m
+        JOIN station_key sk ON sk.station_key = m.station_key
+        JOIN metric_key mk ON mk.metric_key = m.metric_key
+    GROUP BY sk.station_id, mk.metric_id;
+"""
+
+"""rows sent to the server in each statement by Repository.put_measurements_from_list(upsert=True)"""
+UPSERT_PAGE_SIZE = 10000
+
+"""inserts measurements or overwrites the value of existing ones, rows are expanded by execute_values"""
+MEASUREMENT_UPSERT_SQL = """
+    INSERT INTO measurement (station_id, metric_id, date_time, value)
+        VALUES %s
+    ON CONFLICT (station_id, metric_id, date_time)
+        DO UPDATE SET value = EXCLUDED.value
+        WHERE measurement.value IS DISTINCT FROM EXCLUDED.value;
+"""
+
+"""moves the ingest watermark of a station's metric forward to the last timestamp written, never back"""
+INGEST_WATERMARK_SQL = """
+    INSERT INTO ingest_watermark (station_id, metric_id, date_time, updated)
+        VALUES (%(station_id)s, %(metric_id)s, %(end)s, now())
+    ON CONFLICT (station_id, metric_id)
+        DO UPDATE SET date_time = EXCLUDED.date_time, updated = EXCLUDED.updated
+        WHERE ingest_watermark.date_time < EXCLUDED.date_time;
+"""
+
+
+"""resolutions Repository.clear_measurements keeps old measurements at, day keeps only the daily rollup"""
+RETENTION_RESOLUTIONS = ('day', 'hour')
+
+"""total on-disk size, including indexes and partitions, and estimated row count of a table"""
+RELATION_SIZE_SQL = """
+    SELECT COALESCE(SUM(pg_total_relation_size(c.oid)), 0), COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)
+    FROM pg_class c
+    WHERE c.oid = %(relation)s::regclass
+        OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %(relation)s::regclass);
+"""
+
+
+"""weather station sources whose closest station is referenced for every run"""
+STATION_SOURCES = ('NOAA', 'USGS', 'SNOW')
+
+"""closest station of each source keyed by run id, cleared by Repository.put_station_river_distances"""
+_NEAREST_STATIONS = {}
+
+"""number of measurements in each frame yielded by Repository.iter_measurements"""
+MEASUREMENT_CHUNK_SIZE = 100000
+
+"""columns of the measurement frames returned by get_measurements"""
+MEASUREMENT_COLUMNS = ['date_time', 'metric_id', 'source', 'station_id', 'value']
+
+"""reads measurements and their station's source for a set of stations over a date range, format with the
+measurement relation"""
+MEASUREMENT_SQL = """
+    SELECT m.date_time, m.metric_id, s.source, m.station_id, m.value
+    FROM {measurement} m
+        JOIN station s ON s.station_id = m.station_id
+    WHERE m.station_id = ANY(%(station_ids)s)
+        AND m.date_time >= %(start)s
+        AND m.date_time < %(end)s
+"""
+
+"""metric filter added to a station read given metric ids, format with the alias of the table holding metric_id"""
+METRIC_FILTER_SQL = " AND {alias}.metric_id = ANY(%(metric_ids)s)"
+
+"""resolutions get_measurements can aggregate measurements to in the database"""
+AGGREGATE_RESOLUTIONS = ('hour', 'day')
+
+"""SQL aggregate of each aggregation get_measurements accepts"""
+AGGREGATES = {'count': 'COUNT', 'max': 'MAX', 'mean': 'AVG', 'min': 'MIN', 'sum': 'SUM'}
+
+"""columns of the aggregated measurement frames returned by get_measurements"""
+AGGREGATE_MEASUREMENT_COLUMNS = ['date_time', 'metric_id', 'source', 'station_id', 'value', 'value_count']
+
+"""aggregates measurements per station, metric and period, format with the measurement relation, the resolution and
+the value expression. the caller groups by the first four columns"""
+AGGREGATE_MEASUREMENT_SQL = """
+    SELECT date_trunc('{resolution}', m.date_time), m.metric_id, s.source, m.station_id,
+        {value}, COUNT(m.value)
+    FROM {measurement} m
+        JOIN station s ON s.station_id = m.station_id
+    WHERE m.station_id = ANY(%(station_ids)s)
+        AND m.date_time >= %(start)s
+        AND m.date_time < %(end)s
+"""
+
+"""columns of the daily rollup frames returned by get_daily_measurements"""
+DAILY_MEASUREMENT_COLUMNS = ['day', 'metric_id', 'source', 'station_id', 'value_count', 'value_mean', 'value_sum']
+
+"""reads the daily rollup and its station's source for a set of stations over a date range"""
+DAILY_MEASUREMENT_SQL = """
+    SELECT d.day, d.metric_id, s.source, d.station_id, d.value_count, d.value_mean, d.value_sum
+    FROM daily_measurement d
+        JOIN station s ON s.station_id = d.station_id
+    WHERE d.station_id = ANY(%(station_ids)s)
+        AND d.day >= %(start)s
+        AND d.day < %(end)s
+"""
+
+
+"""bytes buffered between the record iterator and COPY by Repository.put_measurements_from_stream"""
+STREAM_BUFFER_SIZE = 1 << 20
+
+"""rows of a measurement file encoded at a time by Repository.put_measurements_from_csv(binary=True)"""
+BINARY_CHUNK_SIZE = 100000
+
+"""signature, flags and header extension length that start a binary COPY"""
+COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+
+"""field count of -1 that ends a binary COPY"""
+COPY_BINARY_TRAILER = struct.pack('>h', -1)
+
+"""binary COPY timestamps count microseconds from this date"""
+COPY_BINARY_EPOCH = np.datetime64('2000-01-01', 'us')
+
+"""UTC offsets, which text COPY into a timestamp column ignores"""
+UTC_OFFSET_PATTERN = r'^(.*?)(?:Z|[+-]\d\d:?\d\d)?$'
+
+
+def _copy_binary_tuples(station_id, metric_id, date_time, value):
+    """encode measurements as binary COPY tuples of (station_id, metric_id, date_time, value)
+
+    tuples of the same string lengths share a fixed layout, so each group is packed as one NumPy structured array
+    instead of one struct per row and scattered back to the offsets of its rows, keeping the input order. the header
+    and trailer are not included.
+
+    Args:
+        station_id (Series): station ids
+        metric_id (Series): metric ids
+        date_time (Series): timestamps as datetimes or text, UTC offsets in text are ignored the same as text COPY
+        value (Series): values, missing values are written as NULL
+
+    Returns:
+        bytes: the encoded tuples
+    """
+    station = np.char.encode(np.asarray(station_id, dtype=str), 'utf-8')
+    metric = np.char.encode(np.asarray(metric_id, dtype=str), 'utf-8')
+
+    if not pd.api.types.is_datetime64_any_dtype(date_time):
+        date_time = pd.to_datetime(date_time.str.extract(UTC_OFFSET_PATTERN, expand=False))
+    micros = (np.asarray(date_time, dtype='datetime64[us]') - COPY_BINARY_EPOCH).astype(np.int64)
+
+    value = np.asarray(value, dtype=np.float64)
+    null = np.isnan(value)
+
+    station_lens = np.char.str_len(station)
+    metric_lens = np.char.str_len(metric)
+    groups = pd.DataFrame({
+        'station': station_lens,
+        'metric': metric_lens,
+        'null': null
+    }).groupby(['station', 'metric', 'null']).indices
+
+    # 2 byte field count, 4 byte length of each field, 8 byte timestamp and 8 byte value unless NULL
+    lengths = 2 + 4*4 + station_lens + metric_lens + 8 + np.where(null, 0, 8)
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+
+    for (station_len, metric_len, is_null), index in groups.items():
+        fields = [('fields', '>i2'),
+                  ('station_len', '>i4'), ('station', f'S{station_len}'),
+                  ('metric_len', '>i4'), ('metric', f'S{metric_len}'),
+                  ('date_time_len', '>i4'), ('date_time', '>i8'),
+                  ('value_len', '>i4')]
+        if not is_null:
+            fields.append(('value', '>f8'))
+
+        rows = np.empty(len(index), dtype=fields)
+        rows['fields'] = 4
+        rows['station_len'] = station_len
+        rows['station'] = station[index]
+        rows['metric_len'] = metric_len
+        rows['metric'] = metric[index]
+        rows['date_time_len'] = 8
+        rows['date_time'] = micros[index]
+        rows['value_len'] = -1 if is_null else 8
+        if not is_null:
+            rows['value'] = value[index]
+
+        size = rows.dtype.itemsize
+        out[offsets[index][:, None] + np.arange(size)] = rows.view(np.uint8).reshape(-1, size)
+
+    return out.tobytes()
+
+
+class _ChunkStream:
+    """read-only file-like view of an iterator of bytes
+
+    chunks are only pulled from the iterator as COPY reads them, so memory stays bounded by the size of one read
+    and one chunk
+    """
+    def __init__(self, chunks):
+        """
+        Args:
+            chunks (iterable): bytes to read, in order
+        """
+        self.__chunks = iter(chunks)
+        self.__buffer = b''
+
+    def read(self, size=-1):
+        """read up to size bytes, all remaining when size is negative"""
+        chunks = [self.__buffer]
+        length = len(self.__buffer)
+
+        for chunk in self.__chunks:
+            chunks.append(chunk)
+            length += len(chunk)
+
+            if 0 <= size <= length:
+                break
+
+        data = b''.join(chunks)
+        if size < 0:
+            size = len(data)
+        self.__buffer = data[size:]
+
+        return data[:size]
+
+    def readline(self, size=-1):
+        """COPY only uses read, this is here to satisfy the file protocol"""
+        return self.read(size)
+
+
+class _RecordStream(_ChunkStream):
+    """read-only file-like view of an iterator of measurement records
+
+    records are formatted as COPY text lines only as COPY reads them
+
+    Attributes:
+        count (int): number of records read so far
+    """
+    def __init__(self, records, audit_file=None):
+        """
+        Args:
+            records (iterable): (station_id, metric_id, date_time, value) tuples
+            audit_file (file): optional open text file, every record is also written to it as a CSV line in the
+                layout read by Repository.put_measurements_from_csv
+        """
+        super().__init__(self.__lines(records, audit_file))
+        self.count = 0
+
+    def __lines(self, records, audit_file):
+        """format each record as an encoded COPY text line"""
+        for station_id, metric_id, date_time, value in records:
+            value = r'\N' if value is None else value
+            if audit_file is not None:
+                audit_file.write(f'{date_time},{metric_id},{station_id},{value}\n')
+
+            self.count += 1
+            yield f'{station_id}\t{metric_id}\t{date_time}\t{value}\n'.encode()
+
 
 class Repository:
     """interface between application and backend
 
     """
-    def __init__(self, session=None, connection=None):
+    def __init__(self, session=None, connection=None, compact=COMPACT_MEASUREMENTS, cached=CACHE_MEASUREMENTS):
+        """
+        Args:
+            session (Session): optional database session, defaults to a new session of settings.DATABASE
+            connection (connection): optional psycopg2 connection for bulk writes, defaults to the session's pool
+            compact (bool): optional, store and read measurements in the compact layout. the database must have
+                been migrated with context.compact_measurement_table
+            cached (bool): optional, read measurements through the process-wide measurement cache so repeated reads
+                only fetch the date ranges not read before. writes through any repository invalidate it
+        """
         if session is None:
             self.__context = context.Context(settings.DATABASE)
             self.__session = self.__context.Session()
         else:
             self.__session = session
 
-        if connection is None:
-            self.__connection = psycopg2.connect(**settings.PSYCOPG_DB)
-        else:
-            self.__connection = connection
+        self.__connection = connection
+
+        self.__compact = compact
+        self.__measurement = context.COMPACT_MEASUREMENT_VIEW if compact else 'measurement'
+        self.__measurement_table = 'compact_measurement' if compact else 'measurement'
+        self.__measurement_keys = ('station_key', 'metric_key') if compact else ('station_id', 'metric_id')
+
+        self.__cached = cached
+        self.__stale_ranges = []
 
     def __del__(self):
         self.__session.close()
-        self.__connection.close()
+
+        if self.__connection is not None:
+            self.__connection.close()
+
+    @staticmethod
+    def clear_station_cache():
+        """clear the cached closest stations of every run
+
+        needed only when station river distances are changed without put_station_river_distances
+
+        Returns
+            None
+        """
+        _NEAREST_STATIONS.clear()
+
+    def clear_measurements(self, before, resolution='day', archive_file=None, dry_run=False):
+        """apply the retention policy to measurements older than a day
+
+        the daily rollup of the days being downsampled is refreshed from their raw measurements first, so the models
+        keep the daily values they use. the raw measurements are then optionally archived and either removed, for
+        resolution 'day', or replaced by their hourly means, for resolution 'hour'.
+
+        Notes:
+            * the cut-off is truncated to midnight so no day is left partially downsampled
+            * the cut-off is recorded. the rollup of the days before it is final, it is not recomputed from what is
+            left of their measurements and the put_measurements_* methods refuse measurements before it
+            * deleted space is reused after the next vacuum, it is returned to the OS only by VACUUM FULL
+            * connection will rollback transaction if commit fails
+
+        Args:
+            before (DateTime): measurements taken before this day are downsampled
+            resolution (str): optional 'day' or 'hour', the finest resolution kept
+            archive_file (str): optional name of a file to write the raw measurements to before they are removed, in
+                the layout read by put_measurements_from_csv
+            dry_run (bool): optional, only report what would be removed
+
+        Returns:
+            dict: cutoff, rows removed, rows kept as hourly means, estimated bytes reclaimed and the archive file
+
+        Raises:
+            ValueError: if the resolution is not supported
+        """
+        if resolution not in RETENTION_RESOLUTIONS:
+            raise ValueError(f'resolution must be one of {RETENTION_RESOLUTIONS}')
+
+        cutoff = datetime.datetime(before.year, before.month, before.day)
+        station_key, metric_key = self.__measurement_keys
+        table = self.__measurement_table
+        params = {'cutoff': cutoff, 'relation': table}
+
+        with self.__raw_connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    if resolution == 'hour':
+                        # hours already holding a single measurement on the hour are left alone, so repeated runs
+                        # neither rewrite them nor rebuild the rollup from hourly means
+                        cursor.execute(f"""
+                            CREATE TEMPORARY TABLE hourly_measurement ON COMMIT DROP AS
+                                SELECT {station_key}, {metric_key}, date_trunc('hour', date_time) AS date_time,
+                                    AVG(value) AS value, COUNT(*) AS count,
+                                    MIN(date_time) AS first, MAX(date_time) AS last
+                                FROM {table}
+                                WHERE date_time < %(cutoff)s
+                                GROUP BY {station_key}, {metric_key}, date_trunc('hour', date_time)
+                                HAVING COUNT(*) > 1 OR MIN(date_time) <> date_trunc('hour', MIN(date_time));
+
+                            SELECT COALESCE(SUM(count), 0), COUNT(*) FROM hourly_measurement;
+                        """, params)
+                    else:
+                        cursor.execute(f"""
+                            SELECT COUNT(*), 0 FROM {table} WHERE date_time < %(cutoff)s;
+                        """, params)
+                    rows, kept = cursor.fetchone()
+
+                    cursor.execute(RELATION_SIZE_SQL, params)
+                    size, total = cursor.fetchone()
+
+                    report = {
+                        'cutoff': cutoff,
+                        'rows': int(rows - kept),
+                        'kept': int(kept),
+                        'bytes': int(size * (rows - kept) / total) if total > 0 else 0,
+                        'archive_file': archive_file
+                    }
+
+                    if dry_run or rows == 0:
+                        connection.rollback()
+                        return report
+
+                    self.__put_daily_measurements(cursor, self.__retention_ranges(cursor, resolution, cutoff),
+                                                  rebuild=True)
+
+                    if archive_file is not None:
+                        self.__archive_measurements(cursor, resolution, cutoff, archive_file)
+
+                    if resolution == 'hour':
+                        cursor.execute(f"""
+                            DELETE FROM {table} t
+                            USING hourly_measurement h
+                            WHERE t.{station_key} = h.{station_key}
+                                AND t.{metric_key} = h.{metric_key}
+                                AND t.date_time >= h.date_time
+                                AND t.date_time < h.date_time + interval '1 hour';
+
+                            INSERT INTO {table} ({station_key}, {metric_key}, date_time, value)
+                                SELECT {station_key}, {metric_key}, date_time, value FROM hourly_measurement;
+                        """)
+                    else:
+                        cursor.execute(f"""
+                            DELETE FROM {table} WHERE date_time < %(cutoff)s;
+                        """, params)
+
+                    cursor.execute(context.RETENTION_CUTOFF_SQL, params)
+
+                connection.commit()
+
+                return report
+            except:
+                connection.rollback()
+
+                raise
 
     def clear_predictions(self, run_id):
         """delete all existing predictions from database
@@ -80,7 +537,95 @@ class Repository:
         stations = [s.dict for s in stations]
         return pd.DataFrame(stations)
 
-    def get_measurements(self, run_id, start_date=None, end_date=None, min_distance=0., metric_ids=None):
+    def get_ingest_watermarks(self, source=None, metric_ids=None):
+        """get the timestamp of the latest measurement ingested for each station and metric
+
+        Args:
+            source (str) - optional: only stations of this source
+            metric_ids ([str]) - optional: list of metric ids to filter
+
+        Returns:
+            DataFrame: station_id, metric_id and date_time of each watermark, stations and metrics without
+            measurements have none
+        """
+        sql = """
+            SELECT w.station_id, w.metric_id, w.date_time
+            FROM ingest_watermark w
+                JOIN station s ON s.station_id = w.station_id
+            WHERE TRUE
+        """
+        params = {}
+        if source is not None:
+            sql += ' AND s.source = %(source)s'
+            params['source'] = source
+        if metric_ids is not None:
+            sql += ' AND w.metric_id = ANY(%(metric_ids)s)'
+            params['metric_ids'] = [str(m) for m in metric_ids]
+
+        with self.__session.connection().connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        return pd.DataFrame.from_records(rows, columns=['station_id', 'metric_id', 'date_time'])
+
+    def get_daily_measurements(self, run_id, start_date=None, end_date=None, min_distance=0., metric_ids=None):
+        """get the daily rollup of measurements from the db
+
+        the rollup holds the sum, mean and count of each station's metric per day and is maintained by the
+        put_measurements_* methods. stations and date ranges are resolved exactly as in get_measurements,
+        days are included if they start within the range.
+
+        Args:
+            run_id (int): retrieve measurements associated with a specific run
+            start_date (DateTime) - optional: beginning of date range for which to retrieve measurements. if None is
+            supplied the function will default to retrieving the past thirty days
+            end_date (DateTime) - optional: end of date range for which to retrieve measurements
+            min_distance (float) - optional: distance from run for which to retrieve measurements
+            metric_ids ([str]) - optional: list of metric ids to filter
+
+        Returns:
+            DataFrame: containing one row per station, metric and day
+
+        Raises:
+             ValueError: if start date is later than end date
+             ValueError: if start date is is later than current date
+             ValueError: if run id does not exist
+        """
+        return self.get_daily_measurements_for_runs(
+            [run_id], start_date, end_date, min_distance, metric_ids)[run_id]
+
+    def get_daily_measurements_for_runs(self, run_ids, start_date=None, end_date=None, min_distance=0.,
+                                        metric_ids=None):
+        """get the daily rollup of measurements for several runs at once
+
+        see get_daily_measurements. the rollup of each distinct station is read once and shared by every run
+        referencing it.
+
+        Args:
+            run_ids ([int]): runs to retrieve measurements for
+            start_date (DateTime) - optional: beginning of date range for which to retrieve measurements
+            end_date (DateTime) - optional: end of date range for which to retrieve measurements
+            min_distance (float) - optional: distance from run for which to retrieve measurements
+            metric_ids ([str]) - optional: list of metric ids to filter
+
+        Returns:
+            {int: DataFrame}: one row per station, metric and day, keyed by run id
+
+        Raises:
+             ValueError: if start date is later than end date
+             ValueError: if start date is is later than current date
+             ValueError: if any run id does not exist
+        """
+        start_date, end_date = self.__validate_date_range(start_date, end_date)
+        self.__validate_run_ids(run_ids)
+        run_stations = self.__get_station_ids_for_runs(run_ids, min_distance)
+
+        df = self.__read_station_rows(DAILY_MEASUREMENT_SQL, DAILY_MEASUREMENT_COLUMNS, 'd',
+                                      self.__distinct_station_ids(run_stations), start_date, end_date, metric_ids)
+        return self.__split_by_run(df, run_stations)
+
+    def get_measurements(self, run_id, start_date=None, end_date=None, min_distance=0., metric_ids=None,
+                         resolution=None, aggregates=None):
         """ get a set of measurements from the db
 
         * not supplying a start and end date will return measurements covering the previous 30 days. add a start date to retrieve older
@@ -89,6 +634,8 @@ class Repository:
         * supplying a distance will NOT guarantee both NOAA and USGS stations are retrieved
         * supplying an end date without a start will raise an exception
         * supplying an end date earlier than the start will raise an exception
+        * supplying a resolution aggregates the measurements in the database and returns one row per station, metric
+        and hour or day, with the aggregated value and the number of measurements it covers
 
         Args:
             run_id (int): retrieve measurements associated with a specific run
@@ -97,6 +644,9 @@ class Repository:
             end_date (DateTime) - optional: end of date range for which to retrieve measurements
             min_distance (float) - optional: distance from run for which to retrieve measurements
             metric_ids ([str]) - optional: list of metric ids to filter
+            resolution (str) - optional: 'hour' or 'day' to aggregate measurements to
+            aggregates (str or {str: str}) - optional: with a resolution, the aggregation of every metric or of each
+            metric id, one of AGGREGATES. metrics not listed are averaged
 
         Returns:
             DataFrame: containing measurements within the given set of parameters
@@ -105,83 +655,126 @@ class Repository:
              ValueError: if start date is later than end date
              ValueError: if start date is is later than current date
              ValueError: if end date is supplied without a starting date
+             ValueError: if the resolution or an aggregation is not supported
         """
-        # ensure dates are correct
-        if start_date is not None:
-            if start_date > datetime.datetime.now():
-                raise ValueError('start date cannot be later than today')
+        return self.get_measurements_for_runs(
+            [run_id], start_date, end_date, min_distance, metric_ids, resolution, aggregates)[run_id]
 
-            if end_date is not None and end_date < start_date:
-                raise ValueError('end date cannot be before start date')
-        else:
-            start_date = datetime.datetime.now() - datetime.timedelta(days=30)
+    def get_measurements_for_runs(self, run_ids, start_date=None, end_date=None, min_distance=0., metric_ids=None,
+                                  resolution=None, aggregates=None):
+        """get measurements for several runs at once
 
-        if end_date is None:
-            end_date = datetime.datetime.now()
+        stations are resolved for every run as in get_measurements, then each distinct station's measurements are
+        read exactly once and shared by every run referencing it. a cached repository only reads the part of the
+        date range it has not read before for the same stations and metrics. aggregated reads are not cached.
 
-        # ensure the run_id exists if it was supplied
-        def raise_rid_error():
-            raise ValueError('run_id does not exist: %s' % run_id)
+        Args:
+            run_ids ([int]): runs to retrieve measurements for
+            start_date (DateTime) - optional: beginning of date range for which to retrieve measurements. if None is
+            supplied the function will default to retrieving the past thirty days
+            end_date (DateTime) - optional: end of date range for which to retrieve measurements
+            min_distance (float) - optional: distance from run for which to retrieve measurements
+            metric_ids ([str]) - optional: list of metric ids to filter
+            resolution (str) - optional: 'hour' or 'day' to aggregate measurements to, see get_measurements
+            aggregates (str or {str: str}) - optional: aggregation of every metric or of each metric id
 
-        if run_id > -1:
-            try:
-                run = self.__session.query(RiverRun.run_id).filter(RiverRun.run_id == run_id).first()
-                if run is None:
-                    raise_rid_error()
-            except Exception as e:
-                raise_rid_error()
-        else:
-            raise_rid_error()
-
-        # define the stations we need to reference
-        stations = self.__session.query(StationRiverDistance.station_id,
-                                        StationRiverDistance.distance,
-                                        Station.source) \
-            .join(Station, (Station.station_id == StationRiverDistance.station_id)) \
-            .filter(StationRiverDistance.run_id == run_id) \
-            .order_by(StationRiverDistance.distance) \
-            .all()
-
-        # make sure at least one of each weather source is returned
-        if min_distance <= 0.:
-            tmp = []
-            noaa, usgs, snow = False, False, False
-            for station in stations:
-                if 'NOAA' == station[2]:
-                    tmp.append(station)
-                    noaa = True
-                elif 'USGS' == station[2]:
-                    tmp.append(station)
-                    usgs = True
-                elif 'SNOW' == station[2]:
-                    tmp.append(station)
-                    snow = True
-                if noaa and usgs and snow:
-                    break
+        Returns:
+            {int: DataFrame}: measurements within the given set of parameters keyed by run id
 
-            stations = tmp
-        else:
-            stations = [s for s in stations if s[1] < min_distance]
+        Raises:
+             ValueError: if start date is later than end date
+             ValueError: if start date is is later than current date
+             ValueError: if any run id does not exist
+             ValueError: if the resolution or an aggregation is not supported
+        """
+        if resolution is not None:
+            sql, params = self.__aggregate_query(resolution, aggregates)
+        elif aggregates is not None:
+            raise ValueError('aggregates require a resolution')
 
-        station_ids = [s[0] for s in stations]
+        start_date, end_date = self.__validate_date_range(start_date, end_date)
+        self.__validate_run_ids(run_ids)
+        run_stations = self.__get_station_ids_for_runs(run_ids, min_distance)
+        station_ids = self.__distinct_station_ids(run_stations)
 
-        # make the query
-        if metric_ids is None:
-            measurements = self.__session.query(Measurement) \
-                .filter(Measurement.date_time >= start_date,
-                        Measurement.date_time < end_date,
-                        Measurement.station_id.in_(station_ids), ) \
-                .all()
+        if resolution is not None:
+            df = self.__read_station_rows(sql, AGGREGATE_MEASUREMENT_COLUMNS, 'm', station_ids, start_date, end_date,
+                                          metric_ids, group_by='1, 2, 3, 4', params=params)
+            return self.__split_by_run(df, run_stations)
+
+        sql = MEASUREMENT_SQL.format(measurement=self.__measurement)
+
+        def fetch(start, end):
+            return self.__read_station_rows(sql, MEASUREMENT_COLUMNS, 'm', station_ids, start, end, metric_ids)
+
+        if self.__cached:
+            df = measurement_cache.MEASUREMENT_CACHE.get(station_ids, metric_ids, start_date, end_date, fetch,
+                                                         source=self.__cache_source())
         else:
-            measurements = self.__session.query(Measurement) \
-                .filter(Measurement.date_time >= start_date,
-                        Measurement.date_time < end_date,
-                        Measurement.station_id.in_(station_ids),
-                        Measurement.metric_id.in_(metric_ids)) \
-                .all()
+            df = fetch(start_date, end_date)
+
+        return self.__split_by_run(df, run_stations)
+
+    def iter_measurements(self, run_id, start_date=None, end_date=None, min_distance=0., metric_ids=None,
+                          chunk_size=MEASUREMENT_CHUNK_SIZE):
+        """stream a set of measurements from the db in fixed size chunks
+
+        takes the same arguments and raises the same exceptions as get_measurements, but rows are read through a
+        server-side cursor and yielded in time order, so memory stays bounded however long the date range is.
+        the arguments are checked when this is called, not when iteration starts.
+
+        Args:
+            run_id (int): retrieve measurements associated with a specific run
+            start_date (DateTime) - optional: beginning of date range for which to retrieve measurements. if None is
+            supplied the function will default to retrieving the past thirty days
+            end_date (DateTime) - optional: end of date range for which to retrieve measurements
+            min_distance (float) - optional: distance from run for which to retrieve measurements
+            metric_ids ([str]) - optional: list of metric ids to filter
+            chunk_size (int) - optional: number of measurements in each chunk
+
+        Returns:
+            generator: of DataFrames with the columns of get_measurements
+
+        Raises:
+             ValueError: if start date is later than end date
+             ValueError: if start date is is later than current date
+             ValueError: if run id does not exist
+        """
+        start_date, end_date = self.__validate_date_range(start_date, end_date)
+        self.__validate_run_ids([run_id])
+        station_ids = self.__get_station_ids_for_runs([run_id], min_distance)[run_id]
 
-        df = pd.DataFrame([m.dict for m in measurements])
-        return df
+        sql = MEASUREMENT_SQL.format(measurement=self.__measurement)
+        return self.__iter_station_rows(sql, MEASUREMENT_COLUMNS, 'm',
+                                        station_ids, start_date, end_date, metric_ids, chunk_size)
+
+    def get_model_order(self, run_id):
+        """retrieve the cached ARIMA order for a run
+
+        Args:
+            run_id (int): run id
+
+        Returns:
+            ModelOrder: the cached order or None if no order has been selected
+        """
+        return self.__session.query(ModelOrder).filter(ModelOrder.run_id == run_id).scalar()
+
+    def get_model_parameters(self, run_id, ar_order, ma_order):
+        """retrieve the last fitted ARIMA parameters for a run and order
+
+        Args:
+            run_id (int): run id
+            ar_order (int): number of autoregressive terms
+            ma_order (int): number of moving average terms
+
+        Returns:
+            ModelParameters: the stored parameters or None if the run has not been fit with this order
+        """
+        return self.__session.query(ModelParameters).filter(
+            ModelParameters.run_id == run_id,
+            ModelParameters.ar_order == ar_order,
+            ModelParameters.ma_order == ma_order
+        ).scalar()
 
     def get_run(self, run_id):
         """retrieve a single run
@@ -205,15 +798,23 @@ class Repository:
             print([str(a) for a in e.args])
             raise e
 
-    def put_measurements_from_csv(self, csv_file):
+    def put_measurements_from_csv(self, csv_file, binary=False):
         """ add a file of measurements
 
         Notes:
-            * will overwrite previous values with same primary key
+            * will overwrite previous values with same primary key, only measurements whose value changed are
+            rewritten. when a measurement appears more than once in the file the last one is kept
+            * the daily rollup is updated for every station, metric and day with a changed measurement
+            * the file is loaded into a temporary staging table private to the load, so loads may run concurrently
             * connection will rollback transaction if commit fails
+            * with binary the file is parsed and encoded in BINARY_CHUNK_SIZE row chunks on the client and sent as a
+            binary COPY, so the server does not parse any timestamps or floats
 
         Args:
-            csv_file (file): name of file containing records to insert
+            csv_file (file): name of file containing records to insert, one date_time,metric_id,station_id,value line
+                per measurement as written by the scraper, the audit file of put_measurements_from_stream and the
+                archive of clear_measurements
+            binary (bool): optional, send the records with a binary instead of a text COPY
 
         Returns:
             bool: success/exception
@@ -221,39 +822,223 @@ class Repository:
         Raises:
             Exception: if error occurs while connected to database
         """
-        try:
-            with self.__connection.cursor() as cursor:
-                with open(csv_file, "r") as f:
-                    cursor.copy_from(f, "tmp_measurement", sep=",")
-                cursor.execute("""
-                    INSERT into measurement
-                        SELECT * FROM tmp_measurement
-                    ON CONFLICT (station_id, metric_id, date_time)
-                        DO UPDATE SET value = EXCLUDED.value;
-                """)
-                cursor.execute("""
-                    DELETE FROM tmp_measurement;
-                """)
-
-            self.__connection.commit()
+        with self.__raw_connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(STAGING_TABLE_SQL)
+                    if binary:
+                        self.__copy_binary_from_csv(cursor, csv_file)
+                    else:
+                        with open(csv_file, "r") as f:
+                            cursor.copy_from(f, STAGING_TABLE, sep=",",
+                                             columns=('date_time', 'metric_id', 'station_id', 'value'))
+                    self.__merge_staged_measurements(cursor)
 
-            return True
-        except:
-            self.__connection.rollback()
+                connection.commit()
+
+                return True
+            except:
+                connection.rollback()
+
+                raise
+
+    def put_measurements_from_stream(self, records, audit_file=None):
+        """add measurements from an iterator without staging them in a file
+
+        records are copied to the database as they are produced, so ingest overlaps with the producer, e.g. a
+        scraper, and memory stays bounded by STREAM_BUFFER_SIZE
+
+        Notes:
+            * will overwrite previous values with same primary key, only measurements whose value changed are
+            rewritten. when a measurement appears more than once the last one is kept
+            * the daily rollup is updated for every station, metric and day with a changed measurement
+            * records are loaded into a temporary staging table private to the load, so loads may run concurrently
+            * connection will rollback transaction if commit fails
+
+        Args:
+            records (iterable): (station_id, metric_id, date_time, value) tuples. date_time may be a datetime or an
+                ISO formatted string
+            audit_file (str): optional name of a CSV file to write every record to as it is copied, in the layout read
+                by put_measurements_from_csv
+
+        Returns:
+            int: number of records copied
+
+        Raises:
+            Exception: if error occurs while connected to database
+        """
+        with contextlib.ExitStack() as stack:
+            audit = None if audit_file is None else stack.enter_context(open(audit_file, "w"))
+            stream = _RecordStream(records, audit)
+            connection = stack.enter_context(self.__raw_connection())
+
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(STAGING_TABLE_SQL)
+                    cursor.copy_from(stream, STAGING_TABLE, size=STREAM_BUFFER_SIZE,
+                                     columns=('station_id', 'metric_id', 'date_time', 'value'))
+                    self.__merge_staged_measurements(cursor)
 
-            raise
+                connection.commit()
 
-    def put_measurements_from_list(self, measurements):
+                return stream.count
+            except:
+                connection.rollback()
+
+                raise
+
+    def put_measurements_from_list(self, measurements, upsert=False):
         """add a list of measurements to the database
 
+        Notes:
+            * the daily rollup is updated for every station, metric and day covered by the list
+            * without upsert each measurement is added through the session and any existing measurement fails
+            the whole list
+            * with upsert measurements are written in pages of UPSERT_PAGE_SIZE rows and existing measurements are
+            overwritten, the same as put_measurements_from_csv. when a measurement appears more than once in the
+            list the last one is kept
+            * in the compact layout measurements are always upserted
+
         Args
-            measurements [Measurement]: list of measurements to put in the db
+            measurements [Measurement]: list of measurements to put in the db. with upsert, (station_id, metric_id,
+                date_time, value) tuples or arrays, such as the rows of a 2-d object array, may be used instead
+            upsert (bool): optional, write in bulk and overwrite existing measurements
 
         Returns
             None
         """
+        if upsert or self.__compact:
+            self.__upsert_measurements(measurements)
+            return
+
+        ranges = self.__measurement_ranges(
+            (m.station_id, m.metric_id, m.date_time, m.value) for m in measurements)
+
+        # the rollup and watermarks are written in the session's transaction so they commit with the measurements
         try:
+            with self.__session.connection().connection.cursor() as cursor:
+                self.__put_measurement_partitions(cursor, ranges)
+
             self.__session.add_all(measurements)
+            self.__session.flush()
+
+            with self.__session.connection().connection.cursor() as cursor:
+                self.__put_daily_measurements(cursor, ranges)
+                self.__put_ingest_watermarks(cursor, ranges)
+
+            self.__session.commit()
+        except Exception as e:
+            print([str(a) for a in e.args])
+            self.__session.rollback()
+            raise e
+        finally:
+            self.__invalidate_stale_ranges()
+
+    def put_daily_measurements(self, start_date=None, end_date=None, if_empty=False):
+        """recompute the daily rollup from stored measurements
+
+        measurements added through the put_measurements_* methods keep the rollup current. this is only needed to
+        build the rollup for measurements stored before it existed or written outside of the repository. days before
+        the retention cut-off of clear_measurements are kept as they are.
+
+        Args:
+            start_date (DateTime) - optional: first day to recompute, defaults to the earliest measurement
+            end_date (DateTime) - optional: last day to recompute, defaults to the latest measurement
+            if_empty (bool) - optional: only build the rollup if it holds no rows yet, so it is cheap to call on
+                every run
+
+        Returns:
+            int: number of station and metric pairs recomputed
+        """
+        with self.__raw_connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    if if_empty and not self.__is_empty(cursor, 'daily_measurement'):
+                        connection.rollback()
+                        return 0
+
+                    cursor.execute(f"""
+                        SELECT station_id, metric_id, MIN(date_time), MAX(date_time)
+                        FROM {self.__measurement}
+                        WHERE (%(start)s IS NULL OR date_time >= date_trunc('day', %(start)s::timestamp))
+                            AND (%(end)s IS NULL OR date_time < date_trunc('day', %(end)s::timestamp) + interval '1 day')
+                        GROUP BY station_id, metric_id;
+                    """, {'start': start_date, 'end': end_date})
+                    ranges = cursor.fetchall()
+                    self.__put_daily_measurements(cursor, ranges, rebuild=True)
+
+                connection.commit()
+
+                return len(ranges)
+            except:
+                connection.rollback()
+
+                raise
+
+    def put_ingest_watermarks(self, if_empty=False):
+        """rebuild the ingest watermarks from stored measurements
+
+        measurements added through the put_measurements_* methods keep the watermarks current. this is only needed
+        for measurements stored before the watermarks existed or written outside of the repository.
+
+        Args:
+            if_empty (bool) - optional: only build the watermarks if there are none yet, so it is cheap to call on
+                every run
+
+        Returns:
+            int: number of station and metric pairs with stored measurements
+        """
+        with self.__raw_connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    if if_empty and not self.__is_empty(cursor, 'ingest_watermark'):
+                        connection.rollback()
+                        return 0
+
+                    cursor.execute(f"""
+                        SELECT station_id, metric_id, MIN(date_time), MAX(date_time)
+                        FROM {self.__measurement}
+                        GROUP BY station_id, metric_id;
+                    """)
+                    ranges = cursor.fetchall()
+                    self.__put_ingest_watermarks(cursor, ranges)
+
+                connection.commit()
+
+                return len(ranges)
+            except:
+                connection.rollback()
+
+                raise
+
+    def put_model_order(self, order):
+        """add or replace the cached ARIMA order for a run
+
+        Args:
+            order (ModelOrder): order to cache
+
+        Returns:
+            None
+        """
+        try:
+            self.__session.merge(order)
+            self.__session.commit()
+        except SQLAlchemyError as e:
+            print([str(a) for a in e.args])
+            self.__session.rollback()
+            raise e
+
+    def put_model_parameters(self, parameters):
+        """add or replace the fitted ARIMA parameters for a run and order
+
+        Args:
+            parameters (ModelParameters): parameters to store
+
+        Returns:
+            None
+        """
+        try:
+            self.__session.merge(parameters)
             self.__session.commit()
         except SQLAlchemyError as e:
             print([str(a) for a in e.args])
@@ -275,6 +1060,9 @@ class Repository:
     def put_station_river_distances(self, strd):
         """put station river distance objects in the db
 
+        Notes:
+            * clears the cached closest stations of every run
+
         Args:
             strd ([StationRiverDistance]): list of StationRiverDistances to add
         """
@@ -284,9 +1072,537 @@ class Repository:
         try:
             self.__session.add_all(strd)
             self.__session.commit()
+            self.clear_station_cache()
 
             return True
         except Exception as e:
             self.__session.rollback()
 
             return False
+
+    @contextlib.contextmanager
+    def __raw_connection(self):
+        """a raw DBAPI connection for COPY and bulk statements
+
+        the connection supplied when the repository was created is used if there is one. otherwise a connection is
+        checked out of the session engine's pool when needed and returned to it on exit.
+
+        measurements written through the connection are invalidated in the measurement cache on exit, once the
+        caller has committed or rolled back
+
+        Yields:
+            connection: psycopg2 connection, the caller is responsible for committing
+        """
+        connection = self.__connection
+        if connection is None:
+            connection = self.__session.get_bind().raw_connection()
+
+        try:
+            yield connection
+        finally:
+            if self.__connection is None:
+                connection.close()
+
+            self.__invalidate_stale_ranges()
+
+    @staticmethod
+    def __is_empty(cursor, table):
+        """whether a table holds no rows"""
+        cursor.execute(f'SELECT NOT EXISTS (SELECT 1 FROM {table});')
+        return cursor.fetchone()[0]
+
+    @staticmethod
+    def __timestamp(value):
+        """a timestamp as a timestamp without time zone column stores it, keeping the local time of an offset"""
+        value = pd.Timestamp(value)
+        return value if value.tz is None else value.tz_localize(None)
+
+    def __invalidate_stale_ranges(self):
+        """invalidate the ranges written since the last call in the measurement cache"""
+        stale, self.__stale_ranges = self.__stale_ranges, []
+        for sid, mid, first, last in stale:
+            measurement_cache.MEASUREMENT_CACHE.invalidate(sid, mid, first, last, source=self.__cache_source())
+
+    def __cache_source(self):
+        """the database and measurement table of this repository, keeping their entries apart in the cache"""
+        return str(self.__session.get_bind().url), self.__measurement_table
+
+    def __archive_measurements(self, cursor, resolution, cutoff, archive_file):
+        """write the measurements clear_measurements is about to remove to a file
+
+        Args:
+            cursor (cursor): open cursor
+            resolution (str): 'day' or 'hour', see clear_measurements
+            cutoff (DateTime): measurements before this are removed
+            archive_file (str): name of the file, written in the layout read by put_measurements_from_csv
+        """
+        if resolution == 'hour':
+            # only hours still holding raw measurements are replaced
+            station_key, metric_key = self.__measurement_keys
+            join, station_id, metric_id = self.__measurement_key_ids('t')
+            sql = f"""
+                SELECT t.date_time, {metric_id}, {station_id}, t.value
+                FROM {self.__measurement_table} t
+                    JOIN hourly_measurement h
+                        ON t.{station_key} = h.{station_key}
+                        AND t.{metric_key} = h.{metric_key}
+                        AND t.date_time >= h.date_time
+                        AND t.date_time < h.date_time + interval '1 hour'
+                    {join}
+            """
+        else:
+            sql = f"""
+                SELECT date_time, metric_id, station_id, value
+                FROM {self.__measurement}
+                WHERE date_time < %(cutoff)s
+            """
+
+        with open(archive_file, "w") as f:
+            cursor.copy_expert(cursor.mogrify(f"COPY ({sql}) TO STDOUT WITH (DELIMITER ',')",
+                                              {'cutoff': cutoff}).decode(), f)
+
+    @staticmethod
+    def __copy_binary_from_csv(cursor, csv_file):
+        """binary COPY a measurement file into the staging table
+
+        Args:
+            cursor (cursor): open cursor, the caller is responsible for committing
+            csv_file (str): name of a file in the put_measurements_from_csv layout
+        """
+        reader = pd.read_csv(csv_file, header=None, names=['date_time', 'metric_id', 'station_id', 'value'],
+                             dtype={'date_time': str, 'metric_id': str, 'station_id': str},
+                             na_values={'value': [r'\N']}, keep_default_na=False, chunksize=BINARY_CHUNK_SIZE)
+
+        chunks = itertools.chain(
+            [COPY_BINARY_HEADER],
+            (_copy_binary_tuples(c.station_id, c.metric_id, c.date_time, c.value) for c in reader),
+            [COPY_BINARY_TRAILER]
+        )
+
+        cursor.copy_expert(f"""
+            COPY {STAGING_TABLE} (station_id, metric_id, date_time, value) FROM STDIN WITH (FORMAT binary)
+        """, _ChunkStream(chunks), size=STREAM_BUFFER_SIZE)
+
+    def __merge_staged_measurements(self, cursor):
+        """merge the staging table into measurement and update the daily rollup of the changed days
+
+        missing partitions are created first when the measurement table is partitioned. in the compact layout the
+        staged stations and metrics are assigned keys and merged into compact_measurement instead
+
+        Args:
+            cursor (cursor): open cursor, the caller is responsible for committing
+        """
+        if self.__compact:
+            context.put_measurement_keys(cursor, STAGING_TABLE)
+            cursor.execute(COMPACT_MERGE_STAGING_SQL)
+        else:
+            cursor.execute(f"SELECT MIN(date_time), MAX(date_time) FROM {STAGING_TABLE};")
+            first, last = cursor.fetchone()
+            if first is not None:
+                context.create_measurement_partitions(cursor, first, last)
+
+            cursor.execute(MERGE_STAGING_SQL)
+
+        ranges = cursor.fetchall()
+        self.__put_daily_measurements(cursor, ranges)
+        self.__put_ingest_watermarks(cursor, ranges)
+
+    @staticmethod
+    def __measurement_ranges(rows):
+        """find the first and last timestamp of each station and metric
+
+        Args:
+            rows (iterable): (station_id, metric_id, date_time, value) tuples
+
+        Returns:
+            [(str, str, DateTime, DateTime)]: station id, metric id, first and last timestamp
+        """
+        ranges = {}
+        for station_id, metric_id, date_time, _ in rows:
+            key = (station_id, metric_id)
+            first, last = ranges.get(key, (date_time, date_time))
+            ranges[key] = (min(first, date_time), max(last, date_time))
+
+        return [(sid, mid, first, last) for (sid, mid), (first, last) in ranges.items()]
+
+    def __put_measurement_partitions(self, cursor, ranges):
+        """create any measurement partitions missing for a set of ranges, nothing if the table is not partitioned
+
+        Args:
+            cursor (cursor): open cursor, the caller is responsible for committing
+            ranges ([(str, str, DateTime, DateTime)]): station id, metric id, first and last timestamp
+        """
+        if not self.__compact and len(ranges) > 0:
+            context.create_measurement_partitions(cursor, min(r[2] for r in ranges), max(r[3] for r in ranges))
+
+    def __retention_ranges(self, cursor, resolution, cutoff):
+        """the station and metric ranges clear_measurements refreshes the daily rollup of
+
+        Args:
+            cursor (cursor): open cursor
+            resolution (str): 'day' or 'hour', see clear_measurements
+            cutoff (DateTime): measurements before this are removed
+
+        Returns:
+            [(str, str, DateTime, DateTime)]: station id, metric id, first and last timestamp
+        """
+        if resolution == 'hour':
+            join, station_id, metric_id = self.__measurement_key_ids('h')
+            cursor.execute(f"""
+                SELECT {station_id}, {metric_id}, MIN(h.first), MAX(h.last)
+                FROM hourly_measurement h
+                    {join}
+                GROUP BY 1, 2;
+            """)
+        else:
+            cursor.execute(f"""
+                SELECT station_id, metric_id, MIN(date_time), MAX(date_time)
+                FROM {self.__measurement}
+                WHERE date_time < %(cutoff)s
+                GROUP BY station_id, metric_id;
+            """, {'cutoff': cutoff})
+
+        return cursor.fetchall()
+
+    def __put_daily_measurements(self, cursor, ranges, rebuild=False):
+        """recompute the daily rollup for the days covered by each station and metric range
+
+        days are recomputed from the measurement table rather than incremented so values overwritten by an upsert
+        are never counted twice. days before the retention cut-off are never recomputed, since their measurements
+        have been downsampled. the ranges are invalidated in the measurement cache when the connection is released
+
+        Args:
+            cursor (cursor): open cursor, the caller is responsible for committing
+            ranges ([(str, str, DateTime, DateTime)]): station id, metric id, first and last timestamp touched
+            rebuild (bool): optional, the ranges were read from stored measurements rather than written, days
+                before the retention cut-off are skipped instead of refused
+
+        Raises:
+            ValueError: if measurements were written before the retention cut-off
+        """
+        ranges = list(ranges)
+        self.__stale_ranges.extend(ranges)
+
+        cursor.execute("""
+            SELECT cutoff FROM measurement_retention WHERE relation = %(relation)s;
+        """, {'relation': self.__measurement_table})
+        row = cursor.fetchone()
+        if row is not None:
+            cutoff = row[0]
+            ranges = [(sid, mid, self.__timestamp(first), self.__timestamp(last)) for sid, mid, first, last in ranges]
+            if not rebuild and any(first < cutoff for _, _, first, _ in ranges):
+                raise ValueError(f'measurements before the retention cut-off {cutoff} cannot be added, '
+                                 f'those days have been downsampled')
+
+            ranges = [(sid, mid, max(first, cutoff), last) for sid, mid, first, last in ranges if last >= cutoff]
+
+        cursor.executemany(DAILY_ROLLUP_SQL.format(measurement=self.__measurement), [
+            {'station_id': sid, 'metric_id': mid, 'start': first, 'end': last}
+            for sid, mid, first, last in ranges
+        ])
+
+    @staticmethod
+    def __put_ingest_watermarks(cursor, ranges):
+        """move the ingest watermark of each station and metric forward to the last timestamp written
+
+        Args:
+            cursor (cursor): open cursor, the caller is responsible for committing
+            ranges ([(str, str, DateTime, DateTime)]): station id, metric id, first and last timestamp touched
+        """
+        cursor.executemany(INGEST_WATERMARK_SQL, [
+            {'station_id': sid, 'metric_id': mid, 'end': last}
+            for sid, mid, first, last in ranges
+        ])
+
+    def __measurement_key_ids(self, alias):
+        """translate the measurement keys of a relation to station and metric ids
+
+        Args:
+            alias (str): alias of a relation holding the measurement keys
+
+        Returns:
+            (str, str, str): join clause, station id and metric id expressions
+        """
+        if not self.__compact:
+            return '', f'{alias}.station_id', f'{alias}.metric_id'
+
+        return f"""
+            JOIN station_key sk ON sk.station_key = {alias}.station_key
+            JOIN metric_key mk ON mk.metric_key = {alias}.metric_key
+        """, 'sk.station_id', 'mk.metric_id'
+
+    def __upsert_measurements(self, measurements):
+        """insert or overwrite measurements in bulk and update the daily rollup in the same transaction
+
+        in the compact layout the rows are staged and merged the same as a COPY load
+
+        Args:
+            measurements (iterable): Measurement objects or (station_id, metric_id, date_time, value) tuples or
+                arrays
+
+        Raises:
+            Exception: if error occurs while connected to database
+        """
+        # a statement may not update the same row twice, keep the last value of each measurement
+        rows = {}
+        for m in measurements:
+            if isinstance(m, context.Measurement):
+                m = (m.station_id, m.metric_id, m.date_time, m.value)
+            else:
+                m = tuple(m)
+            rows[m[:3]] = m
+        rows = list(rows.values())
+
+        if len(rows) == 0:
+            return
+
+        with self.__raw_connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    if self.__compact:
+                        cursor.execute(STAGING_TABLE_SQL)
+                        psycopg2.extras.execute_values(cursor, f"""
+                            INSERT INTO {STAGING_TABLE} (station_id, metric_id, date_time, value) VALUES %s;
+                        """, rows, page_size=UPSERT_PAGE_SIZE)
+                        self.__merge_staged_measurements(cursor)
+                    else:
+                        ranges = self.__measurement_ranges(rows)
+                        self.__put_measurement_partitions(cursor, ranges)
+                        psycopg2.extras.execute_values(cursor, MEASUREMENT_UPSERT_SQL, rows,
+                                                       page_size=UPSERT_PAGE_SIZE)
+                        self.__put_daily_measurements(cursor, ranges)
+                        self.__put_ingest_watermarks(cursor, ranges)
+
+                connection.commit()
+            except:
+                connection.rollback()
+
+                raise
+
+    def __aggregate_query(self, resolution, aggregates):
+        """build the statement of an aggregated measurement read
+
+        Args:
+            resolution (str): 'hour' or 'day'
+            aggregates (str or {str: str}): aggregation of every metric or of each metric id, None to average
+
+        Returns:
+            (str, dict): statement and the parameters of its value expression
+
+        Raises:
+            ValueError: if the resolution or an aggregation is not supported
+        """
+        if resolution not in AGGREGATE_RESOLUTIONS:
+            raise ValueError(f'resolution must be one of {AGGREGATE_RESOLUTIONS}')
+
+        if aggregates is None or isinstance(aggregates, str):
+            aggregates = {None: aggregates or 'mean'}
+        else:
+            aggregates = dict(aggregates)
+
+        unsupported = [how for how in aggregates.values() if how not in AGGREGATES]
+        if len(unsupported) > 0:
+            raise ValueError(f'aggregates must be one of {tuple(AGGREGATES)}, not {unsupported}')
+
+        # metrics without their own aggregation fall through to the default
+        default = f'{AGGREGATES[aggregates.pop(None, "mean")]}(m.value)'
+        params = {f'aggregate_{i}': str(metric_id) for i, metric_id in enumerate(aggregates)}
+        cases = ' '.join(f'WHEN %(aggregate_{i})s THEN {AGGREGATES[how]}(m.value)'
+                         for i, how in enumerate(aggregates.values()))
+        value = f'CASE m.metric_id {cases} ELSE {default} END' if len(params) > 0 else default
+
+        sql = AGGREGATE_MEASUREMENT_SQL.format(measurement=self.__measurement, resolution=resolution, value=value)
+        return sql, params
+
+    def __validate_date_range(self, start_date, end_date):
+        """apply the get_measurements date range defaults and checks
+
+        Returns:
+            (DateTime, DateTime): start and end of the range
+
+        Raises:
+             ValueError: if start date is later than end date
+             ValueError: if start date is is later than current date
+        """
+        if start_date is not None:
+            if start_date > datetime.datetime.now():
+                raise ValueError('start date cannot be later than today')
+
+            if end_date is not None and end_date < start_date:
+                raise ValueError('end date cannot be before start date')
+        else:
+            start_date = datetime.datetime.now() - datetime.timedelta(days=30)
+
+        if end_date is None:
+            end_date = datetime.datetime.now()
+
+        return start_date, end_date
+
+    def __validate_run_ids(self, run_ids):
+        """ensure every run id exists
+
+        Raises:
+            ValueError: if any run id does not exist
+        """
+        def raise_rid_error(run_id):
+            raise ValueError('run_id does not exist: %s' % run_id)
+
+        for run_id in run_ids:
+            if run_id < 0:
+                raise_rid_error(run_id)
+
+        try:
+            existing = {r[0] for r in self.__session.query(RiverRun.run_id).filter(RiverRun.run_id.in_(run_ids))}
+        except Exception as e:
+            raise_rid_error(run_ids)
+
+        for run_id in run_ids:
+            if run_id not in existing:
+                raise_rid_error(run_id)
+
+    def __get_station_ids_for_runs(self, run_ids, min_distance):
+        """define the stations to reference for each run
+
+        the closest stations are selected in the database with one DISTINCT ON (run, source) query and cached
+        per run for the life of the process. the cache is cleared whenever station river distances are put.
+
+        Args:
+            run_ids ([int]): run ids
+            min_distance (float): distance from run for which to retrieve stations, if zero or negative the
+            closest station of each source is returned
+
+        Returns:
+            {int: [str]}: station ids keyed by run id
+        """
+        if min_distance > 0.:
+            stations = self.__session.query(StationRiverDistance.run_id,
+                                            StationRiverDistance.station_id) \
+                .filter(StationRiverDistance.run_id.in_(run_ids),
+                        StationRiverDistance.distance < min_distance) \
+                .order_by(StationRiverDistance.run_id, StationRiverDistance.distance) \
+                .all()
+
+            run_stations = {run_id: [] for run_id in run_ids}
+            for run_id, station_id in stations:
+                run_stations[run_id].append(station_id)
+
+            return run_stations
+
+        # make sure the closest station of each weather source is returned
+        missing = [run_id for run_id in run_ids if run_id not in _NEAREST_STATIONS]
+        if len(missing) > 0:
+            stations = self.__session.query(StationRiverDistance.run_id,
+                                            StationRiverDistance.station_id) \
+                .join(Station, (Station.station_id == StationRiverDistance.station_id)) \
+                .filter(StationRiverDistance.run_id.in_(missing),
+                        Station.source.in_(STATION_SOURCES)) \
+                .distinct(StationRiverDistance.run_id, Station.source) \
+                .order_by(StationRiverDistance.run_id, Station.source, StationRiverDistance.distance) \
+                .all()
+
+            nearest = {run_id: [] for run_id in missing}
+            for run_id, station_id in stations:
+                nearest[run_id].append(station_id)
+
+            _NEAREST_STATIONS.update(nearest)
+
+        return {run_id: list(_NEAREST_STATIONS[run_id]) for run_id in run_ids}
+
+    def __read_station_rows(self, sql, columns, alias, station_ids, start_date, end_date, metric_ids=None,
+                            group_by=None, params=None):
+        """run a station read through a raw cursor and build the frame directly from the row tuples
+
+        no ORM objects are created and each row's station source comes from the join rather than a lazy load.
+        the cursor belongs to the session's connection so uncommitted session changes are visible.
+
+        Args:
+            sql (str): select statement taking station_ids, start and end parameters
+            columns ([str]): names of the selected columns
+            alias (str): alias of the table holding metric_id in the statement
+            station_ids ([str]): stations to read
+            start_date (DateTime): beginning of the date range
+            end_date (DateTime): end of the date range, exclusive
+            metric_ids ([str]) - optional: list of metric ids to filter
+            group_by (str) - optional: grouping of an aggregating statement, added after the filters
+            params (dict) - optional: further parameters of the statement
+
+        Returns:
+            DataFrame: the selected rows, empty without columns if nothing matched
+        """
+        sql, query_params = self.__station_rows_query(sql, alias, station_ids, start_date, end_date, metric_ids)
+        if group_by is not None:
+            sql += f' GROUP BY {group_by}'
+        if params is not None:
+            query_params.update(params)
+
+        with self.__session.connection().connection.cursor() as cursor:
+            cursor.execute(sql, query_params)
+            rows = cursor.fetchall()
+
+        if len(rows) == 0:
+            return pd.DataFrame()
+
+        return pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+
+    def __iter_station_rows(self, sql, columns, alias, station_ids, start_date, end_date, metric_ids, chunk_size):
+        """stream a station read through a server-side cursor in time order
+
+        Args:
+            see __read_station_rows
+            chunk_size (int): rows per yielded frame
+
+        Yields:
+            DataFrame: up to chunk_size rows
+        """
+        sql, params = self.__station_rows_query(sql, alias, station_ids, start_date, end_date, metric_ids)
+        sql += f' ORDER BY {alias}.date_time'
+
+        connection = self.__session.connection().connection
+        with connection.cursor(name=f'measurements_{uuid.uuid4().hex}') as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(sql, params)
+
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if len(rows) == 0:
+                    break
+
+                yield pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+
+    @staticmethod
+    def __station_rows_query(sql, alias, station_ids, start_date, end_date, metric_ids):
+        """add the metric filter and bind the parameters of a station read
+
+        Returns:
+            (str, dict): statement and parameters
+        """
+        params = {'station_ids': list(station_ids), 'start': start_date, 'end': end_date}
+        if metric_ids is not None:
+            sql += METRIC_FILTER_SQL.format(alias=alias)
+            params['metric_ids'] = [str(m) for m in metric_ids]
+
+        return sql, params
+
+    @staticmethod
+    def __distinct_station_ids(run_stations):
+        """the distinct station ids referenced by a set of runs"""
+        return sorted({sid for station_ids in run_stations.values() for sid in station_ids})
+
+    @staticmethod
+    def __split_by_run(df, run_stations):
+        """split a frame of station rows into a view per run
+
+        Args:
+            df (DataFrame): rows containing a station_id column
+            run_stations ({int: [str]}): station ids keyed by run id
+
+        Returns:
+            {int: DataFrame}: rows of each run's stations keyed by run id
+        """
+        if len(df) == 0:
+            return {run_id: pd.DataFrame() for run_id in run_stations}
+
+        return {
+            run_id: df[df.station_id.isin(station_ids)].reset_index(drop=True)
+            for run_id, station_ids in run_stations.items()
+        }
@@ -31,6 +31,7 @@ from statsmodels.tsa.arima_model import ARIMA
 from statsmodels.tsa.stattools import acf, pacf
 from statsmodels.tsa.stattools import adfuller
 from statsmodels.tsa.stattools import arma_order_select_ic
+from riverrunner.arima import daily_frame, daily_totals
 from riverrunner.repository import Repository
 
 REPO = Repository()
@@ -49,26 +50,7 @@ def daily_avg(time_series):
     Returns:
         DataFrame: containing daily measurements
     """
-    precip = time_series[time_series.metric_id == '00003']
-    precip['date_time'] = pd.to_datetime(precip['date_time'], utc=True)
-    precip.index = precip['date_time']
-    precip_daily = precip.resample('D').sum()
-
-    flow = time_series[time_series.metric_id == '00060']
-    flow['date_time'] = pd.to_datetime(flow['date_time'], utc=True)
-    flow.index = flow['date_time']
-    flow_daily = flow.resample('D').mean()
-
-    temp = time_series[time_series.metric_id == '00001']
-    temp['date_time'] = pd.to_datetime(temp['date_time'], utc=True)
-    temp.index = temp['date_time']
-    temp_daily = temp.resample('D').mean()
-
-    time_series_daily = temp_daily.merge(flow_daily, how='inner',
-                                         left_index=True, right_index=True)\
-        .merge(precip_daily, how='inner', left_index=True, right_index=True)
-    time_series_daily.columns = ['temp', 'flow', 'precip']
-    return time_series_daily
+    return daily_frame(daily_totals(time_series))
 
 
 def test_stationarity(time_series):
@@ -147,17 +129,23 @@ def test_model(run_id):
     Args:
         run_id: run for which to test model
 
-    Returns: plots showing model results
+    Returns: plots showing model results, None if the run has no
+        measurements to model
     """
     # Retrieve data for one run to model
     start = datetime.datetime(2014, 5, 18)
     end = datetime.datetime(2018, 5, 17)
-    test_measures = REPO.get_measurements(run_id=run_id,
-                                          start_date=start,
-                                          end_date=end)
+    chunks = REPO.iter_measurements(run_id=run_id,
+                                    start_date=start,
+                                    end_date=end)
+
+    # Average data a chunk at a time and create train/test split
+    totals = [daily_totals(chunk) for chunk in chunks]
+    if len(totals) == 0:
+        return None
 
-    # Average data and create train/test split
-    measures_daily = daily_avg(test_measures)
+    totals = pd.concat(totals)
+    measures_daily = daily_frame(totals.groupby(level=[0, 1]).sum())
     train_measures_daily = measures_daily[:-6]
     test_measures_daily = measures_daily[-7:]
     train_measures_daily = train_measures_daily.dropna()
@@ -0,0 +1,337 @@
+"""
+Module for performance benchmarks. Like the other static modules these are run by hand when changing a hot path,
+they are not part of the unit tests.
+
+Functions:
+    synthetic_measurements: generates raw measurements shaped like the output of Repository.get_measurements
+
+    benchmark_daily_avg: compares the original three-pass daily_avg against the single-pass daily_totals and
+    daily_frame
+
+    benchmark_copy: compares text and binary COPY of a measurement file into the test database
+
+    benchmark_measurement_plans: compares the plans of a measurement read with the original single column indexes and
+    with the composite and BRIN indexes
+
+    benchmark_usgs_parsing: compares the time and peak memory of parsing a USGS response whole and as a stream
+"""
+
+import datetime
+import json
+import os
+import tempfile
+import timeit
+import tracemalloc
+import numpy as np
+import pandas as pd
+from riverrunner import settings
+from riverrunner.arima import DAILY_METRICS, daily_frame, daily_totals
+from riverrunner import context
+from riverrunner.continuous_retrieval import USGS_STREAM_CHUNK_SIZE, parse_usgs_records, usgs_series
+from riverrunner.context import Context, Metric, Station
+from riverrunner.repository import MEASUREMENT_SQL, METRIC_FILTER_SQL, Repository
+
+
+def synthetic_measurements(years=4, seed=0):
+    """generate raw measurements for one run
+
+    hourly temperature and precipitation from a NOAA station and 15 minute flow rates from a USGS station, the same
+    mix the models read for every run
+
+    Args:
+        years (int): number of years of measurements
+        seed (int): random seed
+
+    Returns:
+        DataFrame: with the columns returned by Repository.get_measurements
+    """
+    rng = np.random.RandomState(seed)
+    end = datetime.datetime(2018, 5, 1)
+    start = end - datetime.timedelta(days=365*years)
+
+    frames = []
+    for station_id, source, metric_id, freq in [('noaa', 'NOAA', '00001', 'H'),
+                                                ('noaa', 'NOAA', '00003', 'H'),
+                                                ('usgs', 'USGS', '00060', '15T')]:
+        date_time = pd.date_range(start, end, freq=freq, closed='left')
+        frames.append(pd.DataFrame({
+            'date_time': date_time.to_pydatetime(),
+            'metric_id': metric_id,
+            'source': source,
+            'station_id': station_id,
+            'value': rng.normal(10, 3, len(date_time))
+        }))
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def legacy_daily_avg(time_series):
+    """the original daily_avg, kept as the benchmark baseline
+
+    Args:
+        time_series (DataFrame): raw measurements
+
+    Returns:
+        DataFrame: containing daily measurements
+    """
+    precip = time_series[time_series.metric_id == '00003']
+    precip['date_time'] = pd.to_datetime(precip['date_time'], utc=True)
+    precip.index = precip['date_time']
+    precip_daily = precip.resample('D').sum()
+
+    flow = time_series[time_series.metric_id == '00060']
+    flow['date_time'] = pd.to_datetime(flow['date_time'], utc=True)
+    flow.index = flow['date_time']
+    flow_daily = flow.resample('D').mean()
+
+    temp = time_series[time_series.metric_id == '00001']
+    temp['date_time'] = pd.to_datetime(temp['date_time'], utc=True)
+    temp.index = temp['date_time']
+    temp_daily = temp.resample('D').mean()
+
+    time_series_daily = temp_daily.merge(flow_daily, how='inner',
+                                         left_index=True, right_index=True)\
+        .merge(precip_daily, how='inner', left_index=True, right_index=True)
+    time_series_daily.columns = ['temp', 'flow', 'precip']
+    return time_series_daily
+
+
+def benchmark_daily_avg(years=4, repeat=5):
+    """time the original and single-pass daily aggregation on the same synthetic data
+
+    Args:
+        years (int): years of synthetic measurements
+        repeat (int): number of timed runs of each implementation
+
+    Returns:
+        dict: best time in seconds for each implementation
+    """
+    time_series = synthetic_measurements(years)
+
+    legacy = legacy_daily_avg(time_series.copy())
+    single = daily_frame(daily_totals(time_series))
+    pd.testing.assert_frame_equal(legacy, single, check_names=False)
+
+    results = {
+        'legacy': min(timeit.repeat(lambda: legacy_daily_avg(time_series.copy()), number=1, repeat=repeat)),
+        'single_pass': min(timeit.repeat(lambda: daily_frame(daily_totals(time_series)), number=1, repeat=repeat))
+    }
+
+    print(f'{len(time_series)} measurements over {years} years')
+    for name, seconds in results.items():
+        print(f'{name}: {seconds:.3f}s')
+
+    return results
+
+
+def benchmark_copy(rows=1000000, repeat=3, db=settings.DATABASE_TEST):
+    """time text and binary COPY of the same measurement file
+
+    the file uses stations and metrics already in the database so the foreign keys hold. both paths overwrite the
+    same measurements, so run this against the test database only
+
+    Args:
+        rows (int): number of measurements in the file
+        repeat (int): number of timed loads with each format
+        db (dict): connection string of the database to load into
+
+    Returns:
+        dict: best time in seconds for each format
+    """
+    session = Context(db).Session()
+    station_ids = [s for s, in session.query(Station.station_id).limit(100)]
+    metric_ids = [m for m, in session.query(Metric.metric_id)]
+    if len(station_ids) == 0 or len(metric_ids) == 0:
+        raise ValueError('the database needs at least one station and metric')
+
+    # one 15 minute series per station and metric, long enough to reach the requested rows
+    pairs = [(s, m) for s in station_ids for m in metric_ids]
+    periods = -(-rows // len(pairs))
+    date_time = pd.date_range('2010-01-01', periods=periods, freq='15T').strftime('%Y-%m-%dT%H:%M:%S.000-08:00')
+    rng = np.random.RandomState(0)
+
+    fd, csv_file = tempfile.mkstemp(suffix='.csv')
+    os.close(fd)
+    try:
+        with open(csv_file, 'w') as f:
+            written = 0
+            for station_id, metric_id in pairs:
+                n = min(periods, rows - written)
+                values = rng.normal(100, 30, n)
+                f.writelines(f'{t},{metric_id},{station_id},{v:.2f}\n' for t, v in zip(date_time[:n], values))
+                written += n
+                if written >= rows:
+                    break
+
+        repo = Repository(session)
+        results = {
+            'text': min(timeit.repeat(lambda: repo.put_measurements_from_csv(csv_file), number=1, repeat=repeat)),
+            'binary': min(timeit.repeat(lambda: repo.put_measurements_from_csv(csv_file, binary=True),
+                                        number=1, repeat=repeat))
+        }
+    finally:
+        os.remove(csv_file)
+
+    print(f'{rows} measurements from {len(station_ids)} stations')
+    for name, seconds in results.items():
+        print(f'{name}: {seconds:.3f}s')
+
+    return results
+
+
+def benchmark_measurement_plans(years=4, stations=3, metric_ids=None, db=settings.DATABASE_TEST):
+    """explain a model data pull with the original and the composite measurement indexes
+
+    each plan is taken inside a transaction that is rolled back, so the database keeps the indexes it had. the
+    original layout drops the composite and BRIN indexes and creates the single column ones, the new layout runs
+    index_measurement_table with value covered. the read is the one get_measurements_for_runs issues, including its
+    metric filter.
+
+    Args:
+        years (int): years of measurements read, ending today
+        stations (int): number of stations read, the ones with the most measurements are used
+        metric_ids ([str]): metrics read, defaults to the DAILY_METRICS the models read
+        db (dict): connection string of the database to explain against
+
+    Returns:
+        dict: plan lines and execution time in milliseconds for each layout
+    """
+    end = datetime.datetime.now()
+    if metric_ids is None:
+        metric_ids = [m[0] for m in DAILY_METRICS]
+    params = {'start': end - datetime.timedelta(days=365*years), 'end': end, 'metric_ids': list(metric_ids)}
+    explain = ('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + MEASUREMENT_SQL.format(measurement='measurement') +
+               METRIC_FILTER_SQL.format(alias='m'))
+
+    connection = context.get_engine(db).raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT station_id FROM measurement
+                WHERE metric_id = ANY(%(metric_ids)s)
+                GROUP BY station_id ORDER BY COUNT(*) DESC LIMIT %(stations)s;
+            """, {'stations': stations, 'metric_ids': params['metric_ids']})
+            params['station_ids'] = [s for s, in cursor.fetchall()]
+
+        layouts = {
+            'original': f"""
+                DROP INDEX IF EXISTS {context.MEASUREMENT_INDEX};
+                DROP INDEX IF EXISTS {context.MEASUREMENT_BRIN_INDEX};
+                CREATE INDEX IF NOT EXISTS idx_station ON measurement (station_id);
+                CREATE INDEX IF NOT EXISTS idx_date_time ON measurement (date_time);
+            """,
+            'composite': None
+        }
+
+        results = {}
+        for name, ddl in layouts.items():
+            try:
+                with connection.cursor() as cursor:
+                    if ddl is None:
+                        context.index_measurement_table(cursor, include_value=True)
+                    else:
+                        cursor.execute(ddl)
+                    cursor.execute('ANALYZE measurement;')
+                    cursor.execute(explain, params)
+                    plan = cursor.fetchone()[0][0]
+            finally:
+                connection.rollback()
+
+            results[name] = {
+                'plan': json.dumps(plan['Plan'], indent=2).splitlines(),
+                'execution_ms': plan['Execution Time']
+            }
+    finally:
+        connection.close()
+
+    print(f'{len(params["station_ids"])} stations and {len(metric_ids)} metrics over {years} years')
+    for name, result in results.items():
+        print(f'{name}: {result["execution_ms"]:.1f}ms')
+        print('\n'.join(result['plan']))
+
+    return results
+
+
+def synthetic_usgs_response(sites=100, days=30):
+    """generate the body of a USGS instantaneous values response
+
+    one 15 minute discharge series per site, shaped like the responses of continuous_retrieval.usgs_params
+
+    Args:
+        sites (int): number of sites in the response
+        days (int): days of values in each series
+
+    Returns:
+        bytes: the JSON response
+    """
+    date_time = pd.date_range('2018-01-01', periods=days*96, freq='15T').strftime('%Y-%m-%dT%H:%M:%S.000-08:00')
+    rng = np.random.RandomState(0)
+
+    time_series = []
+    for site in range(sites):
+        values = rng.normal(1000, 300, len(date_time))
+        time_series.append({
+            'sourceInfo': {'siteName': f'SITE {site}',
+                           'siteCode': [{'value': f'{12000000 + site}', 'agencyCode': 'USGS'}]},
+            'variable': {'variableCode': [{'value': '00060', 'network': 'NWIS', 'variableID': 45807197}],
+                         'variableName': 'Streamflow, ft&#179;/s'},
+            'values': [{'value': [{'value': f'{v:.0f}', 'qualifiers': ['P'], 'dateTime': t}
+                                  for t, v in zip(date_time, values)]}],
+            'name': f'USGS:{12000000 + site}:00060:00000'
+        })
+
+    return json.dumps({'name': 'ns1:timeSeriesResponseType', 'value': {'timeSeries': time_series}}).encode()
+
+
+def benchmark_usgs_parsing(sites=100, days=30, repeat=3):
+    """time and trace the peak memory of parsing the same USGS response whole and as a stream
+
+    whole parsing is what response.json() does, json.loads of the body followed by continuous_retrieval.usgs_series.
+    streaming feeds USGS_STREAM_CHUNK_SIZE chunks to parse_usgs_records and consumes each record as it is yielded, the
+    way the ingest sink does. the body itself is allocated before tracing starts
+
+    Args:
+        sites (int): number of sites in the response
+        days (int): days of values in each series
+        repeat (int): number of timed runs of each parser
+
+    Returns:
+        dict: best time in seconds and peak traced bytes of each parser
+    """
+    body = synthetic_usgs_response(sites, days)
+
+    def whole():
+        count = 0
+        for date_value_map in usgs_series(json.loads(body.decode())).values():
+            count += len(date_value_map)
+        return count
+
+    def streamed():
+        chunks = (body[i:i + USGS_STREAM_CHUNK_SIZE] for i in range(0, len(body), USGS_STREAM_CHUNK_SIZE))
+        return sum(1 for _ in parse_usgs_records(chunks))
+
+    results = {}
+    for name, parse in [('whole', whole), ('streamed', streamed)]:
+        tracemalloc.start()
+        count = parse()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results[name] = {
+            'seconds': min(timeit.repeat(parse, number=1, repeat=repeat)),
+            'peak_bytes': peak,
+            'records': count
+        }
+
+    if results['whole']['records'] != results['streamed']['records']:
+        raise AssertionError('the parsers read a different number of records')
+
+    print(f'{len(body) / 2**20:.1f}MB response, {results["whole"]["records"]} records from {sites} sites')
+    for name, result in results.items():
+        print(f'{name}: {result["seconds"]:.3f}s, peak {result["peak_bytes"] / 2**20:.1f}MB')
+
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_daily_avg()
@@ -7,8 +7,8 @@ import datetime
 import json
 from math import sin, cos, sqrt, atan2, radians
 import re
-import requests
 import pandas as pd
+from riverrunner import http_client
 from riverrunner import settings
 from riverrunner.context import StationRiverDistance
 from riverrunner.repository import Repository
@@ -27,7 +27,7 @@ def scrape_rivers_urls():
     url = "http://www.professorpaddle.com/rivers/riverdetails.asp?riverid="
 
     for id in river_ids:
-        r = requests.get(url + id)
+        r = http_client.get(url + id)
 
         if r.status_code == 200:
             with open("river_%s.html" % id, 'w+') as f:
@@ -154,7 +154,7 @@ def parse_addresses_from_rivers():
         if name[0] == 0 or name[1] == 0:
             continue
 
-        r = requests.get('https://maps.googleapis.com/maps/api/geocode/json?latlng=%s,%s&key=%s' %
+        r = http_client.get('https://maps.googleapis.com/maps/api/geocode/json?latlng=%s,%s&key=%s' %
                          (name[0], name[1], settings.GEOLOCATION_API_KEY))
         components = json.loads(r.content)['results'][0]['address_components']
         addresses.append(parse_location_components(components, name[0], name[1]))
@@ -164,7 +164,7 @@ def parse_addresses_from_rivers():
         if name[0] == 0 or name[1] == 0:
             continue
 
-        r = requests.get('https://maps.googleapis.com/maps/api/geocode/json?latlng=%s,%s&key=%s' %
+        r = http_client.get('https://maps.googleapis.com/maps/api/geocode/json?latlng=%s,%s&key=%s' %
                          (name[0], name[1], settings.GEOLOCATION_API_KEY))
 
         if r.status_code == 200 and len(r.content) > 10:
@@ -184,7 +184,7 @@ def scrape_snowfall():
             for day in range(1, 32):
                 try:
                     date = '%s%02d%02d' % (year, month, day)
-                    r = requests.get(base_url + date + '.json')
+                    r = http_client.get(base_url + date + '.json')
 
                     if r.status_code == 200 and len(r.content) > 0:
                         snf = json.loads(r.content)
@@ -216,7 +216,7 @@ def parse_addresses_and_stations_from_snowfall():
             continue
 
         # parse address information
-        r = requests.get('https://maps.googleapis.com/maps/api/geocode/json?latlng=%s,%s&key=%s' %
+        r = http_client.get('https://maps.googleapis.com/maps/api/geocode/json?latlng=%s,%s&key=%s' %
                          (name[0], name[1], settings.GEOLOCATION_API_KEY))
 
         components = json.loads(r.content)['results'][0]['address_components']
@@ -267,7 +267,7 @@ def parse_addresses_and_stations_from_precip():
             stations.append(station)
 
             # parse the address
-            r = requests.get('https://maps.googleapis.com/maps/api/geocode/json?latlng=%s,%s&key=%s' %
+            r = http_client.get('https://maps.googleapis.com/maps/api/geocode/json?latlng=%s,%s&key=%s' %
                              (station['latitude'], station['longitude'], settings.GEOLOCATION_API_KEY))
 
             components = json.loads(r.content)['results'][0]['address_components']
@@ -363,7 +363,7 @@ def parse_addresses_and_stations_from_usgs():
         }
         stations.append(station)
 
-        r = requests.get('https://maps.googleapis.com/maps/api/geocode/json?latlng=%s,%s&key=%s' %
+        r = http_client.get('https://maps.googleapis.com/maps/api/geocode/json?latlng=%s,%s&key=%s' %
                          (station['lat'], station['lon'], settings.GEOLOCATION_API_KEY))
 
         if r.status_code == 200 and len(r.content) > 10:
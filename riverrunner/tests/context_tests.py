@@ -1,3 +1,4 @@
+import datetime
 from riverrunner import context
 from riverrunner.tests.tcontext import TContext
 from unittest import TestCase
@@ -158,3 +159,54 @@ class TestContext(TestCase):
         # assert
         measurements = self.session.query(context.Measurement).all()
         self.assertEqual(len(measurements), 0)
+
+    def test_contexts_share_engine(self):
+        """test that contexts of the same database share one engine
+
+        tests whether a second context reuses the engine, and with it the
+        connection pool, of the first
+        """
+        # run
+        other = TContext()
+
+        # assert
+        self.assertIs(self.context.Session.kw['bind'], other.Session.kw['bind'])
+
+    def test_measurement_partition_name(self):
+        """test partitions are named by year and month"""
+        day = datetime.date(2018, 5, 17)
+
+        # assert
+        self.assertEqual(context.measurement_partition_name(day), 'measurement_y2018m05')
+        self.assertEqual(context.measurement_partition_name(day, 'year'), 'measurement_y2018')
+        with self.assertRaises(ValueError):
+            context.measurement_partition_name(day, 'week')
+
+    def test_measurement_partitions_cover_range(self):
+        """test the partitions of a range include both ends and cross years"""
+        # run
+        partitions = context.measurement_partitions(datetime.datetime(2017, 11, 30, 23),
+                                                    datetime.datetime(2018, 2, 1))
+
+        # assert
+        self.assertEqual([p[0] for p in partitions],
+                         ['measurement_y2017m11', 'measurement_y2017m12', 'measurement_y2018m01', 'measurement_y2018m02'])
+        self.assertEqual(partitions[1][1:], (datetime.date(2017, 12, 1), datetime.date(2018, 1, 1)))
+
+    def test_parse_measurement_partition_name(self):
+        """test partition names are parsed back to their interval and bounds"""
+        # assert
+        self.assertEqual(context.parse_measurement_partition_name('measurement_y2018m12'),
+                         ('month', datetime.date(2018, 12, 1), datetime.date(2019, 1, 1)))
+        self.assertEqual(context.parse_measurement_partition_name('measurement_y2018'),
+                         ('year', datetime.date(2018, 1, 1), datetime.date(2019, 1, 1)))
+        self.assertIsNone(context.parse_measurement_partition_name('measurement_unpartitioned'))
+
+    def test_measurement_indexes(self):
+        """test the measurement table declares the composite and BRIN indexes"""
+        indexes = {i.name: i for i in context.Measurement.__table__.indexes}
+
+        # assert
+        self.assertEqual([c.name for c in indexes[context.MEASUREMENT_INDEX].columns],
+                         ['station_id', 'metric_id', 'date_time'])
+        self.assertEqual(indexes[context.MEASUREMENT_BRIN_INDEX].dialect_options['postgresql']['using'], 'brin')
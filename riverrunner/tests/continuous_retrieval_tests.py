@@ -1,8 +1,11 @@
 import datetime as dt
+import json
 from riverrunner.context import Address, Metric, RiverRun, Station
 from riverrunner.continuous_retrieval import *
 from riverrunner.tests.tcontext import TContext
+import time
 from unittest import TestCase
+from unittest import mock
 
 
 class TestRepository(TestCase):
@@ -140,6 +143,155 @@ class TestRepository(TestCase):
         date_value_map = get_usgs_json_data(site_id, start_date, end_date, param_code)
         self.assertTrue(len(date_value_map) != 0)
 
+    def test_get_usgs_batch_json_data(self):
+        """test one request returns each site's series"""
+        site_ids = ["12010000", "12013500"]
+        start_date = "2018-01-01"
+        end_date = start_date
+
+        # assert
+        series = get_usgs_batch_json_data(site_ids, start_date, end_date, PARAM_CODES)
+        self.assertEqual(set(series), {(site_id, PARAM_CODES[0]) for site_id in site_ids})
+        self.assertEqual(series[(site_ids[0], PARAM_CODES[0])],
+                         get_usgs_json_data(site_ids[0], start_date, end_date, PARAM_CODES[0]))
+
+    def test_iter_usgs_records_batches_sites(self):
+        """test records of every site are yielded whatever the batch size"""
+        site_ids = ["12010000", "12013500", "12020000"]
+        start_date = "2018-01-01"
+        end_date = start_date
+
+        # assert
+        batched = list(iter_usgs_records(site_ids, start_date, end_date, PARAM_CODES, batch_size=2, workers=2))
+        single = list(iter_usgs_records(site_ids, start_date, end_date, PARAM_CODES, batch_size=1, workers=1))
+        self.assertTrue(len(batched) != 0)
+        self.assertEqual(sorted(batched), sorted(single))
+
+    def test_usgs_update_windows(self):
+        """test sites are grouped by the day of their oldest watermark, bounded by the backfill limits"""
+        end_date = dt.date(2018, 3, 1)
+        watermarks = pd.DataFrame({
+            "station_id": ["1", "2", "3", "4"],
+            "metric_id": PARAM_CODES[0],
+            "date_time": [dt.datetime(2018, 2, 27, 15), dt.datetime(2018, 2, 27, 1), dt.datetime(2017, 1, 1),
+                          dt.datetime(2018, 3, 2)]
+        })
+
+        windows = usgs_update_windows(["1", "2", "3", "4", "5"], watermarks, end_date)
+
+        # assert
+        self.assertEqual(windows, {
+            dt.date(2018, 2, 27): ["1", "2"],
+            end_date - dt.timedelta(days=USGS_MAX_BACKFILL_DAYS): ["3"],
+            end_date: ["4"],
+            end_date - dt.timedelta(days=USGS_NEW_SITE_DAYS): ["5"]
+        })
+
+    def test_usgs_params_adds_modified_since(self):
+        """test the modifiedSince duration is only sent when given"""
+        params = usgs_params(["1", "2"], "2018-01-01", "2018-01-02", PARAM_CODES)
+        self.assertNotIn("modifiedSince", params)
+        self.assertEqual(params["sites"], "1,2")
+
+        params = usgs_params(["1"], "2018-01-01", "2018-01-02", PARAM_CODES, modified_since="P2D")
+        self.assertEqual(params["modifiedSince"], "P2D")
+
+    def test_written_usgs_records_load(self):
+        """test the files written by the scraper load with text and binary COPY"""
+        # setup
+        m = self.context.get_measurements_for_test(1, self.session)[0]
+        records = [
+            (m.station_id, m.metric_id, "2018-01-01T00:00:00.000-08:00", "1.5"),
+            (m.station_id, m.metric_id, "2018-01-01T00:15:00.000-08:00", "2.5")
+        ]
+        with open(self.context.measurements_file_name, "w") as f:
+            self.assertEqual(list(write_usgs_records(records, {m.metric_id: f})), records)
+
+        for binary in (False, True):
+            # run
+            Repository(self.session).put_measurements_from_csv(self.context.measurements_file_name, binary=binary)
+
+            # assert
+            measurements = self.session.query(Measurement).order_by(Measurement.date_time).all()
+            self.assertEqual([(x.station_id, x.metric_id, x.value) for x in measurements],
+                             [(m.station_id, m.metric_id, 1.5), (m.station_id, m.metric_id, 2.5)])
+            self.session.query(Measurement).delete()
+            self.session.commit()
+
+        # tear down
+        self.context.remove_measurements_file_for_test()
+
+    def test_main_daily_passes_dates(self):
+        """test --daily streams USGS updates to yesterday and fills DarkSky gaps over days-back with dates"""
+        with mock.patch("riverrunner.continuous_retrieval.stream_usgs_updates") as stream, \
+                mock.patch("riverrunner.continuous_retrieval.fill_noaa_gaps") as fill:
+            main(["--daily", "2"])
+
+        # assert
+        yesterday = dt.date.today() - dt.timedelta(days=1)
+        stream.assert_called_once_with(end_date=yesterday, new_site_days=2)
+        fill.assert_called_once_with(yesterday - dt.timedelta(days=2), yesterday)
+
+    def test_main_manual_passes_dates_to_fill(self):
+        """test --manual scrapes with ISO strings and fills DarkSky gaps with dates"""
+        with mock.patch("riverrunner.continuous_retrieval.scrape_usgs_data", return_value=[]) as scrape, \
+                mock.patch("riverrunner.continuous_retrieval.fill_noaa_gaps") as fill:
+            main(["--csv", "--manual", "2018-01-01", "2018-01-03"])
+
+        # assert
+        scrape.assert_called_once_with(start_date="2018-01-01", end_date="2018-01-03")
+        fill.assert_called_once_with(dt.date(2018, 1, 1), dt.date(2018, 1, 3))
+        with self.assertRaises(ValueError):
+            main(["--csv", "--daily"])
+
+    def test_parse_usgs_records(self):
+        """test records are read from a chunked USGS response with the same rules as the batch request"""
+        def series(site_id, values):
+            return {
+                "sourceInfo": {"siteCode": [{"value": site_id}]},
+                "variable": {"variableCode": [{"value": "00060"}]},
+                "values": [{"value": [{"value": v, "dateTime": t} for t, v in values]}, {"value": []}]
+            }
+
+        response = json.dumps({"value": {"timeSeries": [
+            series("1", [("t1", "10"), ("t2", "11")]),
+            series("2", [("t1", "20")]),
+            series("1", [("t3", "12")])
+        ]}}).encode()
+
+        # assert
+        records = list(parse_usgs_records(response[i:i + 16] for i in range(0, len(response), 16)))
+        self.assertEqual(records, [("1", "00060", "t1", "10"), ("1", "00060", "t2", "11"), ("2", "00060", "t1", "20")])
+
+    def test_iter_usgs_records_streams_the_same_records(self):
+        """test streamed and whole responses give the same records"""
+        site_ids = ["12010000", "12013500", "12020000"]
+        start_date = "2018-01-01"
+        end_date = start_date
+
+        # assert
+        with mock.patch("riverrunner.continuous_retrieval.USGS_STREAM_MIN_BYTES", 0):
+            streamed = list(iter_usgs_records(site_ids, start_date, end_date, PARAM_CODES, batch_size=2))
+        whole = list(iter_usgs_records(site_ids, start_date, end_date, PARAM_CODES, batch_size=2, stream=False))
+        self.assertTrue(len(streamed) != 0)
+        self.assertEqual(sorted(streamed), sorted(whole))
+
+    def test_token_bucket_limits_rate(self):
+        """test the token bucket passes a burst of its capacity then holds calls to its rate"""
+        bucket = TokenBucket(rate=20., capacity=5.)
+
+        start = time.monotonic()
+        for _ in range(5):
+            bucket.acquire()
+        burst = time.monotonic() - start
+        for _ in range(10):
+            bucket.acquire()
+        limited = time.monotonic() - start
+
+        # assert
+        self.assertLess(burst, .1)
+        self.assertGreaterEqual(limited, .45)
+
     def test_fill_noaa_gaps(self):
         station = self.context.get_stations_for_test(1, self.session)[0]
         station.source = 'NOAA'
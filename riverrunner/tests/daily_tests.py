@@ -1,6 +1,7 @@
 import os
 import psycopg2
 from riverrunner.daily import *
+from riverrunner.daily import _fit_run, _prediction_jobs
 from riverrunner.repository import Repository
 from riverrunner.tests.tcontext import TContext
 from unittest import TestCase
@@ -123,3 +124,35 @@ class TestDaily(TestCase):
 
         m = compute_predictions(self.session)
         self.assertTrue(m)
+
+    def test_compute_predictions_in_parallel(self):
+        runs = self.context.get_runs_for_test(2, self.session)
+        self.session.add_all(runs)
+        self.session.commit()
+
+        m = compute_predictions(self.session, workers=2, db=settings.DATABASE_TEST)
+        self.assertTrue(m)
+
+    def test_prediction_jobs_isolates_failed_runs(self):
+        class FailingArima:
+            """fails the read of every run at once and the daily measurements of run 2"""
+            def get_daily_data_for_runs(self, run_ids, metric_ids=None):
+                raise ValueError('read failed')
+
+            def daily_avg(self, run_id, daily=None):
+                if run_id == 2:
+                    raise ValueError('bad run')
+                return None
+
+        jobs = _prediction_jobs(self.session, FailingArima(), [1, 2, 3])
+
+        self.assertEqual(jobs, [(1, None, None), (2, None, ['bad run']), (3, None, None)])
+        self.assertEqual(_fit_run(jobs[1]), (2, None, None, ['bad run']))
+
+    def test_build_predictions(self):
+        days = pd.date_range('2018-05-01', periods=3)
+        predictions = build_predictions(1, pd.Series([100.04, 200.06, 300.], index=days))
+
+        self.assertEqual(len(predictions), 3)
+        self.assertEqual(predictions[1].fr, 200.1)
+        self.assertEqual(predictions[2].timestamp, days[2])
@@ -0,0 +1,106 @@
+import requests
+from riverrunner.http_client import *
+import time
+from unittest import TestCase
+
+
+class ScriptedSession:
+    """stands in for a requests session, answering each request with the next scripted response or error"""
+    def __init__(self, script):
+        self.script = list(script)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        answer = self.script.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+
+        return answer
+
+
+def response(status_code, headers=None):
+    """a response with a status code and headers"""
+    r = requests.Response()
+    r.status_code = status_code
+    r.headers.update(headers or {})
+    return r
+
+
+class TestHttpClient(TestCase):
+    def client(self, script, **kwargs):
+        """a client without backoff answering from a script"""
+        client = HttpClient(backoff=0., **kwargs)
+        client.session = ScriptedSession(script)
+        return client
+
+    def test_retries_server_errors_and_rate_limits(self):
+        """test 5xx, 429 and connection errors are retried until a response succeeds"""
+        client = self.client([response(503), requests.ConnectionError(), response(429), response(200)])
+
+        r = client.get('https://example.com/data', params={'a': 1})
+
+        # assert
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(client.session.requests), 4)
+        self.assertEqual(client.session.requests[0][2]['timeout'], (client.connect_timeout, client.read_timeout))
+
+    def test_does_not_retry_client_errors(self):
+        """test a 4xx other than 429 is returned at once"""
+        client = self.client([response(404)])
+
+        # assert
+        self.assertEqual(client.get('https://example.com/missing').status_code, 404)
+        self.assertEqual(len(client.session.requests), 1)
+
+    def test_returns_last_response_or_raises_last_error(self):
+        """test a request failing every attempt returns its last response or raises its last error"""
+        client = self.client([response(500)] * 3 + [requests.Timeout()] * 3, retries=2)
+
+        # assert
+        self.assertEqual(client.get('https://example.com/').status_code, 500)
+        with self.assertRaises(requests.Timeout):
+            client.get('https://example.com/')
+
+    def test_circuit_opens_per_host(self):
+        """test a host failing repeatedly is refused while other hosts are still requested"""
+        client = self.client([response(500), response(500), response(200)], retries=0, failures=2)
+
+        client.get('https://down.example.com/')
+        client.get('https://down.example.com/')
+
+        # assert
+        with self.assertRaises(CircuitOpenError):
+            client.get('https://down.example.com/')
+        self.assertEqual(client.get('https://up.example.com/').status_code, 200)
+        self.assertEqual(len(client.session.requests), 3)
+
+    def test_circuit_allows_trial_after_reset(self):
+        """test an open circuit lets a single trial through after the reset time and closes on its success"""
+        breaker = CircuitBreaker(failures=1, reset=.05)
+        breaker.record_failure()
+
+        # assert
+        self.assertFalse(breaker.allow())
+        time.sleep(.06)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+        breaker.record_success()
+        self.assertFalse(breaker.open)
+        self.assertTrue(breaker.allow())
+
+    def test_unexpected_error_ends_trial(self):
+        """test an error that is not retried fails the trial request instead of leaving the circuit half open"""
+        client = self.client([response(500), requests.TooManyRedirects(), response(200)], retries=0, failures=1,
+                             reset=.05)
+        client.get('https://flaky.example.com/')
+
+        time.sleep(.06)
+        with self.assertRaises(requests.TooManyRedirects):
+            client.get('https://flaky.example.com/')
+
+        # assert
+        self.assertTrue(client.breaker('https://flaky.example.com/').open)
+        time.sleep(.06)
+        self.assertEqual(client.get('https://flaky.example.com/').status_code, 200)
@@ -0,0 +1,70 @@
+import json
+from riverrunner.json_stream import *
+from unittest import TestCase
+
+
+def split(data, size):
+    """split a document into chunks of a size"""
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestJsonStream(TestCase):
+    def setUp(self):
+        """perform before each unittest"""
+        self.document = {
+            'name': 'ns1:timeSeriesResponseType',
+            'value': {
+                'timeSeries': [
+                    {'values': [{'value': [{'value': '1.5', 'dateTime': '2018-01-01T00:00:00.000-08:00'}]}]},
+                    {'values': [{'value': []}], 'flags': [True, False, None], 'count': -12, 'mean': 2.5e-3}
+                ]
+            },
+            'note': 'escaped \"quotes\", \\backslashes\\ and ünicode'
+        }
+        self.text = json.dumps(self.document, ensure_ascii=False)
+
+    def test_iter_items_matches_json_loads_for_any_chunking(self):
+        """test the whole document parses the same whatever the chunk boundaries"""
+        data = self.text.encode()
+        for size in [1, 2, 3, 7, 64, len(data)]:
+            items = list(iter_items(split(data, size), ''))
+            self.assertEqual(items, [((), self.document)])
+
+        items = list(iter_items(split(self.text, 5), ''))
+        self.assertEqual(items, [((), self.document)])
+
+    def test_iter_items_yields_each_prefix_in_document_order(self):
+        """test values at several prefixes are yielded with their paths"""
+        items = list(iter_items(split(self.text, 4), 'value.timeSeries.item.values.item.value.item',
+                                'value.timeSeries.item.flags.item'))
+
+        # assert
+        self.assertEqual(items, [
+            (('value', 'timeSeries', 0, 'values', 0, 'value', 0),
+             {'value': '1.5', 'dateTime': '2018-01-01T00:00:00.000-08:00'}),
+            (('value', 'timeSeries', 1, 'flags', 0), True),
+            (('value', 'timeSeries', 1, 'flags', 1), False),
+            (('value', 'timeSeries', 1, 'flags', 2), None)
+        ])
+
+    def test_iter_events(self):
+        """test events carry the path of their value"""
+        events = list(iter_events(['{"a": [1, ', '{"b": "c"}]}']))
+
+        # assert
+        self.assertEqual(events, [
+            ((), 'start_map', None),
+            (('a',), 'start_array', None),
+            (('a', 0), 'value', 1),
+            (('a', 1), 'start_map', None),
+            (('a', 1, 'b'), 'value', 'c'),
+            (('a', 1), 'end_map', None),
+            (('a',), 'end_array', None),
+            ((), 'end_map', None)
+        ])
+
+    def test_invalid_documents_raise(self):
+        """test malformed documents raise ValueError"""
+        for document in ['{"a": 1,}', '[1 2]', '{"a" 1}', '"open', 'tru', '[1', '01', '{"a": 1} 2']:
+            with self.assertRaises(ValueError):
+                list(iter_events(split(document, 2)))
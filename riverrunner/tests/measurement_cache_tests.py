@@ -0,0 +1,178 @@
+import datetime
+import pandas as pd
+from riverrunner.measurement_cache import *
+from unittest import TestCase
+
+
+class TestMeasurementCache(TestCase):
+    def setUp(self):
+        """perform before each unittest"""
+        self.start = datetime.datetime(2018, 1, 1)
+        self.measurements = pd.DataFrame({
+            'date_time': pd.date_range(self.start, periods=24*60, freq='H').to_pydatetime(),
+            'metric_id': '00060',
+            'source': 'USGS',
+            'station_id': '1',
+            'value': range(24*60)
+        })
+        self.fetched = []
+
+    def fetch(self, start_date, end_date):
+        """read the synthetic measurements of a range, recording the range"""
+        self.fetched.append((start_date, end_date))
+        df = self.measurements
+        return df[(df.date_time >= start_date) & (df.date_time < end_date)].reset_index(drop=True)
+
+    def days(self, first, last):
+        """the start date plus a number of days"""
+        return self.start + datetime.timedelta(days=first), self.start + datetime.timedelta(days=last)
+
+    def test_subtract_ranges(self):
+        """test subtract_ranges returns the uncovered parts of a range"""
+        ranges = [(1, 3), (5, 7)]
+
+        self.assertEqual(subtract_ranges(ranges, 0, 8), [(0, 1), (3, 5), (7, 8)])
+        self.assertEqual(subtract_ranges(ranges, 2, 6), [(3, 5)])
+        self.assertEqual(subtract_ranges(ranges, 1, 3), [])
+        self.assertEqual(subtract_ranges([], 1, 3), [(1, 3)])
+
+    def test_union_ranges(self):
+        """test union_ranges merges overlapping and adjacent ranges"""
+        self.assertEqual(union_ranges([(1, 3), (5, 7)], 3, 5), [(1, 7)])
+        self.assertEqual(union_ranges([(1, 3), (5, 7)], 8, 9), [(1, 3), (5, 7), (8, 9)])
+        self.assertEqual(union_ranges([(2, 3)], 0, 1), [(0, 1), (2, 3)])
+
+    def test_get_fetches_only_missing_ranges(self):
+        """test a wider read only fetches the part not read before"""
+        cache = MeasurementCache()
+
+        first = cache.get(['1'], None, *self.days(10, 20), fetch=self.fetch)
+        second = cache.get(['1'], None, *self.days(5, 25), fetch=self.fetch)
+
+        self.assertEqual(len(first), 24*10)
+        self.assertEqual(len(second), 24*20)
+        self.assertEqual(self.fetched, [self.days(10, 20), self.days(5, 10), self.days(20, 25)])
+        self.assertTrue(second.date_time.is_monotonic_increasing)
+
+        # fully covered, nothing is fetched
+        third = cache.get(['1'], None, *self.days(6, 8), fetch=self.fetch)
+        self.assertEqual(len(third), 24*2)
+        self.assertEqual(len(self.fetched), 3)
+
+    def test_get_refetches_unsettled_ranges(self):
+        """test measurements newer than the settle time are always read again"""
+        cache = MeasurementCache()
+        now = datetime.datetime.now()
+        start_date = now - datetime.timedelta(days=3)
+
+        cache.get(['1'], None, start_date, now, fetch=self.fetch)
+        cache.get(['1'], None, start_date, now, fetch=self.fetch)
+
+        self.assertEqual(len(self.fetched), 2)
+        # only the part after the settle horizon of the first read is fetched again
+        self.assertGreaterEqual(self.fetched[1][0], now - cache.settle)
+        self.assertLess(self.fetched[1][0], now - cache.settle + datetime.timedelta(minutes=1))
+        self.assertEqual(self.fetched[1][1], now)
+
+    def test_get_keys_by_stations_and_metrics(self):
+        """test reads of different stations or metrics are cached separately"""
+        cache = MeasurementCache()
+
+        cache.get(['1'], None, *self.days(0, 1), fetch=self.fetch)
+        cache.get(['1'], ['00060'], *self.days(0, 1), fetch=self.fetch)
+        cache.get(['1', '2'], None, *self.days(0, 1), fetch=self.fetch)
+        cache.get(['2', '1'], None, *self.days(0, 1), fetch=self.fetch)
+
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(len(self.fetched), 3)
+
+    def test_get_keys_by_source(self):
+        """test reads of different databases or layouts are cached separately and invalidated separately"""
+        cache = MeasurementCache()
+        row, compact = ('postgresql://db', 'measurement'), ('postgresql://db', 'compact_measurement')
+
+        cache.get(['1'], None, *self.days(0, 10), fetch=self.fetch, source=row)
+        cache.get(['1'], None, *self.days(0, 10), fetch=self.fetch, source=compact)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(len(self.fetched), 2)
+
+        cache.invalidate('1', '00060', *self.days(4, 4), source=compact)
+        cache.get(['1'], None, *self.days(0, 10), fetch=self.fetch, source=row)
+        cache.get(['1'], None, *self.days(0, 10), fetch=self.fetch, source=compact)
+
+        self.assertEqual(self.fetched[2:], [self.days(4, 5)])
+
+    def test_invalidate_refetches_changed_days(self):
+        """test invalidated days are read again and replace the cached values"""
+        cache = MeasurementCache()
+        cache.get(['1'], None, *self.days(0, 10), fetch=self.fetch)
+
+        self.measurements.loc[self.measurements.date_time == self.start + datetime.timedelta(days=4, hours=3),
+                              'value'] = -1.
+        cache.invalidate('1', '00060', *self.days(4, 4))
+        df = cache.get(['1'], None, *self.days(0, 10), fetch=self.fetch)
+
+        self.assertEqual(self.fetched[1], self.days(4, 5))
+        self.assertEqual(len(df), 24*10)
+        self.assertEqual(df.value[24*4 + 3], -1.)
+
+    def test_invalidate_ignores_other_stations(self):
+        """test invalidating a station leaves entries of other stations covered"""
+        cache = MeasurementCache()
+        cache.get(['1'], None, *self.days(0, 10), fetch=self.fetch)
+
+        cache.invalidate('2', '00060', *self.days(4, 4))
+        cache.invalidate('1', '00010', *self.days(4, 4))
+        cache.get(['1'], ['00060'], *self.days(0, 1), fetch=self.fetch)
+        cache.get(['1'], None, *self.days(0, 10), fetch=self.fetch)
+
+        self.assertEqual(len(self.fetched), 3)
+        self.assertEqual(self.fetched[2], self.days(4, 5))
+
+    def test_invalidate_drops_deleted_measurements(self):
+        """test measurements deleted from an invalidated day are not served again"""
+        cache = MeasurementCache()
+        cache.get(['1'], None, *self.days(0, 10), fetch=self.fetch)
+
+        # day 4 downsampled to its first hour
+        day = self.start + datetime.timedelta(days=4)
+        self.measurements = self.measurements[(self.measurements.date_time < day + datetime.timedelta(hours=1)) |
+                                              (self.measurements.date_time >= day + datetime.timedelta(days=1))]
+        cache.invalidate('1', '00060', day, day)
+        df = cache.get(['1'], None, *self.days(0, 10), fetch=self.fetch)
+
+        self.assertEqual(len(df), 24*9 + 1)
+        self.assertTrue(df.date_time.is_monotonic_increasing)
+
+    def test_write_during_fetch_is_not_recorded_as_covered(self):
+        """test a range invalidated while it is fetched is fetched again on the next read"""
+        cache = MeasurementCache()
+
+        def fetch_racing_write(start_date, end_date):
+            df = self.fetch(start_date, end_date)
+            cache.invalidate('1', '00060', *self.days(2, 2))
+            return df
+
+        first = cache.get(['1'], None, *self.days(0, 5), fetch=fetch_racing_write)
+        cache.get(['1'], None, *self.days(0, 5), fetch=self.fetch)
+
+        self.assertEqual(len(first), 24*5)
+        self.assertEqual(self.fetched, [self.days(0, 5), self.days(0, 5)])
+
+    def test_evicts_least_recently_used(self):
+        """test entries are evicted least recently used first once over the memory limit"""
+        cache = MeasurementCache()
+        cache.get(['1'], None, *self.days(0, 10), fetch=self.fetch)
+        cache.max_bytes = cache.bytes * 2
+
+        cache.get(['2'], None, *self.days(0, 10), fetch=self.fetch)
+        cache.get(['1'], None, *self.days(0, 10), fetch=self.fetch)
+        cache.get(['3'], None, *self.days(0, 10), fetch=self.fetch)
+
+        self.assertEqual(len(cache), 2)
+        self.assertLessEqual(cache.bytes, cache.max_bytes)
+
+        # station 2 was evicted, station 1 was not
+        cache.get(['1'], None, *self.days(0, 10), fetch=self.fetch)
+        cache.get(['2'], None, *self.days(0, 10), fetch=self.fetch)
+        self.assertEqual(len(self.fetched), 4)
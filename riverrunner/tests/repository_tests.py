@@ -2,9 +2,10 @@ import datetime
 import numpy as np
 import psycopg2
 from riverrunner import context, settings
-from riverrunner.context import Address, Measurement, Metric, RiverRun, Station, StationRiverDistance
+from riverrunner.context import Address, DailyMeasurement, Measurement, Metric, ModelOrder, ModelParameters, RiverRun, Station, StationRiverDistance
 from riverrunner.repository import Repository
 from riverrunner.tests.tcontext import TContext
+from sqlalchemy.exc import SQLAlchemyError
 from unittest import TestCase
 from unittest import skip
 
@@ -96,6 +97,53 @@ class TestRepository(TestCase):
         predictions = self.session.query(context.Prediction).filter(context.Prediction.run_id == 1).all()
         self.assertEqual(len(predictions), 0)
 
+    def test_put_model_order_replaces_cached_order(self):
+        """test put_model_order keeps a single order per run"""
+        # setup
+        runs = self.context.get_runs_for_test(1, self.session)
+        self.session.add_all(runs)
+        self.session.commit()
+
+        now = datetime.datetime.now()
+        self.repo.put_model_order(ModelOrder(run_id=runs[0].run_id, ar_order=2, ma_order=1, selected=now))
+        self.repo.put_model_order(ModelOrder(run_id=runs[0].run_id, ar_order=3, ma_order=0, selected=now))
+
+        # assert
+        orders = self.session.query(ModelOrder).all()
+        self.assertEqual(len(orders), 1)
+        self.assertEqual(self.repo.get_model_order(runs[0].run_id).order, (3, 0))
+
+    def test_get_model_order_returns_none_if_not_selected(self):
+        """test get_model_order for a run without a cached order"""
+        # setup
+        runs = self.context.get_runs_for_test(1, self.session)
+        self.session.add_all(runs)
+        self.session.commit()
+
+        # assert
+        self.assertIsNone(self.repo.get_model_order(runs[0].run_id))
+
+    def test_put_model_parameters_keeps_one_set_per_order(self):
+        """test put_model_parameters stores parameters per run and order"""
+        # setup
+        runs = self.context.get_runs_for_test(1, self.session)
+        self.session.add_all(runs)
+        self.session.commit()
+
+        now = datetime.datetime.now()
+        rid = runs[0].run_id
+        self.repo.put_model_parameters(
+            ModelParameters(run_id=rid, ar_order=1, ma_order=1, params=[1., .2, .3, .4, .5], fitted=now))
+        self.repo.put_model_parameters(
+            ModelParameters(run_id=rid, ar_order=1, ma_order=1, params=[2., .2, .3, .4, .5], fitted=now))
+        self.repo.put_model_parameters(
+            ModelParameters(run_id=rid, ar_order=2, ma_order=0, params=[1., .2, .3, .4, .5], fitted=now))
+
+        # assert
+        self.assertEqual(len(self.session.query(ModelParameters).all()), 2)
+        self.assertAlmostEqual(self.repo.get_model_parameters(rid, 1, 1).params[0], 2.)
+        self.assertIsNone(self.repo.get_model_parameters(rid, 0, 1))
+
     def test_put_measurements_add_new(self):
         """test put_measurements adds new values"""
         # setup
@@ -131,6 +179,64 @@ class TestRepository(TestCase):
         # tear down
         self.context.remove_measurements_file_for_test()
 
+    def test_put_measurements_binary_matches_text(self):
+        """test a binary COPY stores the same measurements as a text COPY"""
+        # setup
+        self.context.get_measurements_file_for_test(5, self.session)
+        self.repo.put_measurements_from_csv(self.context.measurements_file_name)
+        text = [m.dict for m in self.session.query(context.Measurement).order_by(context.Measurement.date_time)]
+        self.session.query(context.Measurement).delete()
+        self.session.commit()
+
+        # run
+        self.repo.put_measurements_from_csv(self.context.measurements_file_name, binary=True)
+
+        # assert
+        binary = [m.dict for m in self.session.query(context.Measurement).order_by(context.Measurement.date_time)]
+        self.assertEqual(text, binary)
+
+        # tear down
+        self.context.remove_measurements_file_for_test()
+
+    def test_put_measurements_keeps_last_duplicate(self):
+        """test a file containing a measurement twice loads the last value"""
+        # setup
+        self.context.get_measurements_file_for_test(1, self.session)
+        with open(self.context.measurements_file_name, "r") as f:
+            measurement = f.readline().strip().split(",")
+            new_value = float(measurement[3]) + 1
+        with open(self.context.measurements_file_name, "a") as f:
+            measurement[3] = str(new_value)
+            f.write("{}\n".format(",".join(measurement)))
+
+        # assert
+        self.repo.put_measurements_from_csv(self.context.measurements_file_name)
+        measurements = self.session.query(context.Measurement).all()
+        self.assertEqual(len(measurements), 1)
+        self.assertAlmostEqual(measurements[0].value, new_value)
+
+        # tear down
+        self.context.remove_measurements_file_for_test()
+
+    def test_put_measurements_binary_keeps_last_null_duplicate(self):
+        """test a binary COPY keeps the last of a measurement repeated with a missing value"""
+        # setup
+        self.context.get_measurements_file_for_test(1, self.session)
+        with open(self.context.measurements_file_name, "r") as f:
+            measurement = f.readline().strip().split(",")
+        with open(self.context.measurements_file_name, "a") as f:
+            measurement[3] = r"\N"
+            f.write("{}\n".format(",".join(measurement)))
+
+        # assert
+        self.repo.put_measurements_from_csv(self.context.measurements_file_name, binary=True)
+        measurements = self.session.query(context.Measurement).all()
+        self.assertEqual(len(measurements), 1)
+        self.assertIsNone(measurements[0].value)
+
+        # tear down
+        self.context.remove_measurements_file_for_test()
+
     def test_put_measurements_checks_integrity(self):
         """test put_measurements checks referential integrity"""
         # setup
@@ -677,3 +783,679 @@ class TestRepository(TestCase):
         # assert
         measurements = self.session.query(Measurement).all()
         self.assertEqual(24, len(measurements))
+
+    def test_put_measurements_from_list_updates_daily_rollup(self):
+        """test put_measurements_from_list maintains the daily rollup"""
+        # setup
+        stations = self.context.get_stations_for_test(1, self.session)
+        metrics = self.context.get_metrics_for_test(1)
+        self.session.add_all(stations + metrics)
+        self.session.commit()
+
+        day = datetime.datetime(2018, 5, 1)
+        measurements = [
+            Measurement(
+                station_id=stations[0].station_id,
+                metric_id=metrics[0].metric_id,
+                date_time=day + datetime.timedelta(hours=12*i),
+                value=float(i)
+            )
+            for i in range(4)
+        ]
+
+        # assert
+        self.repo.put_measurements_from_list(measurements)
+        rollup = self.session.query(DailyMeasurement).order_by(DailyMeasurement.day).all()
+
+        self.assertEqual(len(rollup), 2)
+        self.assertEqual(rollup[0].value_count, 2)
+        self.assertAlmostEqual(rollup[0].value_sum, 1.)
+        self.assertAlmostEqual(rollup[1].value_mean, 2.5)
+
+    def test_put_measurements_from_list_upsert_accepts_arrays(self):
+        """test the bulk upsert takes the rows of a numpy array"""
+        # setup
+        stations = self.context.get_stations_for_test(1, self.session)
+        metrics = self.context.get_metrics_for_test(1)
+        self.session.add_all(stations + metrics)
+        self.session.commit()
+
+        day = datetime.datetime(2018, 5, 1)
+        station_id, metric_id = stations[0].station_id, metrics[0].metric_id
+        rows = np.array([
+            [station_id, metric_id, day, 1.],
+            [station_id, metric_id, day, 2.],
+            [station_id, metric_id, day + datetime.timedelta(hours=1), 4.]
+        ], dtype=object)
+
+        # run
+        self.repo.put_measurements_from_list(rows, upsert=True)
+
+        # assert
+        measurements = self.session.query(Measurement).order_by(Measurement.date_time).all()
+        self.assertEqual(len(measurements), 2)
+        self.assertAlmostEqual(measurements[0].value, 2.)
+
+    def test_put_measurements_from_list_rolls_back_rollup_with_measurements(self):
+        """test a failed list leaves neither measurements nor rollup rows behind"""
+        # setup
+        stations = self.context.get_stations_for_test(1, self.session)
+        metrics = self.context.get_metrics_for_test(1)
+        self.session.add_all(stations + metrics)
+        self.session.commit()
+
+        def measurement(day):
+            return Measurement(station_id=stations[0].station_id, metric_id=metrics[0].metric_id,
+                               date_time=datetime.datetime(2018, 5, day), value=1.)
+
+        self.repo.put_measurements_from_list([measurement(1)])
+
+        # assert
+        with self.assertRaises(SQLAlchemyError):
+            self.repo.put_measurements_from_list([measurement(2), measurement(1)])
+        self.assertEqual(self.session.query(Measurement).count(), 1)
+        self.assertEqual(self.session.query(DailyMeasurement).count(), 1)
+
+    def test_put_daily_measurements_if_empty_builds_once(self):
+        """test the rollup is only built from stored measurements while it is empty"""
+        # setup
+        stations = self.context.get_stations_for_test(1, self.session)
+        metrics = self.context.get_metrics_for_test(1)
+        self.session.add_all(stations + metrics)
+        self.session.commit()
+        self.repo.put_measurements_from_list([
+            (stations[0].station_id, metrics[0].metric_id, datetime.datetime(2018, 5, 1, i), 1.) for i in range(4)
+        ], upsert=True)
+        self.session.query(DailyMeasurement).delete()
+        self.session.commit()
+
+        # assert
+        self.assertEqual(self.repo.put_daily_measurements(if_empty=True), 1)
+        self.assertEqual(self.session.query(DailyMeasurement).one().value_count, 4)
+        self.assertEqual(self.repo.put_daily_measurements(if_empty=True), 0)
+
+    def test_put_measurements_from_list_upsert_overwrites(self):
+        """test the bulk upsert overwrites existing measurements and keeps the last duplicate"""
+        # setup
+        stations = self.context.get_stations_for_test(1, self.session)
+        metrics = self.context.get_metrics_for_test(1)
+        self.session.add_all(stations + metrics)
+        self.session.commit()
+
+        day = datetime.datetime(2018, 5, 1)
+        station_id, metric_id = stations[0].station_id, metrics[0].metric_id
+        self.repo.put_measurements_from_list([
+            Measurement(station_id=station_id, metric_id=metric_id, date_time=day, value=1.)
+        ], upsert=True)
+
+        # run
+        self.repo.put_measurements_from_list([
+            (station_id, metric_id, day, 2.),
+            (station_id, metric_id, day, 3.),
+            (station_id, metric_id, day + datetime.timedelta(hours=1), 5.)
+        ], upsert=True)
+
+        # assert
+        measurements = self.session.query(Measurement).order_by(Measurement.date_time).all()
+        self.assertEqual(len(measurements), 2)
+        self.assertAlmostEqual(measurements[0].value, 3.)
+
+        rollup = self.session.query(DailyMeasurement).all()
+        self.assertEqual(len(rollup), 1)
+        self.assertEqual(rollup[0].value_count, 2)
+        self.assertAlmostEqual(rollup[0].value_sum, 8.)
+
+    def test_put_measurements_from_stream(self):
+        """test records are copied from an iterator and written to the audit file"""
+        # setup
+        stations = self.context.get_stations_for_test(1, self.session)
+        metrics = self.context.get_metrics_for_test(1)
+        self.session.add_all(stations + metrics)
+        self.session.commit()
+
+        day = datetime.datetime(2018, 5, 1)
+        records = (
+            (stations[0].station_id, metrics[0].metric_id, day + datetime.timedelta(hours=i), float(i))
+            for i in range(48)
+        )
+
+        # run
+        added = self.repo.put_measurements_from_stream(records, audit_file=self.context.measurements_file_name)
+
+        # assert
+        self.assertEqual(added, 48)
+        self.assertEqual(self.session.query(Measurement).count(), 48)
+        self.assertEqual(self.session.query(DailyMeasurement).count(), 2)
+        with open(self.context.measurements_file_name, "r") as f:
+            self.assertEqual(len(f.readlines()), 48)
+
+        # tear down
+        self.context.remove_measurements_file_for_test()
+
+    def test_put_measurements_overwrite_updates_daily_rollup(self):
+        """test overwritten values are not counted twice in the daily rollup"""
+        # setup
+        self.context.get_measurements_file_for_test(1, self.session)
+        self.repo.put_measurements_from_csv(self.context.measurements_file_name)
+        with open(self.context.measurements_file_name, "r") as f:
+            measurement = f.readline().strip().split(",")
+            new_value = float(measurement[3]) + 1
+            measurement[3] = str(new_value)
+        with open(self.context.measurements_file_name, "w") as f:
+            f.write("{}\n".format(",".join(measurement)))
+
+        # assert
+        self.repo.put_measurements_from_csv(self.context.measurements_file_name)
+        rollup = self.session.query(DailyMeasurement).all()
+        self.assertEqual(len(rollup), 1)
+        self.assertEqual(rollup[0].value_count, 1)
+        self.assertAlmostEqual(rollup[0].value_sum, new_value)
+
+        # tear down
+        self.context.remove_measurements_file_for_test()
+
+    def test_get_measurements_aggregates_in_database(self):
+        """test an aggregated read returns one row per station, metric and day with each metric's aggregate"""
+        # setup
+        stations = self.context.get_stations_for_test(1, self.session)
+        run = RiverRun(run_id=1, put_in_latitude=0., put_in_longitude=0., take_out_latitude=0., take_out_longitude=0.)
+        self.session.add_all(stations + [run, Metric(metric_id='00003'), Metric(metric_id='00060')])
+        self.session.add(StationRiverDistance(station_id=stations[0].station_id, run_id=1, distance=1.))
+        self.session.commit()
+
+        now = datetime.datetime.now()
+        day = datetime.datetime(now.year, now.month, now.day) - datetime.timedelta(days=5)
+        self.repo.put_measurements_from_list([
+            (stations[0].station_id, metric_id, day + datetime.timedelta(hours=6*i), float(i))
+            for metric_id in ['00003', '00060'] for i in range(8)
+        ], upsert=True)
+
+        # run
+        aggregated = self.repo.get_measurements(run_id=1, start_date=day - datetime.timedelta(days=1),
+                                                resolution='day', aggregates={'00003': 'sum'})
+
+        # assert
+        self.assertEqual(len(aggregated), 4)
+        self.assertTrue((aggregated.value_count == 4).all())
+        aggregated = aggregated.set_index(['metric_id', 'date_time']).value
+        self.assertAlmostEqual(aggregated['00003', day], 6.)
+        self.assertAlmostEqual(aggregated['00060', day + datetime.timedelta(days=1)], 5.5)
+
+    def test_get_measurements_throws_for_unsupported_aggregation(self):
+        """test get_measurements rejects unknown resolutions and aggregations"""
+        with self.assertRaises(ValueError):
+            self.repo.get_measurements(run_id=1, resolution='week')
+
+        with self.assertRaises(ValueError):
+            self.repo.get_measurements(run_id=1, resolution='day', aggregates='median')
+
+        with self.assertRaises(ValueError):
+            self.repo.get_measurements(run_id=1, aggregates='sum')
+
+    def test_get_daily_measurements_returns_rollup_for_run(self):
+        """test get_daily_measurements returns one row per station, metric and day"""
+        # setup
+        now = datetime.datetime.now()
+        today = datetime.datetime(now.year, now.month, now.day)
+
+        address = self.session.query(Address).first()
+        station = Station(
+            station_id='1',
+            latitude=address.latitude,
+            longitude=address.longitude,
+            source='USGS'
+        )
+
+        run = RiverRun(
+            run_id=1,
+            put_in_latitude=address.latitude,
+            put_in_longitude=address.longitude,
+            take_out_latitude=address.latitude,
+            take_out_longitude=address.longitude
+        )
+
+        strd = StationRiverDistance(station_id=station.station_id, run_id=run.run_id, distance=1.)
+        metric = Metric(metric_id='00060')
+
+        self.session.add_all([station, run, strd, metric])
+        self.session.commit()
+
+        self.repo.put_measurements_from_list([
+            Measurement(
+                station_id=station.station_id,
+                metric_id=metric.metric_id,
+                date_time=today - datetime.timedelta(days=5, minutes=15*i),
+                value=float(i)
+            )
+            for i in range(8)
+        ])
+
+        # assert
+        daily = self.repo.get_daily_measurements(run_id=run.run_id,
+                                                 start_date=today - datetime.timedelta(days=10),
+                                                 end_date=today)
+        self.assertEqual(len(daily), 2)
+        self.assertEqual(daily.value_count.sum(), 8)
+        self.assertTrue(set(daily.source.values) == {'USGS'})
+
+    def test_compact_layout_round_trip(self):
+        """test measurements written in the compact layout read back with their string ids"""
+        # setup
+        now = datetime.datetime.now()
+        today = datetime.datetime(now.year, now.month, now.day)
+
+        address = self.session.query(Address).first()
+        station = Station(
+            station_id='1',
+            latitude=address.latitude,
+            longitude=address.longitude,
+            source='USGS'
+        )
+
+        run = RiverRun(
+            run_id=1,
+            put_in_latitude=address.latitude,
+            put_in_longitude=address.longitude,
+            take_out_latitude=address.latitude,
+            take_out_longitude=address.longitude
+        )
+
+        strd = StationRiverDistance(station_id=station.station_id, run_id=run.run_id, distance=1.)
+        metric = Metric(metric_id='00060')
+
+        self.session.add_all([station, run, strd, metric])
+        self.session.commit()
+
+        with self.connection.cursor() as cursor:
+            context.compact_measurement_table(cursor)
+        self.connection.commit()
+
+        repo = Repository(session=self.session, compact=True)
+
+        # run
+        repo.put_measurements_from_list([
+            (station.station_id, metric.metric_id, today - datetime.timedelta(days=5, minutes=15*i), float(i))
+            for i in range(8)
+        ])
+
+        # assert
+        measurements = repo.get_measurements(run_id=run.run_id,
+                                             start_date=today - datetime.timedelta(days=10),
+                                             end_date=today)
+        self.assertEqual(len(measurements), 8)
+        self.assertTrue(set(measurements.station_id.values) == {station.station_id})
+        self.assertAlmostEqual(measurements.value.sum(), 28.)
+        self.assertEqual(self.session.query(context.CompactMeasurement).count(), 8)
+        self.assertEqual(self.session.query(context.Measurement).count(), 0)
+        self.assertEqual(self.session.query(DailyMeasurement).count(), 2)
+
+    def test_partitioned_measurement_table(self):
+        """test migrating to partitions, creating partitions on ingest and detaching old partitions"""
+        # setup
+        stations = self.context.get_stations_for_test(1, self.session)
+        metrics = self.context.get_metrics_for_test(1)
+        self.session.add_all(stations + metrics)
+        self.session.commit()
+
+        station_id, metric_id = stations[0].station_id, metrics[0].metric_id
+        self.repo.put_measurements_from_list([(station_id, metric_id, datetime.datetime(2018, 5, 1), 1.)],
+                                             upsert=True)
+
+        with self.connection.cursor() as cursor:
+            created = context.partition_measurement_table(cursor, keep_unpartitioned=True)
+        self.connection.commit()
+
+        try:
+            # run
+            self.repo.put_measurements_from_list([(station_id, metric_id, datetime.datetime(2018, 7, 1), 2.)],
+                                                 upsert=True)
+            with self.connection.cursor() as cursor:
+                partitions = context.get_measurement_partitions(cursor)
+            count = self.session.query(Measurement).count()
+            self.session.rollback()
+
+            with self.connection.cursor() as cursor:
+                detached = context.detach_measurement_partitions(cursor, datetime.date(2018, 6, 1), drop=True)
+            self.connection.commit()
+
+            # assert
+            self.assertEqual(created, ['measurement_y2018m05'])
+            self.assertEqual(partitions, ['measurement_y2018m05', 'measurement_y2018m07'])
+            self.assertEqual(count, 2)
+            self.assertEqual(detached, ['measurement_y2018m05'])
+            self.assertEqual(self.session.query(Measurement).one().value, 2.)
+            self.assertEqual(self.session.query(context.MeasurementRetention).one().cutoff,
+                             datetime.datetime(2018, 6, 1))
+            self.session.rollback()
+
+        finally:
+            # tear down, restore the unpartitioned table
+            self.session.rollback()
+            self.connection.rollback()
+            with self.connection.cursor() as cursor:
+                cursor.execute(f"""
+                    DROP TABLE measurement;
+                    DROP TABLE IF EXISTS measurement_y2018m05;
+                    ALTER TABLE measurement_unpartitioned RENAME TO measurement;
+                    ALTER INDEX measurement_unpartitioned_pkey RENAME TO measurement_pkey;
+                    ALTER INDEX IF EXISTS {context.MEASUREMENT_INDEX}_unpartitioned
+                        RENAME TO {context.MEASUREMENT_INDEX};
+                    ALTER INDEX IF EXISTS {context.MEASUREMENT_BRIN_INDEX}_unpartitioned
+                        RENAME TO {context.MEASUREMENT_BRIN_INDEX};
+                """)
+            self.connection.commit()
+
+    def put_measurements_for_retention_test(self):
+        """add two days of 15 minute measurements, returns the station and metric ids"""
+        stations = self.context.get_stations_for_test(1, self.session)
+        metrics = self.context.get_metrics_for_test(1)
+        self.session.add_all(stations + metrics)
+        self.session.commit()
+
+        day = datetime.datetime(2010, 5, 1)
+        station_id, metric_id = stations[0].station_id, metrics[0].metric_id
+        self.repo.put_measurements_from_list([
+            (station_id, metric_id, day + datetime.timedelta(minutes=15*i), 1.)
+            for i in range(4*48)
+        ], upsert=True)
+
+        return station_id, metric_id
+
+    def test_clear_measurements_dry_run(self):
+        """test a dry run reports the measurements before the cut-off without removing them"""
+        # setup
+        self.put_measurements_for_retention_test()
+
+        # run
+        report = self.repo.clear_measurements(datetime.datetime(2010, 5, 2, 12), dry_run=True)
+
+        # assert
+        self.assertEqual(report['cutoff'], datetime.datetime(2010, 5, 2))
+        self.assertEqual(report['rows'], 4*24)
+        self.assertEqual(self.session.query(Measurement).count(), 4*48)
+
+    def test_clear_measurements_keeps_daily_rollup(self):
+        """test removed measurements are archived and their daily rollup kept"""
+        # setup
+        self.put_measurements_for_retention_test()
+
+        # run
+        self.repo.clear_measurements(datetime.datetime(2010, 5, 2), archive_file=self.context.measurements_file_name)
+
+        # assert
+        self.assertEqual(self.session.query(Measurement).count(), 4*24)
+        rollup = self.session.query(DailyMeasurement).order_by(DailyMeasurement.day).all()
+        self.assertEqual([r.value_count for r in rollup], [4*24, 4*24])
+        with open(self.context.measurements_file_name, "r") as f:
+            self.assertEqual(len(f.readlines()), 4*24)
+
+        # tear down
+        self.context.remove_measurements_file_for_test()
+
+    def test_clear_measurements_hourly_is_repeatable(self):
+        """test hourly downsampling keeps hourly means and leaves them alone on the next run"""
+        # setup
+        self.put_measurements_for_retention_test()
+        self.repo.clear_measurements(datetime.datetime(2010, 5, 2), resolution='hour')
+
+        # run
+        report = self.repo.clear_measurements(datetime.datetime(2010, 5, 2), resolution='hour')
+
+        # assert
+        self.assertEqual(report['rows'], 0)
+        self.assertEqual(self.session.query(Measurement).count(), 24 + 4*24)
+        rollup = self.session.query(DailyMeasurement).order_by(DailyMeasurement.day).first()
+        self.assertEqual(rollup.value_count, 4*24)
+
+    def test_clear_measurements_keeps_rollup_of_retained_days_final(self):
+        """test measurements before the cut-off are refused and a rebuild keeps the rollup of retained days"""
+        # setup
+        station_id, metric_id = self.put_measurements_for_retention_test()
+        self.repo.clear_measurements(datetime.datetime(2010, 5, 2), resolution='hour')
+
+        # assert
+        with self.assertRaises(ValueError):
+            self.repo.put_measurements_from_list([(station_id, metric_id, datetime.datetime(2010, 5, 1, 0, 5), 9.)],
+                                                 upsert=True)
+        self.assertEqual(self.session.query(Measurement).count(), 24 + 4*24)
+
+        self.assertEqual(self.repo.put_daily_measurements(), 1)
+        rollup = self.session.query(DailyMeasurement).order_by(DailyMeasurement.day).all()
+        self.assertEqual([r.value_count for r in rollup], [4*24, 4*24])
+
+        # days after the cut-off are still written
+        self.repo.put_measurements_from_list([(station_id, metric_id, datetime.datetime(2010, 5, 2, 0, 5), 9.)],
+                                             upsert=True)
+        self.assertEqual(self.session.query(Measurement).count(), 24 + 4*24 + 1)
+
+    def test_get_measurements_for_runs_shares_stations(self):
+        """test get_measurements_for_runs returns each run's view of shared stations"""
+        # setup
+        now = datetime.datetime.now()
+
+        addresses = self.session.query(Address).limit(2)
+        stations = [
+            Station(
+                station_id=str(i),
+                latitude=addresses[i].latitude,
+                longitude=addresses[i].longitude,
+                source=self.context.weather_sources[i]
+            )
+            for i in range(2)
+        ]
+
+        runs = [
+            RiverRun(
+                run_id=i,
+                put_in_latitude=addresses[0].latitude,
+                put_in_longitude=addresses[0].longitude,
+                take_out_latitude=addresses[1].latitude,
+                take_out_longitude=addresses[1].longitude
+            )
+            for i in range(1, 3)
+        ]
+
+        # both runs share the NOAA station, only run 2 references the USGS station
+        strds = [
+            StationRiverDistance(station_id=stations[0].station_id, run_id=1, distance=1.),
+            StationRiverDistance(station_id=stations[0].station_id, run_id=2, distance=1.),
+            StationRiverDistance(station_id=stations[1].station_id, run_id=2, distance=2.)
+        ]
+
+        metric = Metric(metric_id=1)
+
+        self.session.add_all(stations + runs)
+        self.session.add_all(strds)
+        self.session.add(metric)
+
+        measurements = []
+        for i in range(10):
+            measurements.append(
+                Measurement(
+                    station_id=stations[i % 2].station_id,
+                    metric_id=metric.metric_id,
+                    date_time=now - datetime.timedelta(days=15, seconds=5*i)
+                )
+            )
+
+        [self.session.merge(m) for m in measurements]
+        self.session.commit()
+
+        # assert
+        measurements = self.repo.get_measurements_for_runs(run_ids=[1, 2])
+        self.assertEqual(len(measurements[1]), 5)
+        self.assertEqual(len(measurements[2]), 10)
+        self.assertEqual(set(measurements[1].station_id.values), {'0'})
+
+    def test_get_measurements_cached_sees_upserts(self):
+        """test a cached read fetches days overwritten since the previous read"""
+        # setup
+        stations = self.context.get_stations_for_test(1, self.session)
+        metrics = self.context.get_metrics_for_test(1)
+        run = RiverRun(run_id=1, put_in_latitude=0., put_in_longitude=0., take_out_latitude=0., take_out_longitude=0.)
+        self.session.add_all(stations + metrics + [run])
+        self.session.add(StationRiverDistance(station_id=stations[0].station_id, run_id=1, distance=1.))
+        self.session.commit()
+
+        station_id, metric_id = stations[0].station_id, metrics[0].metric_id
+        day = datetime.datetime.now() - datetime.timedelta(days=20)
+        repo = Repository(session=self.session, cached=True)
+        repo.put_measurements_from_list([
+            (station_id, metric_id, day + datetime.timedelta(hours=i), 1.) for i in range(4)
+        ], upsert=True)
+        start_date = day - datetime.timedelta(days=1)
+
+        # run
+        before = repo.get_measurements(1, start_date=start_date)
+        repo.put_measurements_from_list([(station_id, metric_id, day, 2.)], upsert=True)
+        after = repo.get_measurements(1, start_date=start_date)
+
+        # assert
+        self.assertEqual(len(before), 4)
+        self.assertEqual(len(after), 4)
+        self.assertAlmostEqual(after.value.sum(), 5.)
+
+    def test_put_measurements_advances_ingest_watermark(self):
+        """test the watermark follows the latest measurement put and never moves back"""
+        # setup
+        stations = self.context.get_stations_for_test(1, self.session)
+        metrics = self.context.get_metrics_for_test(1)
+        self.session.add_all(stations + metrics)
+        self.session.commit()
+
+        station_id, metric_id = stations[0].station_id, metrics[0].metric_id
+        day = datetime.datetime(2018, 1, 10)
+
+        # run
+        self.repo.put_measurements_from_list([
+            (station_id, metric_id, day + datetime.timedelta(hours=i), 1.) for i in range(4)
+        ], upsert=True)
+        first = self.repo.get_ingest_watermarks()
+        self.repo.put_measurements_from_list([(station_id, metric_id, day - datetime.timedelta(days=5), 2.)],
+                                             upsert=True)
+        second = self.repo.get_ingest_watermarks(metric_ids=[metric_id])
+
+        # assert
+        self.assertEqual(len(first), 1)
+        self.assertEqual(first.date_time[0], day + datetime.timedelta(hours=3))
+        self.assertEqual(second.date_time[0], first.date_time[0])
+        self.assertEqual(len(self.repo.get_ingest_watermarks(metric_ids=['none'])), 0)
+
+        # rebuilding from the measurements gives the same watermark
+        self.assertEqual(self.repo.put_ingest_watermarks(), 1)
+        self.assertEqual(self.repo.get_ingest_watermarks().date_time[0], first.date_time[0])
+
+        # the bootstrap only builds missing watermarks
+        self.assertEqual(self.repo.put_ingest_watermarks(if_empty=True), 0)
+        self.session.query(context.IngestWatermark).delete()
+        self.session.commit()
+        self.assertEqual(self.repo.put_ingest_watermarks(if_empty=True), 1)
+
+    def test_get_measurements_for_runs_throws_if_any_run_id_does_not_exist(self):
+        """test get_measurements_for_runs validates every run id"""
+        # setup
+        runs = self.context.get_runs_for_test(1, self.session)
+        self.session.add_all(runs)
+        self.session.commit()
+
+        # assert
+        self.assertRaises(ValueError, self.repo.get_measurements_for_runs,
+                          run_ids=[runs[0].run_id, runs[0].run_id + 1])
+
+    def test_get_measurements_uses_closest_station_of_each_source(self):
+        """test only the closest station of each source is referenced"""
+        # setup
+        now = datetime.datetime.now()
+
+        address = self.session.query(Address).first()
+        stations = [
+            Station(
+                station_id=str(i),
+                latitude=address.latitude,
+                longitude=address.longitude,
+                source='NOAA'
+            )
+            for i in range(2)
+        ]
+
+        run = RiverRun(
+            run_id=1,
+            put_in_latitude=address.latitude,
+            put_in_longitude=address.longitude,
+            take_out_latitude=address.latitude,
+            take_out_longitude=address.longitude
+        )
+
+        metric = Metric(metric_id=1)
+
+        self.session.add_all(stations + [run, metric])
+        self.session.commit()
+
+        self.repo.put_station_river_distances([
+            StationRiverDistance(station_id='0', run_id=run.run_id, distance=2.),
+            StationRiverDistance(station_id='1', run_id=run.run_id, distance=1.)
+        ])
+
+        [self.session.merge(Measurement(
+            station_id=s.station_id,
+            metric_id=metric.metric_id,
+            date_time=now - datetime.timedelta(days=5)
+        )) for s in stations]
+        self.session.commit()
+
+        # assert
+        measurements = self.repo.get_measurements(run_id=run.run_id)
+        self.assertEqual(list(measurements.station_id.values), ['1'])
+
+        # moving the closer station away invalidates the cached selection
+        strd = self.session.query(StationRiverDistance).filter(StationRiverDistance.station_id == '1').one()
+        strd.distance = 3.
+        self.repo.put_station_river_distances([strd])
+
+        measurements = self.repo.get_measurements(run_id=run.run_id)
+        self.assertEqual(list(measurements.station_id.values), ['0'])
+
+    def test_iter_measurements_yields_chunks_in_time_order(self):
+        """test iter_measurements streams fixed size chunks ordered by time"""
+        # setup
+        now = datetime.datetime.now()
+
+        address = self.session.query(Address).first()
+        station = Station(
+            station_id='1',
+            latitude=address.latitude,
+            longitude=address.longitude,
+            source='NOAA'
+        )
+
+        run = RiverRun(
+            run_id=1,
+            put_in_latitude=address.latitude,
+            put_in_longitude=address.longitude,
+            take_out_latitude=address.latitude,
+            take_out_longitude=address.longitude
+        )
+
+        strd = StationRiverDistance(station_id=station.station_id, run_id=run.run_id, distance=1.)
+        metric = Metric(metric_id=1)
+
+        self.session.add_all([station, run, strd, metric])
+
+        [self.session.merge(Measurement(
+            station_id=station.station_id,
+            metric_id=metric.metric_id,
+            date_time=now - datetime.timedelta(days=5, seconds=5*i)
+        )) for i in range(10)]
+        self.session.commit()
+
+        # assert
+        chunks = list(self.repo.iter_measurements(run_id=run.run_id, chunk_size=3))
+        self.assertEqual([len(c) for c in chunks], [3, 3, 3, 1])
+
+        date_times = [d for c in chunks for d in c.date_time]
+        self.assertEqual(date_times, sorted(date_times))
+
+    def test_iter_measurements_validates_before_iterating(self):
+        """test iter_measurements raises for an invalid run without being iterated"""
+        # assert
+        self.assertRaises(ValueError, self.repo.iter_measurements, run_id=-1)
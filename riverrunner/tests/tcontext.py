@@ -2,6 +2,8 @@ import datetime
 import numpy as np
 import os
 from riverrunner import context
+from riverrunner.measurement_cache import MEASUREMENT_CACHE
+from riverrunner.repository import Repository
 from riverrunner import settings
 import time
 
@@ -49,8 +51,16 @@ class TContext(context.Context):
             None
         """
         entities = [
+            context.ModelOrder,
+            context.ModelParameters,
             context.Prediction,
             context.StationRiverDistance,
+            context.DailyMeasurement,
+            context.IngestWatermark,
+            context.MeasurementRetention,
+            context.CompactMeasurement,
+            context.StationKey,
+            context.MetricKey,
             context.Measurement,
             context.Metric,
             context.Station,
@@ -61,6 +71,9 @@ class TContext(context.Context):
             session.query(entity).delete()
         session.commit()
 
+        Repository.clear_station_cache()
+        MEASUREMENT_CACHE.clear()
+
     def generate_addresses(self, session):
         """generate a random set of addresses
 